@@ -0,0 +1,86 @@
+# Schema and connection setup run once per process before it serves requests or consumes messages.
+# Every step is idempotent so api workers and consumers can start in any order.
+import logging
+
+from app.sensors import repository
+
+logger = logging.getLogger(__name__)
+
+CASSANDRA_KEYSPACE = "sensor"
+
+CASSANDRA_SCHEMA = [
+    """
+    CREATE KEYSPACE IF NOT EXISTS sensor
+    WITH replication = {'class': 'SimpleStrategy', 'replication_factor' : 3};
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sensor.sensor_data ( id uuid PRIMARY KEY, sensor_id INT, data TEXT, last_seen TEXT, type_sensor TEXT);
+    """,
+    # readings of one sensor and day live in a single partition, newest first
+    """
+    CREATE TABLE IF NOT EXISTS sensor.sensor_readings ( sensor_id INT, day_bucket DATE, last_seen TIMESTAMP, velocity DOUBLE, temperature DOUBLE, humidity DOUBLE, battery_level DOUBLE, type_sensor TEXT, PRIMARY KEY ((sensor_id, day_bucket), last_seen)) WITH CLUSTERING ORDER BY (last_seen DESC);
+    """,
+    # the same readings grouped by sensor type and day, spread over shards so a large fleet does not fill one partition a day,
+    # sensor_reading_days lists the partitions of each type
+    """
+    CREATE TABLE IF NOT EXISTS sensor.sensor_readings_by_type ( type_sensor TEXT, day_bucket DATE, shard INT, sensor_id INT, last_seen TIMESTAMP, velocity DOUBLE, temperature DOUBLE, humidity DOUBLE, battery_level DOUBLE, PRIMARY KEY ((type_sensor, day_bucket, shard), sensor_id, last_seen));
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sensor.sensor_reading_days ( type_sensor TEXT, day_bucket DATE, shard INT, PRIMARY KEY (type_sensor, day_bucket, shard));
+    """,
+]
+
+# statements used on the ingest path, prepared before the first reading arrives
+CASSANDRA_STATEMENTS = [
+    repository.CASSANDRA_INSERT_READING,
+    repository.CASSANDRA_INSERT_READING_BY_TYPE,
+    repository.CASSANDRA_INSERT_READING_DAY,
+]
+
+# the schema is owned by the migrations_time yoyo migrations, the table is only created for databases that never ran them
+TIMESCALE_SCHEMA = "CREATE TABLE IF NOT EXISTS sensor_data ( id SERIAL PRIMARY KEY, sensor_id INT NOT NULL, data JSONB, last_seen TIMESTAMPTZ NOT NULL);"
+
+
+def bootstrap_cassandra(cassandra_client):
+    for statement in CASSANDRA_SCHEMA:
+        cassandra_client.execute(statement)
+    cassandra_client.set_keyspace(CASSANDRA_KEYSPACE)
+    for statement in CASSANDRA_STATEMENTS:
+        cassandra_client.prepare(statement)
+
+
+def bootstrap_timescale(timescale_pool):
+    # also opens the first pooled connection
+    timescale = timescale_pool.get()
+    try:
+        timescale.execute(TIMESCALE_SCHEMA)
+        timescale.conn.commit()
+    finally:
+        timescale.close()
+
+
+def bootstrap_redis(redis_client):
+    redis_client.ping()
+
+
+def bootstrap_mongodb(mongodb_client):
+    mongodb_client.ping()
+    mongodb_client.getDatabase("sensors")
+    mongodb_client.getCollection("sensorsCol")
+    mongodb_client.createIndex([("type", 1)])
+    mongodb_client.createIndex([("location", "2dsphere")])
+
+
+def bootstrap_elasticsearch(elastic_client):
+    # also true when the index is an alias created by app.commands.reindex
+    if not elastic_client.index_exists(repository.SENSORS_INDEX):
+        elastic_client.create_index(repository.SENSORS_INDEX, mappings=repository.SENSORS_MAPPING)
+
+
+def bootstrap(resources):
+    bootstrap_redis(resources.redis)
+    bootstrap_mongodb(resources.mongodb)
+    bootstrap_elasticsearch(resources.elastic)
+    bootstrap_timescale(resources.timescale)
+    bootstrap_cassandra(resources.cassandra)
+    logger.info("Schemas ready")
@@ -1,31 +1,96 @@
+import threading
+import time
+
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
+
+from app.metrics import instrumented, observe_backend
+from app.slow_queries import redact_statement, slow_queries
 
 class CassandraClient:
     def __init__(self, hosts):
         self.cluster = Cluster(hosts,protocol_version=4)
         self.session = self.cluster.connect()
-        self.session.execute("""
-            CREATE KEYSPACE IF NOT EXISTS sensor
-            WITH replication = {'class': 'SimpleStrategy', 'replication_factor' : 3};
-            """)
-        # self.session.execute("""
-        #                     CREATE KEYSPACE IF NOT EXISTS sensor
-        #                     WITH replication = {'class': 'SimpleStrategy', 'replication_factor' : 3};
-        #                     """)
-        
-        self.session.set_keyspace('sensor')
-        self.session.execute("""
-        CREATE TABLE IF NOT EXISTS sensor_data ( id uuid PRIMARY KEY, sensor_id INT, data TEXT, last_seen TEXT, type_sensor TEXT);
-        """)
+        # keyspace and tables are created by app.bootstrap, which then binds the session to the keyspace
+        # Prepared statements keyed by their query text
+        self._statements = {}
+        self._statements_lock = threading.Lock()
 
     def get_session(self):
         return self.session
 
     def get_session_keyspace(self):
-        return self.cluster.connect('sensor')
+        # The session is already bound to the sensor keyspace, opening a new one per call is expensive
+        return self.session
+
+    def set_keyspace(self, keyspace):
+        self.session.set_keyspace(keyspace)
 
     def close(self):
         self.cluster.shutdown()
 
-    def execute(self, query):
-        return self.get_session().execute(query)
+    def prepare(self, query):
+        statement = self._statements.get(query)
+        if statement is None:
+            with self._statements_lock:
+                statement = self._statements.get(query)
+                if statement is None:
+                    statement = self._prepare(query)
+                    self._statements[query] = statement
+        return statement
+
+    @instrumented("cassandra", "prepare")
+    def _prepare(self, query):
+        return self.session.prepare(query)
+
+    @instrumented("cassandra")
+    def execute(self, query, parameters=None):
+        start = time.perf_counter()
+        if parameters is None:
+            result = self.get_session().execute(query)
+        else:
+            result = self.session.execute(self.prepare(query), parameters)
+        # rows of the first page, the driver fetches the next ones while iterating
+        slow_queries.check("cassandra", "execute", query, time.perf_counter() - start, len(result.current_rows))
+        return result
+
+    def execute_async(self, query, parameters=None):
+        # Returns a ResponseFuture, call result() on it to wait for the rows
+        statement = query if parameters is None else self.prepare(query)
+        start = time.perf_counter()
+        future = self.session.execute_async(statement, parameters)
+        # timed until the driver has the response
+        future.add_callbacks(lambda rows: self._async_done(query, start, rows),
+                             lambda _: observe_backend("cassandra", "execute_async", time.perf_counter() - start, failed=True))
+        return future
+
+    def _async_done(self, query, start, rows):
+        elapsed = time.perf_counter() - start
+        observe_backend("cassandra", "execute_async", elapsed)
+        slow_queries.check("cassandra", "execute_async", query, elapsed, len(rows) if rows is not None else None)
+
+    @instrumented("cassandra")
+    def execute_concurrent(self, query, parameters, concurrency=100):
+        # Run the same statement for every parameter list, keeping up to `concurrency` requests in flight
+        start = time.perf_counter()
+        results = execute_concurrent_with_args(self.session, self.prepare(query), parameters, concurrency=concurrency)
+        slow_queries.check("cassandra", "execute_concurrent", query, time.perf_counter() - start, _rows(results))
+        return results
+
+    @instrumented("cassandra")
+    def execute_concurrent_statements(self, statements, concurrency=100):
+        # statements is a list of (query, parameters) pairs, possibly of different queries
+        start = time.perf_counter()
+        results = execute_concurrent(self.session, [(self.prepare(query), parameters) for query, parameters in statements], concurrency=concurrency)
+        slow_queries.check("cassandra", "execute_concurrent_statements", statements, time.perf_counter() - start, _rows(results),
+                           redact=_redact_statements)
+        return results
+
+
+def _redact_statements(statements):
+    return "; ".join(redact_statement(query) for query in dict.fromkeys(query for query, _ in statements))
+
+
+def _rows(results):
+    # rows of the first page of every successful statement of an execute_concurrent call
+    return sum(len(result.current_rows) for success, result in results if success)
@@ -0,0 +1,53 @@
+# Copy the readings of the old JSON sensor_data table into the typed reading tables.
+# Usage: python -m app.commands.cassandra_backfill [--hosts cassandra] [--batch-size 500]
+import argparse
+import json
+
+from cassandra.query import SimpleStatement
+
+from app.bootstrap import bootstrap_cassandra
+from app.cassandra_client import CassandraClient
+from app.sensors import repository
+
+
+def backfill(cassandra_client: CassandraClient, batch_size: int = 500):
+    # the old table is read page by page so memory stays bounded by batch_size
+    statement = SimpleStatement("SELECT sensor_id, data, last_seen, type_sensor FROM sensor.sensor_data;", fetch_size=batch_size)
+    copied = 0
+    skipped = 0
+    rows = []
+    for row in cassandra_client.execute(statement):
+        try:
+            repository.parse_last_seen(row.last_seen)
+            rows.append((row.sensor_id, json.loads(row.data), row.last_seen, row.type_sensor))
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        if len(rows) >= batch_size:
+            repository.write_cassandra_readings(cassandra_client, rows)
+            copied += len(rows)
+            rows = []
+            print(f"Copied {copied} readings")
+    if rows:
+        repository.write_cassandra_readings(cassandra_client, rows)
+        copied += len(rows)
+    return copied, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the typed cassandra reading tables from sensor_data")
+    parser.add_argument("--hosts", nargs="+", default=["cassandra"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    cassandra_client = CassandraClient(hosts=args.hosts)
+    bootstrap_cassandra(cassandra_client)
+    try:
+        copied, skipped = backfill(cassandra_client, args.batch_size)
+        print(f"Copied {copied} readings, skipped {skipped} unreadable rows")
+    finally:
+        cassandra_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Recompute the running sensor statistics kept in redis from the cassandra reading history.
+# Readings ingested while the command runs can be counted twice or missed, run it on a quiet system.
+# Usage: python -m app.commands.rebuild_stats [--redis-host redis] [--cassandra-hosts cassandra]
+import argparse
+
+from app.bootstrap import bootstrap_cassandra
+from app.cassandra_client import CassandraClient
+from app.redis_client import RedisClient
+from app.sensors import repository
+
+
+def rebuild(redis_client: RedisClient, cassandra_client: CassandraClient):
+    stats = {}
+    members = {}
+    types = {row.type_sensor for row in cassandra_client.execute("SELECT DISTINCT type_sensor FROM sensor.sensor_reading_days;")}
+    for type_sensor in types:
+        for reading in repository.get_readings_by_type(cassandra_client, type_sensor, "sensor_id, " + ", ".join(repository.METRICS)):
+            members.setdefault(type_sensor, set()).add(reading.sensor_id)
+            sensor_stats = stats.setdefault(reading.sensor_id, {})
+            for metric in repository.METRICS:
+                value = getattr(reading, metric)
+                if value is None:
+                    continue
+                if metric in sensor_stats:
+                    count, total, minimum, maximum = sensor_stats[metric]
+                    sensor_stats[metric] = (count + 1, total + value, min(minimum, value), max(maximum, value))
+                else:
+                    sensor_stats[metric] = (1, value, value, value)
+
+    pipe = redis_client.pipeline()
+    for key in redis_client.keys("stats-*"):
+        pipe.delete(key)
+    for sensor_id, sensor_stats in stats.items():
+        mapping = {}
+        for metric, (count, total, minimum, maximum) in sensor_stats.items():
+            mapping.update({f"{metric}:count": count, f"{metric}:sum": repr(total), f"{metric}:min": repr(minimum), f"{metric}:max": repr(maximum)})
+        if mapping:
+            pipe.hset(repository.stats_key(sensor_id), mapping)
+    for type_sensor, sensor_ids in members.items():
+        pipe.sadd(repository.stats_sensors_key(type_sensor), *sensor_ids)
+    pipe.execute()
+    return len(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the running sensor statistics from cassandra")
+    parser.add_argument("--redis-host", default="redis")
+    parser.add_argument("--cassandra-hosts", nargs="+", default=["cassandra"])
+    args = parser.parse_args()
+
+    redis_client = RedisClient(host=args.redis_host)
+    cassandra_client = CassandraClient(hosts=args.cassandra_hosts)
+    bootstrap_cassandra(cassandra_client)
+    try:
+        print(f"Rebuilt statistics of {rebuild(redis_client, cassandra_client)} sensors")
+    finally:
+        cassandra_client.close()
+        redis_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Rebuild the sensors search index from the mongodb sensor documents.
+# The documents are bulk loaded into a new index which then replaces the old one behind the sensors alias
+# in a single atomic alias update, searches never see a missing or half filled index.
+# Sensors created or deleted while the command runs may be missing from, or left in, the new index.
+# Usage: python -m app.commands.reindex [--mongodb-host mongodb] [--elasticsearch-host elasticsearch] [--chunk-size 1000] [--keep-old]
+import argparse
+import time
+
+from app.elasticsearch_client import ElasticsearchClient
+from app.mongodb_client import MongoDBClient
+from app.sensors import repository
+
+
+def reindex(mongodb_client: MongoDBClient, elastic_client: ElasticsearchClient, chunk_size: int = 1000, keep_old: bool = False):
+    alias = repository.SENSORS_INDEX
+    index_name = f"{alias}-{time.strftime('%Y%m%d%H%M%S')}"
+
+    # no refreshes or replicas while loading, they are restored before the index goes live
+    elastic_client.create_index(index_name, mappings=repository.SENSORS_MAPPING,
+                                settings={"refresh_interval": "-1", "number_of_replicas": 0})
+
+    mongodb_client.getDatabase("sensors")
+    mongodb_client.getCollection("sensorsCol")
+    projection = {"_id": 0, "sensor_id": 1, "name": 1, "type": 1, "description": 1}
+    documents = (repository.sensor_document(doc) for doc in mongodb_client.findAllDocuments({}, projection))
+    indexed = elastic_client.bulk_index(index_name, documents, chunk_size=chunk_size)
+
+    elastic_client.put_settings(index_name, {"refresh_interval": None, "number_of_replicas": None})
+    elastic_client.refresh(index_name)
+
+    old_indices = elastic_client.get_alias_indices(alias)
+    actions = [{"remove": {"index": old, "alias": alias}} for old in old_indices]
+    if not old_indices and elastic_client.index_exists(alias):
+        # the index created by the api before the first reindex has the name the alias needs
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index_name, "alias": alias}})
+    elastic_client.update_aliases(actions)
+
+    if not keep_old:
+        for old in old_indices:
+            elastic_client.clearIndex(old)
+    return index_name, indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the sensors elasticsearch index from mongodb")
+    parser.add_argument("--mongodb-host", default="mongodb")
+    parser.add_argument("--elasticsearch-host", default="elasticsearch")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--keep-old", action="store_true", help="keep the indices previously behind the alias")
+    args = parser.parse_args()
+
+    mongodb_client = MongoDBClient(host=args.mongodb_host)
+    elastic_client = ElasticsearchClient(host=args.elasticsearch_host)
+    try:
+        index_name, indexed = reindex(mongodb_client, elastic_client, args.chunk_size, args.keep_old)
+        print(f"Indexed {indexed} sensors into {index_name}")
+    finally:
+        elastic_client.close()
+        mongodb_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,32 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, NotFoundError, helpers
 import time
 
+from app.metrics import instrumented
+
 class ElasticsearchClient:
-    def __init__(self, host="localhost", port="9200"):
+    def __init__(self, host="localhost", port="9200", wait_timeout=None):
+        # waits for elasticsearch to answer, forever unless wait_timeout seconds are given
         self.host = host
         self.port = port
         self.client = Elasticsearch(["http://"+self.host+":"+self.port])
 
+        deadline = None if wait_timeout is None else time.monotonic() + wait_timeout
         while not self.ping():
+            if deadline is not None and time.monotonic() >= deadline:
+                self.client.close()
+                raise ConnectionError(f"Elasticsearch at {self.host}:{self.port} is not available")
             print("Waiting for Elasticsearch to start...")
             time.sleep(1)
 
+    @instrumented("elasticsearch")
     def ping(self):
         return self.client.ping()
     
+    @instrumented("elasticsearch", "clear_index")
     def clearIndex(self, index_name):
+        if self.client.indices.exists_alias(name=index_name):
+            # Delete the indices behind the alias, the alias goes with them
+            return self.client.indices.delete(index=self.get_alias_indices(index_name))
         if self.client.indices.exists(index=index_name):
             # If the index exists, delete it
             return self.client.indices.delete(index=index_name)
@@ -25,22 +37,63 @@ class ElasticsearchClient:
     def close(self):
         self.client.close()
 
+    @instrumented("elasticsearch")
     def index_exists(self, index_name):
         return self.client.indices.exists(index=index_name)
 
-    def create_index(self, index_name):
-        return self.client.indices.create(index=index_name)
+    @instrumented("elasticsearch")
+    def create_index(self, index_name, mappings=None, settings=None):
+        return self.client.indices.create(index=index_name, mappings=mappings, settings=settings)
     
+    @instrumented("elasticsearch")
     def create_mapping(self, index_name, mapping):
         return self.client.indices.put_mapping(index=index_name, body=mapping)
     
-    def search(self, index_name, query):
-        return self.client.search(index=index_name, body=query)
-    
-    def index_document(self, index_name, document):
-        return self.client.index(index=index_name, body=document)
+    @instrumented("elasticsearch")
+    def search(self, index_name, query, size=None, from_=None, source=None):
+        # size, from_ and source (the _source fields to return) are added to the query body
+        body = dict(query)
+        if size is not None:
+            body["size"] = size
+        if from_ is not None:
+            body["from"] = from_
+        if source is not None:
+            body["_source"] = source
+        return self.client.search(index=index_name, body=body)
     
+    @instrumented("elasticsearch")
+    def index_document(self, index_name, document, id=None):
+        return self.client.index(index=index_name, id=id, body=document)
 
-    
-    
-    
+    @instrumented("elasticsearch")
+    def delete_document(self, index_name, id):
+        try:
+            return self.client.delete(index=index_name, id=id)
+        except NotFoundError:
+            return None
+
+    @instrumented("elasticsearch")
+    def bulk_index(self, index_name, documents, id_field="id", chunk_size=500, refresh=False):
+        # documents can be any iterable, they are sent in chunks of chunk_size through the _bulk api
+        actions = ({"_index": index_name, "_id": document[id_field], "_source": document} for document in documents)
+        indexed, _ = helpers.bulk(self.client, actions, chunk_size=chunk_size, refresh=refresh)
+        return indexed
+
+    @instrumented("elasticsearch")
+    def refresh(self, index_name):
+        return self.client.indices.refresh(index=index_name)
+
+    @instrumented("elasticsearch")
+    def put_settings(self, index_name, settings):
+        return self.client.indices.put_settings(index=index_name, settings=settings)
+
+    @instrumented("elasticsearch")
+    def get_alias_indices(self, alias):
+        if not self.client.indices.exists_alias(name=alias):
+            return []
+        return list(self.client.indices.get_alias(name=alias).keys())
+
+    @instrumented("elasticsearch")
+    def update_aliases(self, actions):
+        # every action is applied atomically
+        return self.client.indices.update_aliases(actions=actions)
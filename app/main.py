@@ -1,11 +1,17 @@
 import fastapi
+from fastapi.responses import PlainTextResponse
+from . import metrics
+from .sensors.cache import metadata_cache
+from .slow_queries import slow_queries
 from .sensors.controller import router as sensorsRouter
+from .resources import resources
 from yoyo import read_migrations, get_backend
 import os
 
 app = fastapi.FastAPI(title="Senser", version="0.1.0-alpha.1")
 
 app.include_router(sensorsRouter)
+app.add_middleware(metrics.RequestTimingMiddleware)
 
 # from app.cassandra_client import CassandraClient
 
@@ -29,8 +35,49 @@ app.include_router(sensorsRouter)
 #         backend.apply_migrations(migrations_to_apply)
 
 
+@app.on_event("startup")
+def open_resources():
+    resources.open()
+
+
+@app.on_event("shutdown")
+def close_resources():
+    resources.close()
+
+
 @app.get("/")
 def index():
     #Return the api name and version
     return {"name": app.title, "version": app.version}
 
+
+
+@metrics.collector
+def cache_and_buffer_metrics():
+    cache = metadata_cache.stats()
+    samples = [
+        ("senser_metadata_cache_hits_total", "counter", "Sensor metadata cache hits.", cache["hits"]),
+        ("senser_metadata_cache_misses_total", "counter", "Sensor metadata cache misses.", cache["misses"]),
+        ("senser_metadata_cache_size", "gauge", "Sensors in the metadata cache.", cache["size"]),
+    ]
+    if resources.ingest_buffer is not None:
+        samples.append(("senser_ingest_buffer_pending", "gauge", "Readings waiting to be written to the history stores.", resources.ingest_buffer.pending()))
+    return samples
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/slow_queries")
+def get_slow_queries():
+    # Backend operations slower than SLOW_QUERY_MS, newest first
+    return {"threshold_ms": slow_queries.threshold_ms, "entries": slow_queries.entries()}
+
+
+@app.delete("/admin/slow_queries")
+def clear_slow_queries():
+    slow_queries.clear()
+    return {"detail": "Slow query log cleared"}
@@ -0,0 +1,209 @@
+# Latency histograms of the API endpoints and of every backend call, rendered in the Prometheus text format by /metrics.
+# Backend calls are timed inside the client wrappers with @instrumented, requests by RequestTimingMiddleware.
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+# seconds, from a redis round trip to a slow aggregation
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        # labels is a tuple of values in the order of labelnames
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per bucket counts, then count and sum
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += seconds
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(buckets), count, total]) for labels, (buckets, count, total) in self._series.items())
+        for labels, (buckets, count, total) in series:
+            cumulative = 0
+            for bound, observations in zip(self.buckets, buckets):
+                cumulative += observations
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+REQUEST_DURATION = Histogram("senser_http_request_duration_seconds", "Time to answer an API request.", ("method", "endpoint", "status"))
+BACKEND_DURATION = Histogram("senser_backend_operation_duration_seconds", "Time of a call to a backend store.", ("backend", "operation"))
+BACKEND_ERRORS = Counter("senser_backend_operation_errors_total", "Backend calls that raised.", ("backend", "operation"))
+
+METRICS = [REQUEST_DURATION, BACKEND_DURATION, BACKEND_ERRORS]
+
+# functions returning (name, type, documentation, value) samples read when /metrics is scraped
+_collectors = []
+
+
+def collector(function):
+    _collectors.append(function)
+    return function
+
+
+def observe_backend(backend, operation, seconds, failed=False):
+    BACKEND_DURATION.observe((backend, operation), seconds)
+    if failed:
+        BACKEND_ERRORS.inc((backend, operation))
+
+
+def instrumented(backend, operation=None):
+    # Times every call of the decorated client method as backend/operation, the method name by default
+    def decorator(function):
+        name = operation or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                observe_backend(backend, name, time.perf_counter() - start, failed)
+        return wrapper
+    return decorator
+
+
+def timed_iter(backend, operation, iterable, start=None, on_done=None):
+    # Lazy cursors only talk to the server while they are iterated, the time spent creating and iterating
+    # them is observed once they are exhausted or dropped. on_done(seconds, items) is then called on success.
+    elapsed = 0.0 if start is None else time.perf_counter() - start
+    failed = False
+    items = 0
+    iterator = iter(iterable)
+    try:
+        while True:
+            resumed = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - resumed
+                return
+            except Exception:
+                elapsed += time.perf_counter() - resumed
+                failed = True
+                raise
+            elapsed += time.perf_counter() - resumed
+            items += 1
+            yield item
+    finally:
+        observe_backend(backend, operation, elapsed, failed)
+        if on_done is not None and not failed:
+            on_done(elapsed, items)
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for function in _collectors:
+        for name, kind, documentation, value in function():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {_number(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+class RequestTimingMiddleware:
+    # ASGI middleware timing every HTTP request, labelled by the route template so /sensors/1 and /sensors/2 add up.
+    # Paths matching no route are reported as "unmatched".
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_DURATION.observe((scope["method"], self._endpoint(scope), str(status)), time.perf_counter() - start)
+
+    def _endpoint(self, scope):
+        # the router leaves the matched endpoint in the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            path = "unmatched"
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._paths[endpoint] = path
+        return path
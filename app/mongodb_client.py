@@ -1,5 +1,11 @@
+import json
+import time
+
 from pymongo import MongoClient
 
+from app.metrics import instrumented, timed_iter
+from app.slow_queries import describe_filter, redact_filter, slow_queries
+
 class MongoDBClient:
     def __init__(self, host="localhost", port=27017):
         self.host = host
@@ -11,6 +17,7 @@ class MongoDBClient:
     def close(self):
         self.client.close()
     
+    @instrumented("mongodb")
     def ping(self):
         return self.client.db_name.command('ping')
     
@@ -22,18 +29,41 @@ class MongoDBClient:
         self.collection = self.database[collection]
         return self.collection
     
+    @instrumented("mongodb", "drop_database")
     def clearDb(self,database):
         self.client.drop_database(database)
 
+    @instrumented("mongodb", "insert_one")
     def insertOne(self, doc):
         return self.collection.insert_one(doc)
 
+    @instrumented("mongodb", "find_one")
     def findOne(self, query={}):
-        return self.collection.find_one(query)
+        start = time.perf_counter()
+        doc = self.collection.find_one(query)
+        slow_queries.check("mongodb", "find_one", query, time.perf_counter() - start, int(doc is not None), redact=describe_filter)
+        return doc
 
+    @instrumented("mongodb", "delete_one")
     def deleteOne(self, query={}):
         return self.collection.delete_one(query)
 
-    def findAllDocuments(self, query={}):
-        return self.collection.find(query)
+    def findAllDocuments(self, query={}, projection=None, limit=0):
+        # limit=0 returns every matching document, the documents are fetched while iterating
+        start = time.perf_counter()
+        return timed_iter("mongodb", "find", self.collection.find(query, projection, limit=limit), start,
+                          lambda seconds, rows: slow_queries.check("mongodb", "find", query, seconds, rows, redact=describe_filter))
+
+    def aggregate(self, pipeline):
+        start = time.perf_counter()
+        return timed_iter("mongodb", "aggregate", self.collection.aggregate(pipeline), start,
+                          lambda seconds, rows: slow_queries.check("mongodb", "aggregate", pipeline, seconds, rows, redact=_describe_pipeline))
+
+    @instrumented("mongodb", "create_index")
+    def createIndex(self, keys, **kwargs):
+        # No-op when an index with the same keys and options already exists
+        return self.collection.create_index(keys, **kwargs)
+
 
+def _describe_pipeline(pipeline):
+    return json.dumps([redact_filter(stage) for stage in pipeline], sort_keys=True)
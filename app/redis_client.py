@@ -1,31 +1,232 @@
+import logging
+import time
+
 import redis
 
+from app.metrics import instrumented
+
+logger = logging.getLogger(__name__)
+
+# Keeps <field>:count, <field>:sum, <field>:min and <field>:max of every field in the hash KEYS[1].
+# ARGV holds field, value pairs.
+STATS_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local field = ARGV[i]
+    local value = tonumber(ARGV[i + 1])
+    redis.call('HINCRBY', KEYS[1], field .. ':count', 1)
+    redis.call('HINCRBYFLOAT', KEYS[1], field .. ':sum', ARGV[i + 1])
+    local min = tonumber(redis.call('HGET', KEYS[1], field .. ':min'))
+    if not min or value < min then
+        redis.call('HSET', KEYS[1], field .. ':min', ARGV[i + 1])
+    end
+    local max = tonumber(redis.call('HGET', KEYS[1], field .. ':max'))
+    if not max or value > max then
+        redis.call('HSET', KEYS[1], field .. ':max', ARGV[i + 1])
+    end
+end
+"""
+
+
+# Sets KEYS[2] to ARGV[2] and the score of member ARGV[3] in the sorted sets KEYS[3..], unless KEYS[1] holds an order
+# greater than ARGV[1]: readings arriving late do not replace a newer latest value. ARGV[4..] are the scores,
+# an empty score removes the member from its sorted set. Returns 1 when applied, 0 when the value was older.
+LATEST_SCRIPT = """
+local order = tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[1]))
+if current and current > order then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('SET', KEYS[2], ARGV[2])
+for i = 3, #KEYS do
+    local score = ARGV[i + 1]
+    if score == '' then
+        redis.call('ZREM', KEYS[i], ARGV[3])
+    else
+        redis.call('ZADD', KEYS[i], score, ARGV[3])
+    end
+end
+return 1
+"""
+
+
+def _latest_args(order_key, order, key, value, member, scores):
+    keys = [order_key, key] + list(scores)
+    args = [repr(order), value, member] + ["" if score is None else repr(float(score)) for score in scores.values()]
+    return keys, args
+
+
+def _stats_args(values):
+    args = []
+    for field, value in values.items():
+        args += [field, repr(float(value))]
+    return args
+
+
 class RedisClient:
     def __init__(self, host='localhost', port=6379, db=0):
         self._host = host
         self._port = port
         self._db = db
         self._client = redis.Redis(host=self._host, port=self._port, db=self._db)
+        self._stats_script = self._client.register_script(STATS_SCRIPT)
+        self._latest_script = self._client.register_script(LATEST_SCRIPT)
     
     def close(self):
         self._client.close()
 
+    @instrumented("redis")
     def ping(self):
         return self._client.ping()
     
+    @instrumented("redis")
     def get(self, key):
         return self._client.get(key)
     
+    @instrumented("redis")
     def set(self, key, value):
         return self._client.set(key, value)
+
+    @instrumented("redis")
+    def mget(self, keys):
+        # Values in the same order as keys, None for missing keys
+        return self._client.mget(keys)
+
     
+    @instrumented("redis")
     def delete(self, key):
         return self._client.delete(key)
     
+    def pipeline(self):
+        # Queue commands and send them in a single round trip with execute()
+        return RedisPipeline(self._client.pipeline(transaction=False), self._stats_script, self._latest_script)
+
+    @instrumented("redis")
+    def update_stats(self, key, values):
+        # Add one value per field to the running statistics kept in the hash `key`
+        return self._stats_script(keys=[key], args=_stats_args(values))
+
+    @instrumented("redis")
+    def set_latest(self, order_key, order, key, value, member, scores):
+        # Sets key to value and the score of member in every sorted set of scores, None removes it,
+        # unless order_key holds a greater order. Returns 1 when the value was stored, 0 when it was older.
+        keys, args = _latest_args(order_key, order, key, value, member, scores)
+        return self._latest_script(keys=keys, args=args)
+
+    @instrumented("redis")
+    def hgetall(self, key):
+        return self._client.hgetall(key)
+
+    @instrumented("redis")
+    def sadd(self, key, *members):
+        return self._client.sadd(key, *members)
+
+    @instrumented("redis")
+    def srem(self, key, *members):
+        return self._client.srem(key, *members)
+
+    @instrumented("redis")
+    def smembers(self, key):
+        return self._client.smembers(key)
+
+    @instrumented("redis")
+    def zadd(self, key, mapping):
+        return self._client.zadd(key, mapping)
+
+    @instrumented("redis")
+    def zrem(self, key, *members):
+        return self._client.zrem(key, *members)
+
+    @instrumented("redis")
+    def zrangebyscore(self, key, min, max):
+        # Members with min <= score <= max as (member, score) pairs, prefix a bound with ( to exclude it
+        return self._client.zrangebyscore(key, min, max, withscores=True)
+
+    @instrumented("redis")
+    def publish(self, channel, message):
+        return self._client.publish(channel, message)
+
+    def subscribe(self, channel, handler, on_reconnect=None):
+        # Call handler(message) for every message published on channel from a background thread.
+        # The thread survives a lost connection, on_reconnect() is called once it is subscribed again
+        # since the messages published in between are lost.
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: handler})
+        return pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=PubSubReconnect(on_reconnect))
+
+    @instrumented("redis")
     def keys(self, pattern):
         return self._client.keys(pattern)
     
     def clearAll(self):
         for key in self._client.keys("*"):
             self._client.delete(key)
-    
+
+
+class PubSubReconnect:
+    # exception_handler of a pubsub worker thread, without one the thread dies on the first connection error.
+    # Reconnects with backoff, the connection subscribes again to the channels of the pubsub when it connects.
+
+    def __init__(self, on_reconnect=None, max_backoff=30.0):
+        self.on_reconnect = on_reconnect
+        self.max_backoff = max_backoff
+        self.backoff = 0.5
+
+    def __call__(self, error, pubsub, thread):
+        if not isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+            logger.error("Redis subscription handler failed", exc_info=error)
+            return
+        logger.warning("Redis subscription lost, reconnecting in %.1fs: %s", self.backoff, error)
+        time.sleep(self.backoff)
+        try:
+            pubsub.connection.disconnect()
+            pubsub.connection.connect()
+        except (redis.ConnectionError, redis.TimeoutError):
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            return
+        self.backoff = 0.5
+        logger.info("Redis subscription restored")
+        if self.on_reconnect is not None:
+            self.on_reconnect()
+
+
+class RedisPipeline:
+    def __init__(self, pipe, stats_script, latest_script):
+        self._pipe = pipe
+        self._stats_script = stats_script
+        self._latest_script = latest_script
+
+    def set(self, key, value):
+        self._pipe.set(key, value)
+
+    def delete(self, *keys):
+        self._pipe.delete(*keys)
+
+    def update_stats(self, key, values):
+        self._stats_script(keys=[key], args=_stats_args(values), client=self._pipe)
+
+    def set_latest(self, order_key, order, key, value, member, scores):
+        keys, args = _latest_args(order_key, order, key, value, member, scores)
+        self._latest_script(keys=keys, args=args, client=self._pipe)
+
+    def hset(self, key, mapping):
+        self._pipe.hset(key, mapping=mapping)
+
+    def hgetall(self, key):
+        self._pipe.hgetall(key)
+
+    def sadd(self, key, *members):
+        self._pipe.sadd(key, *members)
+
+    def srem(self, key, *members):
+        self._pipe.srem(key, *members)
+
+    def zadd(self, key, mapping):
+        self._pipe.zadd(key, mapping)
+
+    def zrem(self, key, *members):
+        self._pipe.zrem(key, *members)
+
+    @instrumented("redis", "pipeline")
+    def execute(self):
+        return self._pipe.execute()
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+
+from app.redis_client import RedisClient
+from app.mongodb_client import MongoDBClient
+from app.elasticsearch_client import ElasticsearchClient
+from app.timescale import TimescalePool
+from app.cassandra_client import CassandraClient
+from app.bootstrap import bootstrap, bootstrap_cassandra, bootstrap_elasticsearch, bootstrap_mongodb, bootstrap_redis, bootstrap_timescale
+from app.sensors.cache import metadata_cache
+from app.sensors.ingest_buffer import WriteBehindBuffer
+from app.sensors import repository
+
+logger = logging.getLogger(__name__)
+
+# seconds open() keeps retrying a backend that is not accepting connections yet, e.g. while docker-compose starts it
+STARTUP_TIMEOUT = float(os.environ.get("STARTUP_TIMEOUT", "120"))
+
+# "sync" writes readings to every store before answering, "write_behind" only waits for redis
+INGEST_MODE = os.environ.get("INGEST_MODE", "sync")
+
+
+class Resources:
+    # Backend clients shared by every request served by this process.
+    # They are opened and the schemas bootstrapped by the startup hook, or lazily on first use when no startup hook ran.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = False
+        self.redis = None
+        self.mongodb = None
+        self.elastic = None
+        self.timescale = None
+        self.cassandra = None
+        self.ingest_buffer = None
+
+    def open(self, timeout=None):
+        # Each backend is connected and set up in turn, retried with backoff until timeout seconds have passed.
+        # When one of them never comes up the clients opened so far are closed and the error is raised.
+        with self._lock:
+            if self.opened:
+                return
+            deadline = time.monotonic() + (STARTUP_TIMEOUT if timeout is None else timeout)
+            steps = [
+                ("redis", lambda: RedisClient(host="redis"), bootstrap_redis),
+                ("mongodb", lambda: MongoDBClient(host="mongodb"), bootstrap_mongodb),
+                ("elasticsearch", lambda: ElasticsearchClient(host="elasticsearch", wait_timeout=0), bootstrap_elasticsearch),
+                ("timescale", lambda: TimescalePool(), bootstrap_timescale),
+                ("cassandra", lambda: CassandraClient(hosts=["cassandra"]), bootstrap_cassandra),
+            ]
+            clients = []
+            try:
+                for name, connect, setup in steps:
+                    clients.append(_open_client(name, connect, setup, deadline))
+                self._start(*clients)
+            except BaseException:
+                for client in reversed(clients):
+                    _close_quietly(client)
+                raise
+
+    def open_with(self, redis, mongodb, elastic, timescale, cassandra):
+        # Same as open() with clients built by the caller, e.g. the in-memory stand-ins of the benchmarks
+        with self._lock:
+            if self.opened:
+                raise RuntimeError("Resources are already open")
+            self._start(redis, mongodb, elastic, timescale, cassandra, setup=bootstrap)
+
+    def _start(self, redis, mongodb, elastic, timescale, cassandra, setup=None):
+        self.redis = redis
+        self.mongodb = mongodb
+        self.elastic = elastic
+        self.timescale = timescale
+        self.cassandra = cassandra
+        try:
+            if setup is not None:
+                setup(self)
+            metadata_cache.listen(self.redis)
+            if INGEST_MODE == "write_behind":
+                self.ingest_buffer = WriteBehindBuffer(self.write_history,
+                                                       batch_size=int(os.environ.get("INGEST_BATCH_SIZE", "500")),
+                                                       flush_interval=float(os.environ.get("INGEST_FLUSH_INTERVAL", "0.5")),
+                                                       append_timeout=float(os.environ.get("INGEST_APPEND_TIMEOUT", "5")),
+                                                       stop_timeout=float(os.environ.get("INGEST_STOP_TIMEOUT", "10")))
+                self.ingest_buffer.start()
+        except BaseException:
+            metadata_cache.stop()
+            self.redis = self.mongodb = self.elastic = self.timescale = self.cassandra = None
+            raise
+        self.opened = True
+
+    def get(self):
+        if not self.opened:
+            self.open()
+        return self
+
+    def write_history(self, rows):
+        timescale = self.timescale.get()
+        try:
+            repository.store_history(timescale, self.cassandra, self.redis, rows)
+        finally:
+            timescale.close()
+
+    def close(self):
+        with self._lock:
+            if not self.opened:
+                return
+            # drain buffered readings while the clients are still open
+            if self.ingest_buffer is not None:
+                self.ingest_buffer.stop()
+                self.ingest_buffer = None
+            metadata_cache.stop()
+            self.redis.close()
+            self.mongodb.close()
+            self.elastic.close()
+            self.timescale.close()
+            self.cassandra.close()
+            self.opened = False
+
+
+def _open_client(name, connect, setup, deadline, max_backoff=10.0):
+    # connect() builds the client and setup(client) checks it answers and creates its schema
+    backoff = 0.5
+    while True:
+        client = None
+        try:
+            client = connect()
+            setup(client)
+            return client
+        except Exception as e:
+            if client is not None:
+                _close_quietly(client)
+            if time.monotonic() + backoff > deadline:
+                logger.error("Giving up on %s: %s", name, e)
+                raise
+            logger.warning("%s is not available, retrying in %.1fs: %s", name, backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+
+def _close_quietly(client):
+    try:
+        client.close()
+    except Exception:
+        logger.exception("Failed to close %s", type(client).__name__)
+
+
+resources = Resources()
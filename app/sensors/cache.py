@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+INVALIDATION_CHANNEL = "sensor-metadata-invalidate"
+
+
+class SensorMetadataCache:
+    # Bounded LRU cache of the static sensor metadata merged from postgresql and mongodb.
+    # Entries expire after `ttl` seconds and are dropped on every worker through a redis channel when a sensor changes.
+
+    def __init__(self, maxsize=10000, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sensor_id):
+        with self._lock:
+            entry = self._entries.get(sensor_id)
+            if entry is not None:
+                expires_at, metadata = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(sensor_id)
+                    self.hits += 1
+                    return dict(metadata)
+                del self._entries[sensor_id]
+            self.misses += 1
+            return None
+
+    def put(self, sensor_id, metadata):
+        with self._lock:
+            self._entries[sensor_id] = (self._clock() + self.ttl, dict(metadata))
+            self._entries.move_to_end(sensor_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, sensor_id=None):
+        # Drop one sensor, or every entry when no sensor_id is given
+        with self._lock:
+            if sensor_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sensor_id, None)
+
+    def publish_invalidation(self, redis, sensor_id):
+        self.invalidate(sensor_id)
+        redis.publish(INVALIDATION_CHANNEL, sensor_id)
+
+    def listen(self, redis):
+        # Invalidate entries when another worker publishes a change
+        if self._listener is None:
+            # invalidations published while the subscription was down are lost, every entry is dropped instead
+            self._listener = redis.subscribe(INVALIDATION_CHANNEL, self._on_invalidation, on_reconnect=self.invalidate)
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _on_invalidation(self, message):
+        self.invalidate(int(message["data"]))
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+metadata_cache = SensorMetadataCache(maxsize=int(os.environ.get("SENSOR_CACHE_SIZE", "10000")),
+                                     ttl=float(os.environ.get("SENSOR_CACHE_TTL", "300")))
@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from app.database import SessionLocal
+from app.resources import resources
 from app.redis_client import RedisClient
 from app.mongodb_client import MongoDBClient
 from app.elasticsearch_client import ElasticsearchClient 
 from app.timescale import Timescale
 from app.cassandra_client import CassandraClient
+from app.sensors.ingest_buffer import WriteBehindBuffer
 from . import models, schemas, repository
 from datetime import datetime
 from typing import Optional
@@ -20,7 +22,7 @@ def get_db():
         db.close()
 
 def get_timescale():
-    ts = Timescale()
+    ts = resources.get().timescale.get()
     try:
         yield ts
     finally:
@@ -28,35 +30,23 @@ def get_timescale():
 
 # Dependency to get redis client
 def get_redis_client():
-    redis = RedisClient(host="redis")
-    try:
-        yield redis
-    finally:
-        redis.close()
+    return resources.get().redis
 
 # Dependency to get mongodb client
 def get_mongodb_client():
-    mongodb = MongoDBClient(host="mongodb")
-    try:
-        yield mongodb
-    finally:
-        mongodb.close()
+    return resources.get().mongodb
 
 # Dependency to get elastic_search client
 def get_elastic_search():
-    es = ElasticsearchClient(host="elasticsearch")
-    try:
-        yield es
-    finally:
-        es.close()
+    return resources.get().elastic
 
 # Dependency to get cassandra client
 def get_cassandra_client():
-    cassandra = CassandraClient(hosts=["cassandra"])
-    try:
-        yield cassandra
-    finally:
-        cassandra.close()
+    return resources.get().cassandra
+
+# Dependency to get the write-behind buffer, None when readings are written synchronously
+def get_ingest_buffer():
+    return resources.get().ingest_buffer
 
 
 router = APIRouter(
@@ -71,17 +61,18 @@ router = APIRouter(
 # - query: string to search
 # - size (optional): number of results to return
 # - search_type (optional): type of search to perform
+# - from (optional): number of results to skip
 # - db: database session
 # - mongodb_client: mongodb client
 @router.get("/search")
-def search_sensors(query: str, size: int = 10, search_type: str = "match", db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), es: ElasticsearchClient = Depends(get_elastic_search)):
-    return repository.search_sensors(db=db,mongodb=mongodb_client, es=es, query=query, size=size, search_type=search_type)
+def search_sensors(query: str, size: int = Query(10, ge=0), search_type: str = "match", from_: int = Query(0, alias="from", ge=0), db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), es: ElasticsearchClient = Depends(get_elastic_search)):
+    return repository.search_sensors(db=db,mongodb=mongodb_client, es=es, query=query, size=size, search_type=search_type, from_=from_)
 
 
 # 🙋🏽‍♀️ Add here the route to get a list of sensors near to a given location
 @router.get("/near")
-def get_sensors_near(latitude: float, longitude: float, radius: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
-    return repository.get_sensors_near(latitude=latitude, longitude=longitude,radius=radius, db=db, mongodb_client=mongodb_client, redis_client=redis_client)
+def get_sensors_near(latitude: float, longitude: float, radius: int, limit: int = Query(0, ge=0), db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.get_sensors_near(latitude=latitude, longitude=longitude,radius=radius, db=db, mongodb_client=mongodb_client, redis_client=redis_client, limit=limit)
 
 
 @router.get("/temperature/values")
@@ -115,6 +106,32 @@ def get_low_battery_sensors(db: Session = Depends(get_db),
 
 
 
+# Sensors whose latest value of a metric is within the given bounds
+@router.get("/latest")
+def get_latest(metric: str,
+               gt: Optional[float] = None,
+               gte: Optional[float] = None,
+               lt: Optional[float] = None,
+               lte: Optional[float] = None,
+               db: Session = Depends(get_db),
+               redis_client: RedisClient = Depends(get_redis_client),
+               mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+    return repository.get_latest_in_range(db=db, redis=redis_client, mongodb_client=mongodb_client, metric=metric, gt=gt, gte=gte, lt=lt, lte=lte)
+
+
+# Record readings of many sensors with one request
+@router.post("/data/batch")
+def record_data_batch(batch: schemas.SensorDataBatch,
+                      db: Session = Depends(get_db),
+                      redis_client: RedisClient = Depends(get_redis_client),
+                      mongodb_client: MongoDBClient = Depends(get_mongodb_client),
+                      timescale_client: Timescale = Depends(get_timescale),
+                      cassandra_client: CassandraClient = Depends(get_cassandra_client),
+                      ingest_buffer: Optional[WriteBehindBuffer] = Depends(get_ingest_buffer)
+                      ):
+    return repository.record_data_batch(redis=redis_client, readings=batch.readings, db=db, mongodb_client=mongodb_client, timescale_client=timescale_client, cassandra_client=cassandra_client, ingest_buffer=ingest_buffer)
+
+
 # 🙋🏽‍♀️ Add here the route to get all sensors
 @router.get("")
 def get_sensors(db: Session = Depends(get_db)):
@@ -123,11 +140,11 @@ def get_sensors(db: Session = Depends(get_db)):
 
 # 🙋🏽‍♀️ Add here the route to create a sensor
 @router.post("")
-def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), ElasticsearchClient = Depends(get_elastic_search)):
+def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), ElasticsearchClient = Depends(get_elastic_search), redis_client: RedisClient = Depends(get_redis_client)):
     db_sensor = repository.get_sensor_by_name(db, sensor.name)
     if db_sensor:
         raise HTTPException(status_code=400, detail="Sensor with same name already registered")
-    return repository.create_sensor(db=db, sensor=sensor, mongodb_client=mongodb_client, elastic_client=ElasticsearchClient)
+    return repository.create_sensor(db=db, sensor=sensor, mongodb_client=mongodb_client, elastic_client=ElasticsearchClient, redis=redis_client)
 
 
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
@@ -141,11 +158,11 @@ def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: Mo
 
 # 🙋🏽‍♀️ Add here the route to delete a sensor
 @router.delete("/{sensor_id}")
-def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client), es: ElasticsearchClient = Depends(get_elastic_search)):
     db_sensor = repository.get_sensor(db, sensor_id, mongodb_client)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return repository.delete_sensor(db=db, sensor_id=sensor_id, mongodb_client=mongodb_client)
+    return repository.delete_sensor(db=db, sensor_id=sensor_id, mongodb_client=mongodb_client, redis=redis_client, elastic_client=es)
     
 
 # 🙋🏽‍♀️ Add here the route to update a sensor
@@ -156,9 +173,10 @@ def record_data(sensor_id: int,
                 redis_client: RedisClient = Depends(get_redis_client), 
                 mongodb_client: MongoDBClient = Depends(get_mongodb_client), 
                 timescale_client: Timescale = Depends(get_timescale),
-                cassandra_client: CassandraClient = Depends(get_cassandra_client)
+                cassandra_client: CassandraClient = Depends(get_cassandra_client),
+                ingest_buffer: Optional[WriteBehindBuffer] = Depends(get_ingest_buffer)
                 ):
-    return repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data, db=db, mongodb_client=mongodb_client, timescale_client=timescale_client, cassandra_client=cassandra_client)
+    return repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data, db=db, mongodb_client=mongodb_client, timescale_client=timescale_client, cassandra_client=cassandra_client, ingest_buffer=ingest_buffer)
 
 
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
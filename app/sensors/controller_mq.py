@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
 from . import schemas
 from datetime import datetime
 from typing import Optional
-from shared.publisher import Publisher
+from shared.publisher import Publisher, ReadingPublisher
+import os
+import threading
 
 
 router = APIRouter(
@@ -11,14 +14,54 @@ router = APIRouter(
     tags=["sensors"],
 )
 
+_publisher = None
+_reading_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> Publisher:
+    # one publisher per worker process, created on the first request
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = Publisher(timeout=float(os.environ.get("MQ_RPC_TIMEOUT", "30")))
+    return _publisher
+
+
+@router.on_event("shutdown")
+def close_publisher():
+    # the app including this router closes the publishers when it shuts down
+    global _publisher, _reading_publisher
+    with _publisher_lock:
+        if _publisher is not None:
+            _publisher.close()
+            _publisher = None
+        if _reading_publisher is not None:
+            _reading_publisher.close()
+            _reading_publisher = None
+
+
+def get_reading_publisher() -> ReadingPublisher:
+    global _reading_publisher
+    if _reading_publisher is None:
+        with _publisher_lock:
+            if _reading_publisher is None:
+                _reading_publisher = ReadingPublisher()
+    return _reading_publisher
+
+
 def publish_request(request_type: str, data: dict):
     try:
-        publisher = Publisher()
-        response = publisher.publish(request_type, data)
-        publisher.close()
-        return response
+        reply = get_publisher().publish(request_type, jsonable_encoder(data))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # the consumer answers {"status_code", "response"} or {"status_code", "detail"} for the errors of the repository
+    if reply['status_code'] >= 400:
+        raise HTTPException(status_code=reply['status_code'], detail=reply['detail'])
+    return reply['response']
     
 # 🙋🏽‍♀️ Add here the route to search sensors by query to Elasticsearch
 # Parameters:
@@ -28,14 +71,14 @@ def publish_request(request_type: str, data: dict):
 # - db: database session
 # - mongodb_client: mongodb client
 @router.get("/search")
-def search_sensors(query: str, size: int = 10, search_type: str = "match"):
-    return publish_request('search', {'query': query, 'size': size, 'search_type': search_type})
+def search_sensors(query: str, size: int = Query(10, ge=0), search_type: str = "match", from_: int = Query(0, alias="from", ge=0)):
+    return publish_request('search', {'query': query, 'size': size, 'search_type': search_type, 'from': from_})
 
 
 # 🙋🏽‍♀️ Add here the route to get a list of sensors near to a given location
 @router.get("/near")
-def get_sensors_near(latitude: float, longitude: float, radius: int):
-    return publish_request('near', {'latitude': latitude, 'longitude': longitude, 'radius': radius})
+def get_sensors_near(latitude: float, longitude: float, radius: int, limit: int = Query(0, ge=0)):
+    return publish_request('near', {'latitude': latitude, 'longitude': longitude, 'radius': radius, 'limit': limit})
 
 @router.get("/temperature/values")
 def get_temperature_values():
@@ -81,10 +124,15 @@ def delete_sensor(sensor_id: int):
     
 
 # 🙋🏽‍♀️ Add here the route to update a sensor
-@router.post("/{sensor_id}/data")
+# readings go to the ingest queue without waiting for the consumer, unknown sensors are dropped there
+@router.post("/{sensor_id}/data", status_code=202)
 def record_data(sensor_id: int, 
                 data: schemas.SensorData):
-    return publish_request('post_sensor_by_id_data', {'sensor_id': sensor_id, 'data':data})
+    try:
+        get_reading_publisher().publish({'sensor_id': sensor_id, **data.dict()})
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return Response(status_code=202)
 
 
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
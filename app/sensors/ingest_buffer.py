@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from cassandra import InvalidRequest
+
+logger = logging.getLogger(__name__)
+
+# errors the databases raise for the data itself, writing the same rows again fails the same way
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, InvalidRequest, ValueError, TypeError)
+
+
+def is_data_error(error):
+    return isinstance(error, DATA_ERRORS)
+
+
+class WriteBehindBuffer:
+    # Readings already acknowledged to the sensors but not yet stored in the history databases.
+    # A background thread hands them to `write` in batches of at most `batch_size` rows,
+    # at least every `flush_interval` seconds, and drains whatever is left on stop().
+    # Batches failing because a database is unreachable are retried until it is back, or stop_timeout seconds after stop().
+    # A batch failing with a data error is written row by row and only the rows the databases refuse are dropped,
+    # so one bad row can not hold back every reading behind it.
+
+    def __init__(self, write, batch_size=500, flush_interval=0.5, max_pending=50000, retry_interval=1.0,
+                 append_timeout=5.0, stop_timeout=10.0):
+        self._write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.append_timeout = append_timeout
+        self.stop_timeout = stop_timeout
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._stop_deadline = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+            self._thread.start()
+
+    def append(self, rows, timeout=None):
+        # Returns False when the buffer stayed full for timeout seconds, append_timeout by default.
+        # Producers wait when the flusher falls too far behind instead of growing the buffer without bound.
+        timeout = self.append_timeout if timeout is None else timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._rows) < self.max_pending or self._stopping, timeout=timeout):
+                return False
+            self._rows.extend(rows)
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._rows)
+
+    def stop(self):
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._stop_deadline = time.monotonic() + self.stop_timeout
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def _take(self):
+        batch = []
+        while self._rows and len(batch) < self.batch_size:
+            batch.append(self._rows.popleft())
+        self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or len(self._rows) >= self.batch_size, timeout=self.flush_interval)
+                if self._stopping and not self._rows:
+                    return
+                batch = self._take()
+            if not batch:
+                continue
+            batch = self._flush(batch)
+            if not batch:
+                continue
+            with self._cond:
+                if self._stopping and time.monotonic() >= self._stop_deadline:
+                    logger.error("Dropping %d readings, history databases are unavailable", len(batch) + len(self._rows))
+                    self._rows.clear()
+                    return
+                self._rows.extendleft(reversed(batch))
+            time.sleep(self.retry_interval)
+
+    def _flush(self, batch):
+        # Returns the rows to write again
+        try:
+            self._write(batch)
+            return []
+        except Exception as e:
+            if not is_data_error(e):
+                logger.exception("Failed to flush %d readings", len(batch))
+                return batch
+            logger.warning("Flushing %d readings failed on their data, writing them one by one: %s", len(batch), e)
+        retry = []
+        for row in batch:
+            try:
+                self._write([row])
+            except Exception as e:
+                if not is_data_error(e):
+                    retry.append(row)
+                else:
+                    logger.error("Dropping reading %r the history databases refuse: %s", row, e)
+        return retry
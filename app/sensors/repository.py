@@ -1,42 +1,66 @@
-from collections import defaultdict
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
+import ast
 import json
-import uuid
+import logging
+import os
 from typing import List, Optional
 from . import models, schemas, last_data
-from datetime import datetime
-from collections import defaultdict
+from .cache import metadata_cache
+from .ingest_buffer import WriteBehindBuffer
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+SENSOR_FIELDS = ("id", "name", "latitude", "longitude", "type", "mac_address", "manufacturer", "model", "serie_number", "firmware_version", "description")
+
+def get_sensor_metadata(db: Session, mongodb_client: Session, sensor_id: int) -> Optional[dict]:
+    return get_sensors_metadata(db, mongodb_client, [sensor_id]).get(sensor_id)
+
+def get_sensors_metadata(db: Session, mongodb_client: Session, sensor_ids: List[int]) -> dict:
+    # static metadata of each sensor merged from postgresql and mongodb, sensors missing in either store are left out
+    sensors = {}
+    missing = []
+    for sensor_id in sensor_ids:
+        metadata = metadata_cache.get(sensor_id)
+        if metadata is None:
+            missing.append(sensor_id)
+        else:
+            sensors[sensor_id] = metadata
+    if not missing:
+        return sensors
+
+    db_sensors = {db_sensor.id: db_sensor for db_sensor in db.query(models.Sensor).filter(models.Sensor.id.in_(missing)).all()}
+    if not db_sensors:
+        return sensors
 
-def get_sensor(db: Session, sensor_id: int, mongodb_client: Session) -> Optional[models.Sensor]:
-
-    # get sensor from postgresql with sensor_id
-    db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
-    if not db_sensor:
-        raise HTTPException(status_code=404, detail="Sensor not found in postgreSQL")
-    
-    # get sensor from mongodb with sensor_id
     mongodb_client.getDatabase("sensors")
     mongodb_client.getCollection("sensorsCol")
-    mongodb_sensor = mongodb_client.findOne({"sensor_id": sensor_id})
-
-    if mongodb_sensor is None:
-        raise HTTPException(status_code=404, detail="Sensor not found in MongoDB")
-
-    sensor = {"id": sensor_id, 
-              "name": db_sensor.name, 
-              "latitude": mongodb_sensor["location"]["coordinates"][0], 
-              "longitude": mongodb_sensor["location"]["coordinates"][1],
-              "type": mongodb_sensor["type"], 
-              "mac_address": mongodb_sensor["mac_address"],
-              "manufacturer": mongodb_sensor["manufacturer"],
-              "model": mongodb_sensor["model"], 
-              "serie_number": mongodb_sensor["serie_number"], 
-              "firmware_version": mongodb_sensor["firmware_version"], 
-              "description": mongodb_sensor["description"], 
-            }
+    for doc in mongodb_client.findAllDocuments({"sensor_id": {"$in": list(db_sensors)}}):
+        db_sensor = db_sensors[doc["sensor_id"]]
+        metadata = {"id": db_sensor.id,
+                    "name": db_sensor.name,
+                    "joined_at": db_sensor.joined_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "latitude": doc["location"]["coordinates"][0],
+                    "longitude": doc["location"]["coordinates"][1],
+                    "type": doc["type"],
+                    "mac_address": doc["mac_address"],
+                    "manufacturer": doc["manufacturer"],
+                    "model": doc["model"],
+                    "serie_number": doc["serie_number"],
+                    "firmware_version": doc["firmware_version"],
+                    "description": doc["description"],
+                    }
+        metadata_cache.put(db_sensor.id, metadata)
+        sensors[db_sensor.id] = metadata
+    return sensors
 
-    return sensor
+def get_sensor(db: Session, sensor_id: int, mongodb_client: Session) -> Optional[dict]:
+    metadata = get_sensor_metadata(db, mongodb_client, sensor_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    return {field: metadata[field] for field in SENSOR_FIELDS}
 
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.name == name).first()
@@ -44,7 +68,29 @@ def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
 def get_sensors(db: Session, skip: int = 0, limit: int = 100) -> List[models.Sensor]:
     return db.query(models.Sensor).offset(skip).limit(limit).all()
 
-def create_sensor(db: Session, sensor: schemas.SensorCreate,  mongodb_client: Session, elastic_client: Session):
+# search index of the sensors, created by app.bootstrap and turned into an alias by app.commands.reindex
+SENSORS_INDEX = "sensors"
+SENSORS_MAPPING = {
+    "properties": {
+        "id": {"type": "keyword"},
+        "name": {"type": "keyword"},
+        "type": {"type": "keyword"},
+        "description": {"type": "text"},
+    }
+}
+
+
+def sensor_document(mongodb_sensor: dict) -> dict:
+    # elasticsearch document of a sensor from its mongodb document
+    return {
+        "id": mongodb_sensor["sensor_id"],
+        "name": mongodb_sensor["name"],
+        "type": mongodb_sensor["type"],
+        "description": mongodb_sensor["description"],
+    }
+
+
+def create_sensor(db: Session, sensor: schemas.SensorCreate,  mongodb_client: Session, elastic_client: Session, redis: Session):
     # create a new sensor in postgresql
     db_sensor = models.Sensor(name=sensor.name)
     db.add(db_sensor)
@@ -70,30 +116,10 @@ def create_sensor(db: Session, sensor: schemas.SensorCreate,  mongodb_client: Se
             "description": sensor.description
         }
     mongodb_client.insertOne(mydoc)
+    metadata_cache.publish_invalidation(redis, db_sensor.id)
 
-    elastic_index_name = "sensors"
-    
-    if not elastic_client.index_exists(elastic_index_name):
-        elastic_client.create_index(elastic_index_name)
-        mapping = {
-            "properties": {
-                "id": {"type": "keyword"},
-                "name": {"type": "keyword"},
-                "type": {"type": "keyword"},
-                "description": {"type": "text"},
-            }
-        }
-
-        elastic_client.create_mapping(elastic_index_name, mapping)
-
-    elastic_doc = {
-        "id": db_sensor.id,
-        "name": sensor.name,
-        "type": sensor.type,
-        "description": sensor.description,
-    }
-
-    elastic_client.index_document(elastic_index_name, elastic_doc)
+    # the sensor id is the document id so the document can be replaced or deleted later
+    elastic_client.index_document(SENSORS_INDEX, sensor_document(mydoc), id=db_sensor.id)
     
     output = {
         "id": db_sensor.id,
@@ -111,133 +137,264 @@ def create_sensor(db: Session, sensor: schemas.SensorCreate,  mongodb_client: Se
 
     return output
 
-def record_data(redis: Session, sensor_id: int, data: schemas.SensorData, db: Session, mongodb_client: Session, timescale_client: Session, cassandra_client: Session) ->  Optional[schemas.Sensor]:
-   # get sensor from postgresql with sensor_id
-    db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
-    if not db_sensor:
+def record_data(redis: Session, sensor_id: int, data: schemas.SensorData, db: Session, mongodb_client: Session, timescale_client: Session, cassandra_client: Session, ingest_buffer: Optional[WriteBehindBuffer] = None) ->  Optional[schemas.Sensor]:
+    metadata = get_sensor_metadata(db, mongodb_client, sensor_id)
+    if metadata is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
 
-    # conver db_sensor to json format let it store in redis
-    sensor_json = json.dumps(data.dict())
-    redis.set(f"sensor-{sensor_id}", sensor_json)
+    rows = [_history_row(sensor_id, data, metadata["type"])]
+    store_latest(redis, rows)
 
-    # get sensor from mongodb with sensor_id
-    mongodb_client.getDatabase("sensors")
-    mongodb_client.getCollection("sensorsCol")
-    col_sensor = mongodb_client.findOne({"sensor_id": sensor_id})
-    if not col_sensor:
-        raise HTTPException(status_code=404, detail="Sensor not found")
-
-
-    # if sensor exists, update the last data in redis
+    # answer with the cached metadata and the new reading
     sensor = schemas.Sensor(id=sensor_id, 
-                        name=db_sensor.name, 
-                        latitude=col_sensor["location"]["coordinates"][0], 
-                        longitude=col_sensor["location"]["coordinates"][1],
-                        type=col_sensor["type"], 
-                        mac_address=col_sensor["mac_address"],
-                        joined_at=db_sensor.joined_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), 
+                        name=metadata["name"], 
+                        latitude=metadata["latitude"], 
+                        longitude=metadata["longitude"],
+                        type=metadata["type"], 
+                        mac_address=metadata["mac_address"],
+                        joined_at=metadata["joined_at"], 
                         temperature=data.temperature,
                         velocity=data.velocity, 
                         humidity=data.humidity,
                         battery_level=data.battery_level, 
                         last_seen=data.last_seen,
-                        description=col_sensor["description"])
-        
+                        description=metadata["description"])
 
-    # timescale_client.execute("CREATE TABLE IF NOT EXISTS sensor_data ( id SERIAL PRIMARY KEY, sensor_id INT NOT NULL, data JSONB, last_seen TIMESTAMPTZ NOT NULL);")
-    data = data.dict()
-    last_seen = data.pop('last_seen')
-    data_json = json.dumps(data)
-    timescale_client.insert(f"INSERT INTO sensor_data (sensor_id, data, last_seen) VALUES ({sensor_id}, '{data_json}', '{last_seen}');")
-
-    #cassandra_client.get_session().set_keyspace('sensor')
-    insert_stmt = cassandra_client.get_session_keyspace().prepare("""
-    INSERT INTO sensor.sensor_data (id, sensor_id, data, last_seen, type_sensor)
-    VALUES (?, ?, ?, ?, ?)
-    """)
-    data_str = json.dumps(data)
-    cassandra_client.get_session_keyspace().execute(insert_stmt, [uuid.uuid4(), sensor_id, data_str, last_seen, str(col_sensor["type"])])
-    #cassandra_client.execute(f"INSERT INTO sensor_data (sensor_id, data, last_seen) VALUES ({sensor_id}, '{data_json}', '{last_seen}');")
+    _store_history(timescale_client, cassandra_client, redis, ingest_buffer, rows)
 
     return sensor
 
+def record_data_batch(redis: Session, readings: List[schemas.SensorReading], db: Session, mongodb_client: Session, timescale_client: Session, cassandra_client: Session, ingest_buffer: Optional[WriteBehindBuffer] = None):
+    if not readings:
+        return {"readings": 0, "sensors": 0}
+
+    # get every sensor of the batch with one query per store for the ones not cached yet
+    sensor_ids = sorted({reading.sensor_id for reading in readings})
+    sensors = get_sensors_metadata(db, mongodb_client, sensor_ids)
+
+    missing = [sensor_id for sensor_id in sensor_ids if sensor_id not in sensors]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Sensor not found: {missing}")
+
+    rows = _reading_rows(readings, sensors)
+    store_latest(redis, rows)
+    _store_history(timescale_client, cassandra_client, redis, ingest_buffer, rows)
+
+    return {"readings": len(rows), "sensors": len(sensor_ids)}
+
+def ingest_readings(redis: Session, readings: List[schemas.SensorReading], db: Session, mongodb_client: Session, timescale_client: Session, cassandra_client: Session) -> int:
+    # readings that arrive through the ingest queue nobody waits on, readings of unknown sensors are dropped
+    sensors = get_sensors_metadata(db, mongodb_client, sorted({reading.sensor_id for reading in readings}))
+    known = [reading for reading in readings if reading.sensor_id in sensors]
+    if len(known) < len(readings):
+        logger.warning("Dropping %d readings of unknown sensors", len(readings) - len(known))
+    if not known:
+        return 0
+
+    rows = _reading_rows(known, sensors)
+    store_latest(redis, rows)
+    store_history(timescale_client, cassandra_client, redis, rows)
+    return len(rows)
+
+def _reading_rows(readings: List[schemas.SensorReading], sensors: dict) -> list:
+    rows = []
+    for reading in readings:
+        data = schemas.SensorData(**reading.dict(exclude={"sensor_id"}))
+        rows.append(_history_row(reading.sensor_id, data, sensors[reading.sensor_id]["type"]))
+    return rows
+
+METRICS = ("velocity", "temperature", "humidity", "battery_level")
+
+CASSANDRA_INSERT_READING = """
+INSERT INTO sensor.sensor_readings (sensor_id, day_bucket, last_seen, velocity, temperature, humidity, battery_level, type_sensor)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+CASSANDRA_INSERT_READING_BY_TYPE = """
+INSERT INTO sensor.sensor_readings_by_type (type_sensor, day_bucket, shard, sensor_id, last_seen, velocity, temperature, humidity, battery_level)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+CASSANDRA_INSERT_READING_DAY = """
+INSERT INTO sensor.sensor_reading_days (type_sensor, day_bucket, shard) VALUES (?, ?, ?)
+"""
+# partitions a day of readings of one type is spread over, by sensor id
+READINGS_BY_TYPE_SHARDS = int(os.environ.get("CASSANDRA_TYPE_SHARDS", "16"))
+
+def _history_row(sensor_id: int, data: schemas.SensorData, sensor_type: str):
+    data = data.dict()
+    last_seen = data.pop('last_seen')
+    return sensor_id, data, last_seen, str(sensor_type)
+
+def stats_key(sensor_id: int) -> str:
+    return f"stats-{sensor_id}"
+
+def stats_sensors_key(sensor_type: str) -> str:
+    return f"stats-sensors-{sensor_type}"
+
+def latest_key(metric: str) -> str:
+    return f"latest-{metric}"
+
+def latest_seen_key(sensor_id: int) -> str:
+    return f"sensor-last-seen-{sensor_id}"
+
+def store_latest(redis: Session, rows: list):
+    # redis keeps the reading of each sensor with the greatest last_seen as its latest value,
+    # readings arriving late, in a batch or after a newer one, do not replace it
+    latest = {}
+    for sensor_id, data, last_seen, _ in rows:
+        order = _epoch_micros(parse_last_seen(last_seen))
+        if sensor_id not in latest or order >= latest[sensor_id][0]:
+            latest[sensor_id] = (order, data, last_seen)
+
+    pipe = redis.pipeline()
+    for sensor_id, (order, data, last_seen) in latest.items():
+        # one sorted set per metric indexes the latest value of every sensor for range queries
+        pipe.set_latest(latest_seen_key(sensor_id), order, f"sensor-{sensor_id}", json.dumps({**data, "last_seen": last_seen}),
+                        sensor_id, {latest_key(metric): data.get(metric) for metric in METRICS})
+    pipe.execute()
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _epoch_micros(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+def update_stats(redis: Session, rows: list):
+    # every stored reading feeds the running count/sum/min/max of its sensor. It is only called once the readings
+    # are in the history databases, so a failed write retried by the client is not counted twice
+    pipe = redis.pipeline()
+    members = set()
+    for sensor_id, data, _, type_sensor in rows:
+        values = {metric: data[metric] for metric in METRICS if data.get(metric) is not None}
+        if values:
+            pipe.update_stats(stats_key(sensor_id), values)
+        members.add((type_sensor, sensor_id))
+    for type_sensor, sensor_id in members:
+        pipe.sadd(stats_sensors_key(type_sensor), sensor_id)
+    pipe.execute()
+
+def _store_history(timescale_client: Session, cassandra_client: Session, redis: Session, ingest_buffer: Optional[WriteBehindBuffer], rows: list):
+    # in write-behind mode the buffer flushes the rows to timescale and cassandra later
+    if ingest_buffer is not None:
+        if not ingest_buffer.append(rows):
+            raise HTTPException(status_code=503, detail="Too many readings waiting to be stored, retry later")
+    else:
+        store_history(timescale_client, cassandra_client, redis, rows)
+
+def store_history(timescale_client: Session, cassandra_client: Session, redis: Session, rows: list):
+    write_history(timescale_client, cassandra_client, rows)
+    update_stats(redis, rows)
+
+def write_history(timescale_client: Session, cassandra_client: Session, rows: list):
+    # rows are (sensor_id, data, last_seen, type_sensor) tuples, data holds the metric values
+    timescale_client.insert_many("INSERT INTO sensor_data (sensor_id, data, last_seen) VALUES %s",
+                                 [(sensor_id, json.dumps(data), last_seen) for sensor_id, data, last_seen, _ in rows])
+    refresh_late_history(timescale_client, rows)
+    write_cassandra_readings(cassandra_client, rows)
+
+def parse_last_seen(last_seen: str) -> datetime:
+    # readings carry ISO 8601 timestamps, naive ones are taken as UTC
+    last_seen = datetime.fromisoformat(last_seen)
+    if last_seen.tzinfo is None:
+        return last_seen.replace(tzinfo=timezone.utc)
+    return last_seen.astimezone(timezone.utc)
+
+def write_cassandra_readings(cassandra_client: Session, rows: list):
+    statements = []
+    days = set()
+    for sensor_id, data, last_seen, type_sensor in rows:
+        last_seen = parse_last_seen(last_seen)
+        day_bucket = last_seen.date()
+        values = [data.get(metric) for metric in METRICS]
+        statements.append((CASSANDRA_INSERT_READING, [sensor_id, day_bucket, last_seen, *values, type_sensor]))
+        shard = sensor_id % READINGS_BY_TYPE_SHARDS
+        statements.append((CASSANDRA_INSERT_READING_BY_TYPE, [type_sensor, day_bucket, shard, sensor_id, last_seen, *values]))
+        days.add((type_sensor, day_bucket, shard))
+    statements += [(CASSANDRA_INSERT_READING_DAY, list(day)) for day in days]
+    cassandra_client.execute_concurrent_statements(statements)
+
+def get_readings_by_type(cassandra_client: Session, type_sensor: str, columns: str):
+    # one query for the day shards with readings of this type, then every one of these partitions concurrently
+    days = cassandra_client.execute("SELECT day_bucket, shard FROM sensor.sensor_reading_days WHERE type_sensor = ?", [type_sensor])
+    results = cassandra_client.execute_concurrent(f"SELECT {columns} FROM sensor.sensor_readings_by_type WHERE type_sensor = ? AND day_bucket = ? AND shard = ?",
+                                                  [(type_sensor, day.day_bucket, day.shard) for day in days])
+    for result in results:
+        yield from result.result_or_exc
+
+# continuous aggregate of migrations_time, bucket width and how far back its refresh policy surely looks,
+# a day less than its start offset so a reading is not missed between two runs of the policy, for every bucket size
+HISTORY_BUCKETS = {
+    "hour": ("sensor_data_hourly", "1 hour", timedelta(days=7)),
+    "day": ("sensor_data_daily", "1 day", timedelta(days=7)),
+    "week": ("sensor_data_weekly", "1 week", timedelta(days=20)),
+    "month": ("sensor_data_monthly", "1 month", timedelta(days=88)),
+    "year": ("sensor_data_yearly", "1 year", timedelta(days=1094)),
+}
+
+REFRESH_AGGREGATE = """CALL refresh_continuous_aggregate(%(view)s,
+    time_bucket(%(width)s::interval, %(start)s::timestamptz),
+    time_bucket(%(width)s::interval, %(end)s::timestamptz) + %(width)s::interval)"""
+
+def refresh_late_history(timescale_client: Session, rows: list):
+    # Buckets already materialized are only refreshed by the policies within their look back, the aggregates of
+    # readings older than that are refreshed here or the readings would never show in the history.
+    # A failed refresh is logged, the readings are stored and writing them again would duplicate them.
+    now = datetime.now(timezone.utc)
+    last_seen = [parse_last_seen(last_seen) for _, _, last_seen, _ in rows]
+    for view, width, look_back in HISTORY_BUCKETS.values():
+        late = [timestamp for timestamp in last_seen if timestamp < now - look_back]
+        if not late:
+            continue
+        try:
+            timescale_client.execute_autocommit(REFRESH_AGGREGATE, {"view": view, "width": width, "start": min(late), "end": max(late)})
+        except Exception:
+            logger.exception("Failed to refresh %s for %d late readings", view, len(late))
+
+HISTORY_COLUMNS = ", ".join(f"{metric}_avg, {metric}_min, {metric}_max, {metric}_count" for metric in METRICS)
+
 def get_data(redis: Session, sensor_id: int, db: Session, mongodb_client: Session, timescale_client:Session , from_date:  Optional[datetime] = None, to_date:  Optional[datetime]  = None, bucket: Optional[str] = None):
 
-    # get sensor from postgresql with sensor_id
-    db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
-    if not db_sensor:
+    metadata = get_sensor_metadata(db, mongodb_client, sensor_id)
+    if metadata is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
     
-    # get sensor from redis with sensor_id
-    redis_sensor = redis.get(f"sensor-{sensor_id}")
-    if not redis_sensor:
+    # a sensor without data in redis has never sent a reading
+    if not redis.get(f"sensor-{sensor_id}"):
         raise HTTPException(status_code=404, detail="Sensor not found")
-    # convert redis sensor byte format to json format
-    redis_sensor = schemas.SensorData.parse_raw(redis_sensor)
 
-    # get sensor from mongodb with sensor_id
-    mongodb_client.getDatabase("sensors")
-    mongodb_client.getCollection("sensorsCol")
-    mongodb_sensor = mongodb_client.findOne({"sensor_id": sensor_id})
-
-    sensor = schemas.Sensor(id=sensor_id, name=db_sensor.name, 
-                            latitude=mongodb_sensor["location"]["coordinates"][0], 
-                            longitude=mongodb_sensor["location"]["coordinates"][1],
-                            type=mongodb_sensor["type"], 
-                            mac_address=mongodb_sensor["mac_address"],
-                            joined_at=db_sensor.joined_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), 
-                            temperature=redis_sensor.temperature, 
-                            velocity=redis_sensor.velocity,
-                            humidity=redis_sensor.humidity, 
-                            battery_level=redis_sensor.battery_level, 
-                            last_seen=redis_sensor.last_seen,
-                            description=mongodb_sensor["description"])
-
-    timescale_client.execute(f"SELECT * FROM sensor_data WHERE sensor_id = {sensor_id};")
-    rows = timescale_client.fetchall()
+    if (bucket or "day") not in HISTORY_BUCKETS:
+        raise HTTPException(status_code=400, detail="Invalid bucket size")
+    view, width, _ = HISTORY_BUCKETS[bucket or "day"]
+
+    # the buckets containing from_date and to_date are returned whole.
+    # The views are materialized on a schedule and real-time aggregation adds the rows not materialized yet.
+    conditions = ["sensor_id = %(sensor_id)s"]
+    if from_date is not None:
+        conditions.append("bucket >= time_bucket(%(width)s::interval, %(from_date)s::timestamptz)")
+    if to_date is not None:
+        conditions.append("bucket <= time_bucket(%(width)s::interval, %(to_date)s::timestamptz)")
+
+    rows = timescale_client.select(f"""
+    SELECT bucket, readings, {HISTORY_COLUMNS}
+    FROM {view}
+    WHERE {" AND ".join(conditions)}
+    ORDER BY bucket;
+    """, {"sensor_id": sensor_id, "width": width, "from_date": from_date, "to_date": to_date})
 
-    
     listResult = []
     for row in rows:
-        id, sensor_id, data, last_seen = row
-        from_dt = datetime.strptime(str(from_date), "%Y-%m-%d %H:%M:%S%z")
-        to_dt = datetime.strptime(str(to_date), "%Y-%m-%d %H:%M:%S%z")
-        last_seen_dt = datetime.strptime(str(last_seen), "%Y-%m-%d %H:%M:%S%z")
-
-        if bucket == "month":
-            _last = last_seen_dt.strftime("%Y-%m")
-            _from = from_dt.strftime("%Y-%m") 
-            _to = to_dt.strftime("%Y-%m") 
-        elif bucket == "week":
-            _last = last_seen_dt.strftime("%Y-%U")  
-            _from = from_dt.strftime("%Y-%U")  
-            _to = to_dt.strftime("%Y-%U") 
-        elif bucket == "day":
-            _last = last_seen_dt.strftime("%Y-%m-%d") 
-            _from = from_dt.strftime("%Y-%m-%d") 
-            _to = to_dt.strftime("%Y-%m-%d") 
-        elif bucket == "hour":
-            _last = last_seen_dt.strftime("%Y-%m-%d %H")  
-            _from = from_dt.strftime("%Y-%m-%d %H") 
-            _to = to_dt.strftime("%Y-%m-%d %H") 
-
-
-        if _from <= _last and _last <= _to:
-            
-            if(_last not in listResult):
-                listResult.append(_last)
+        result = {"bucket": row[0].isoformat(), "readings": row[1]}
+        for i, metric in enumerate(METRICS):
+            result[metric] = dict(zip(("avg", "min", "max", "count"), row[2 + 4 * i:6 + 4 * i]))
+        listResult.append(result)
 
     return listResult
 
-def get_sensors_near(latitude: float, longitude: float, radius: int, db: Session, mongodb_client: Session, redis_client: Session) -> list[schemas.Sensor]: 
+NEAR_PROJECTION = {"_id": 0, "sensor_id": 1, "location": 1, "type": 1, "mac_address": 1, "description": 1}
+
+def get_sensors_near(latitude: float, longitude: float, radius: int, db: Session, mongodb_client: Session, redis_client: Session, limit: int = 0) -> list[schemas.Sensor]: 
     
-    # get sensors from mongodb with sensor_id
+    # find sensors near to a given location, closest first, the 2dsphere index is created on startup
     mongodb_client.getDatabase("sensors")
-    collection = mongodb_client.getCollection("sensorsCol")
-
-    # find sensors near to a given location
-    collection.create_index([("location", "2dsphere")])
+    mongodb_client.getCollection("sensorsCol")
     geoJSON = {
         "location": {
             "$near": {
@@ -249,23 +406,40 @@ def get_sensors_near(latitude: float, longitude: float, radius: int, db: Session
             }
         }
     }
-    nearby_sensors = list(mongodb_client.findAllDocuments(geoJSON))
-    sensors = []
-
-    # find all sensors near to a given location
-    for doc in nearby_sensors:
-        doc["_id"] = str(doc["_id"])
-        sensor = get_data(redis=redis_client, sensor_id=doc["sensor_id"], db=db, mongodb_client=mongodb_client)
-        if sensor:
-            sensors.append(sensor)
-    
-    if not sensors :
+    nearby_sensors = list(mongodb_client.findAllDocuments(geoJSON, projection=NEAR_PROJECTION, limit=limit))
+    if not nearby_sensors:
         return []
+
+    # enrich every sensor with one postgresql query and one redis round trip
+    sensor_ids = [doc["sensor_id"] for doc in nearby_sensors]
+    db_sensors = {db_sensor.id: db_sensor for db_sensor in db.query(models.Sensor).filter(models.Sensor.id.in_(sensor_ids)).all()}
+    latest = redis_client.mget([f"sensor-{sensor_id}" for sensor_id in sensor_ids])
+
+    sensors = []
+    for doc, redis_sensor in zip(nearby_sensors, latest):
+        db_sensor = db_sensors.get(doc["sensor_id"])
+        # sensors that never sent a reading have no current values to report
+        if db_sensor is None or redis_sensor is None:
+            continue
+        redis_sensor = schemas.SensorData.parse_raw(redis_sensor)
+        sensors.append(schemas.Sensor(id=db_sensor.id, name=db_sensor.name, 
+                                      latitude=doc["location"]["coordinates"][0], 
+                                      longitude=doc["location"]["coordinates"][1],
+                                      type=doc["type"], 
+                                      mac_address=doc["mac_address"],
+                                      joined_at=db_sensor.joined_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), 
+                                      temperature=redis_sensor.temperature, 
+                                      velocity=redis_sensor.velocity,
+                                      humidity=redis_sensor.humidity, 
+                                      battery_level=redis_sensor.battery_level, 
+                                      last_seen=redis_sensor.last_seen,
+                                      description=doc["description"]))
     
     return sensors
 
 
-def delete_sensor(db: Session, sensor_id: int, mongodb_client: Session):
+def delete_sensor(db: Session, sensor_id: int, mongodb_client: Session, redis: Session, elastic_client: Session):
+    metadata = get_sensor_metadata(db, mongodb_client, sensor_id)
 
     # delete sensor from postgresql with sensor_id
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
@@ -279,14 +453,37 @@ def delete_sensor(db: Session, sensor_id: int, mongodb_client: Session):
 
     db.delete(db_sensor)
     db.commit()
+    metadata_cache.publish_invalidation(redis, sensor_id)
+    elastic_client.delete_document(SENSORS_INDEX, sensor_id)
+
+    pipe = redis.pipeline()
+    pipe.delete(stats_key(sensor_id), latest_seen_key(sensor_id))
+    for metric in METRICS:
+        pipe.zrem(latest_key(metric), sensor_id)
+    if metadata is not None:
+        pipe.srem(stats_sensors_key(metadata["type"]), sensor_id)
+    pipe.execute()
     
     return db_sensor
 
 
-def search_sensors(db: Session,  mongodb: Session, es: Session, query: str, size: int, search_type: str) -> list[schemas.Sensor]: 
+def parse_search_query(query: str) -> dict:
+    # the query is a JSON object with a single field, e.g. {"name": "Sensor 1"}
+    try:
+        query_dict = json.loads(query)
+    except ValueError:
+        try:
+            query_dict = ast.literal_eval(query)
+        except (ValueError, SyntaxError):
+            raise HTTPException(status_code=400, detail="Invalid search query")
+    if not isinstance(query_dict, dict) or len(query_dict) != 1:
+        raise HTTPException(status_code=400, detail="Search query must have exactly one field")
+    return query_dict
+
+
+def search_sensors(db: Session,  mongodb: Session, es: Session, query: str, size: int, search_type: str, from_: int = 0) -> list[schemas.Sensor]: 
 
-    query_dict = eval(query)
-    elasic_index_name = 'sensors'
+    query_dict = parse_search_query(query)
     
     query_type = search_type if search_type else 'match'
     search_type = list(query_dict.keys())[0]
@@ -312,19 +509,24 @@ def search_sensors(db: Session,  mongodb: Session, es: Session, query: str, size
             }
         }
 
-    results = es.search(index_name=elasic_index_name, query=search_query)
+    # elasticsearch only returns the requested page and the fields used below
+    results = es.search(index_name=SENSORS_INDEX, query=search_query, size=size, from_=from_, source=["id", "name", "description"])
+    hits = [hit['_source'] for hit in results['hits']['hits']]
+    if not hits:
+        return []
 
-    sensors = []
+    # details of every hit with a single mongodb query
     mongodb.getDatabase("sensors")
     mongodb.getCollection("sensorsCol")
+    mongodb_sensors = {doc["sensor_id"]: doc for doc in mongodb.findAllDocuments({"sensor_id": {"$in": [int(hit['id']) for hit in hits]}}, projection={"_id": 0})}
 
-    for hit in results['hits']['hits']:
-        sensor_data = hit['_source']
-        id = sensor_data['id']
-        mongodb_sensor = mongodb.findOne({"sensor_id": id})
-
+    sensors = []
+    for sensor_data in hits:
+        id = int(sensor_data['id'])
+        mongodb_sensor = mongodb_sensors.get(id)
+        # a document can outlive its sensor when the delete from the index failed
         if mongodb_sensor is None:
-            raise HTTPException(status_code=404, detail="Sensor not found in MongoDB")
+            continue
 
         sensor = {"id": id, 
                 "name": sensor_data['name'], 
@@ -340,58 +542,28 @@ def search_sensors(db: Session,  mongodb: Session, es: Session, query: str, size
                 }
         sensors.append(sensor)
 
-
-
-    return sensors[:size]
+    return sensors
 
 
 
 def get_values_sensor_temperatura(db:Session, redis:Session, mongodb_client:Session, timescale_client:Session, cassandra_client:Session):
-    mongodb_client.getDatabase("sensors")
-    mongodb_client.getCollection("sensorsCol")
-    result = list(mongodb_client.findAllDocuments())
-
-    sensors_data = cassandra_client.get_session_keyspace().execute("SELECT * FROM sensor.sensor_data;")
-    temperature_stats = {}
-    for sensor_data in list(sensors_data):
-        if sensor_data.type_sensor == 'Temperatura':
-
-            data = json.loads(sensor_data.data)
-            sensor_id = int(sensor_data.sensor_id)
-            temperature = data['temperature']
-
-            if sensor_id in temperature_stats:
-                temperature_stats[sensor_id].append(temperature)
-            else:
-                temperature_stats[sensor_id] = [temperature]
-
-    temperature_stats_res = {}
-    for sensor_id, temperatures in temperature_stats.items():
-        max_temperature = max(temperatures)
-        min_temperature = min(temperatures)
-        average_temperature = sum(temperatures) / len(temperatures)
-        temperature_stats_res[sensor_id] = {"max_temperature": max_temperature, "min_temperature": min_temperature, "average_temperature": average_temperature}
+    # the statistics are maintained at ingest time, so this only reads one hash per temperature sensor
+    sensor_ids = sorted(int(sensor_id) for sensor_id in redis.smembers(stats_sensors_key("Temperatura")))
+    pipe = redis.pipeline()
+    for sensor_id in sensor_ids:
+        pipe.hgetall(stats_key(sensor_id))
+    stats = dict(zip(sensor_ids, pipe.execute()))
 
+    sensors = get_sensors_metadata(db, mongodb_client, sensor_ids)
 
     sensor_data_list = []
-    sorted_temperature_stats_res = {k: temperature_stats_res[k] for k in sorted(temperature_stats_res)}
-    for sensor_data in sorted_temperature_stats_res:
-        data_low_battery = {
-            "id": int(sensor_data),
-            "name": result[int(str(sensor_data))-1]['name'],
-            "latitude":  result[int(str(sensor_data))-1]['location']['coordinates'][0], 
-            "longitude":  result[int(str(sensor_data))-1]['location']['coordinates'][1], 
-            "type":  result[int(str(sensor_data))-1]['type'], 
-            "mac_address":  result[int(str(sensor_data))-1]['mac_address'], 
-            "manufacturer": result[int(str(sensor_data))-1]['manufacturer'], 
-            "model": result[int(str(sensor_data))-1]['model'], 
-            "serie_number":  result[int(str(sensor_data))-1]['serie_number'], 
-            "firmware_version":  result[int(str(sensor_data))-1]['firmware_version'], 
-            "description": result[int(str(sensor_data))-1]['description'], 
-            "values": temperature_stats_res[sensor_data]
-        }
-
-        sensor_data_list.append(data_low_battery)
+    for sensor_id in sensor_ids:
+        values = {field.decode(): float(value) for field, value in stats[sensor_id].items()}
+        if sensor_id not in sensors or not values.get("temperature:count"):
+            continue
+        sensor = {field: sensors[sensor_id][field] for field in SENSOR_FIELDS}
+        sensor["values"] = {"max_temperature": values["temperature:max"], "min_temperature": values["temperature:min"], "average_temperature": values["temperature:sum"] / values["temperature:count"]}
+        sensor_data_list.append(sensor)
 
     return  {"sensors": sensor_data_list}
 
@@ -400,46 +572,37 @@ def get_quantity_by_type(db:Session, redis:Session, mongodb_client:Session, time
 
     mongodb_client.getDatabase("sensors")
     mongodb_client.getCollection("sensorsCol")
-    result = mongodb_client.findAllDocuments()
+    # counted by mongodb over the type index, no sensor document leaves the server
+    result = mongodb_client.aggregate([
+        {"$group": {"_id": "$type", "quantity": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ])
 
-    sensor_count = defaultdict(int)
-    for sensor in result:
-        sensor_count[sensor['type']] += 1
+    return {"sensors": [{"type": row["_id"], "quantity": row["quantity"]} for row in result]}
 
-    result = {"sensors": [{"type": key, "quantity": value} for key, value in sensor_count.items()]}
+def get_latest_in_range(db: Session, redis: Session, mongodb_client: Session, metric: str, gt: Optional[float] = None, gte: Optional[float] = None, lt: Optional[float] = None, lte: Optional[float] = None):
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid metric, expected one of {list(METRICS)}")
+    if (gt is not None and gte is not None) or (lt is not None and lte is not None):
+        raise HTTPException(status_code=400, detail="Use only one lower and one upper bound")
 
-    return result
+    # redis excludes a bound prefixed with (
+    lower = f"({gt}" if gt is not None else gte if gte is not None else "-inf"
+    upper = f"({lt}" if lt is not None else lte if lte is not None else "+inf"
+    latest = {int(sensor_id): value for sensor_id, value in redis.zrangebyscore(latest_key(metric), lower, upper)}
 
-def get_low_battery(db:Session, redis:Session, mongodb_client:Session, timescale_client:Session, cassandra_client:Session):
-    mongodb_client.getDatabase("sensors")
-    mongodb_client.getCollection("sensorsCol")
-    result = list(mongodb_client.findAllDocuments())
-
-    sensors_data = cassandra_client.get_session_keyspace().execute("SELECT * FROM sensor.sensor_data;")
+    sensors = get_sensors_metadata(db, mongodb_client, sorted(latest))
 
     sensor_data_list = []
+    for sensor_id in sorted(latest):
+        if sensor_id not in sensors:
+            continue
+        sensor = {field: sensors[sensor_id][field] for field in SENSOR_FIELDS}
+        sensor[metric] = latest[sensor_id]
+        sensor_data_list.append(sensor)
 
-    for sensor_data in list(sensors_data):
-        data = json.loads(sensor_data.data)
-        if data['battery_level'] < 0.2:
-
-            data_low_battery = {
-                "id": int(sensor_data.sensor_id),
-                "name": result[int(str(sensor_data.sensor_id))-1]['name'],
-                "latitude":  result[int(str(sensor_data.sensor_id))-1]['location']['coordinates'][0], 
-                "longitude":  result[int(str(sensor_data.sensor_id))-1]['location']['coordinates'][1], 
-                "type":  result[int(str(sensor_data.sensor_id))-1]['type'], 
-                "mac_address":  result[int(str(sensor_data.sensor_id))-1]['mac_address'], 
-                "manufacturer": result[int(str(sensor_data.sensor_id))-1]['manufacturer'], 
-                "model": result[int(str(sensor_data.sensor_id))-1]['model'], 
-                "serie_number":  result[int(str(sensor_data.sensor_id))-1]['serie_number'], 
-                "firmware_version":  result[int(str(sensor_data.sensor_id))-1]['firmware_version'], 
-                "description": result[int(str(sensor_data.sensor_id))-1]['description'], 
-                "battery_level": data['battery_level']
-            }
-
-            sensor_data_list.append(data_low_battery)
-
-    sorted_sensors = sorted(sensor_data_list, key=lambda sensor: sensor['id'])
+    return  {"sensors": sensor_data_list}
 
-    return  {"sensors": sorted_sensors}
\ No newline at end of file
+def get_low_battery(db:Session, redis:Session, mongodb_client:Session, timescale_client:Session, cassandra_client:Session):
+    # sensors whose latest reading reports less than 20% battery
+    return get_latest_in_range(db=db, redis=redis, mongodb_client=mongodb_client, metric="battery_level", lt=0.2)
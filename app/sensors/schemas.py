@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import Optional
+from datetime import datetime
+
+from pydantic import BaseModel, validator
+from typing import List, Optional
 
 class Sensor(BaseModel):
     id: int
@@ -37,4 +39,19 @@ class SensorData(BaseModel):
     temperature: Optional[float]
     humidity: Optional[float]
     battery_level: float
-    last_seen: str
\ No newline at end of file
+    last_seen: str
+
+    @validator("last_seen")
+    def last_seen_is_a_timestamp(cls, value):
+        # kept as sent, but the history databases can only store ISO 8601 timestamps
+        try:
+            datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError("last_seen must be an ISO 8601 timestamp")
+        return value
+
+class SensorReading(SensorData):
+    sensor_id: int
+
+class SensorDataBatch(BaseModel):
+    readings: List[SensorReading]
\ No newline at end of file
@@ -0,0 +1,49 @@
+from app.sensors.cache import SensorMetadataCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_counts_hits_and_misses():
+    cache = SensorMetadataCache(maxsize=10, ttl=60)
+    assert cache.get(1) is None
+    cache.put(1, {"id": 1, "name": "Sensor 1"})
+    assert cache.get(1) == {"id": 1, "name": "Sensor 1"}
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+def test_cache_evicts_least_recently_used():
+    cache = SensorMetadataCache(maxsize=2, ttl=60)
+    cache.put(1, {"id": 1})
+    cache.put(2, {"id": 2})
+    cache.get(1)
+    cache.put(3, {"id": 3})
+    assert cache.get(2) is None
+    assert cache.get(1) == {"id": 1}
+    assert cache.get(3) == {"id": 3}
+
+def test_cache_expires_entries():
+    clock = FakeClock()
+    cache = SensorMetadataCache(maxsize=10, ttl=60, clock=clock)
+    cache.put(1, {"id": 1})
+    clock.now = 61
+    assert cache.get(1) is None
+    assert cache.stats()["size"] == 0
+
+def test_cache_invalidation_message():
+    cache = SensorMetadataCache(maxsize=10, ttl=60)
+    cache.put(1, {"id": 1})
+    cache.put(2, {"id": 2})
+    cache._on_invalidation({"channel": b"sensor-metadata-invalidate", "data": b"1"})
+    assert cache.get(1) is None
+    assert cache.get(2) == {"id": 2}
+
+def test_cache_returns_copies():
+    cache = SensorMetadataCache(maxsize=10, ttl=60)
+    cache.put(1, {"id": 1})
+    cache.get(1)["values"] = {}
+    assert cache.get(1) == {"id": 1}
@@ -0,0 +1,111 @@
+# Query parameters and error answers of the read endpoints, served by the app on the in-memory stand-ins
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.resources import resources
+from benchmarks.standins import StandIns
+
+client = TestClient(app)
+
+SENSORS = [
+    # name, type, latitude, longitude, battery level
+    ("Velocitat 1", "Velocitat", 41.3870, 2.1700, 0.1),
+    ("Velocitat 2", "Velocitat", 41.3875, 2.1705, 0.5),
+    ("Velocitat 3", "Velocitat", 41.3890, 2.1720, 0.2),
+    ("Temperatura 1", "Temperatura", 41.4500, 2.2500, 0.9),
+]
+
+
+@pytest.fixture(autouse=True)
+def standins():
+    standins = StandIns()
+    standins.install(app, resources)
+    for index, (name, sensor_type, latitude, longitude, battery_level) in enumerate(SENSORS):
+        response = client.post("/sensors", json={"name": name, "latitude": latitude, "longitude": longitude, "type": sensor_type,
+                                                 "mac_address": f"00:00:00:00:00:0{index}", "manufacturer": "Dummy", "model": "Dummy",
+                                                 "serie_number": "0000", "firmware_version": "1.0", "description": f"Sensor {name}"})
+        assert response.status_code == 200
+        response = client.post(f"/sensors/{response.json()['id']}/data", json={"velocity": 10.0, "temperature": 20.0, "battery_level": battery_level,
+                                                                              "last_seen": "2020-01-01T00:00:00.000Z"})
+        assert response.status_code == 200
+    yield standins
+    standins.uninstall(app, resources)
+
+
+def near(**params):
+    return client.get("/sensors/near", params={"latitude": 41.3870, "longitude": 2.1700, "radius": 1000, **params})
+
+
+def test_near_returns_every_sensor_in_the_radius_closest_first():
+    response = near()
+    assert response.status_code == 200
+    assert [sensor["name"] for sensor in response.json()] == ["Velocitat 1", "Velocitat 2", "Velocitat 3"]
+
+def test_near_limit():
+    response = near(limit=2)
+    assert response.status_code == 200
+    assert [sensor["name"] for sensor in response.json()] == ["Velocitat 1", "Velocitat 2"]
+
+def test_near_negative_limit():
+    assert near(limit=-1).status_code == 422
+
+
+def search(**params):
+    return client.get("/sensors/search", params={"query": '{"type": "Velocitat"}', **params})
+
+
+def test_search_size():
+    response = search(size=2)
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_search_from_pages_through_the_hits():
+    first = [sensor["id"] for sensor in search(size=2).json()]
+    rest = [sensor["id"] for sensor in search(size=2, **{"from": 2}).json()]
+    assert len(rest) == 1
+    assert sorted(first + rest) == [1, 2, 3]
+
+def test_search_from_past_the_last_hit():
+    response = search(**{"from": 10})
+    assert response.status_code == 200
+    assert response.json() == []
+
+def test_search_negative_size_or_from():
+    assert search(size=-1).status_code == 422
+    assert search(**{"from": -1}).status_code == 422
+
+def test_search_invalid_query():
+    response = client.get("/sensors/search", params={"query": "{type: Velocitat"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid search query"
+
+def test_search_query_with_several_fields():
+    response = client.get("/sensors/search", params={"query": '{"type": "Velocitat", "name": "Velocitat 1"}'})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Search query must have exactly one field"
+
+def test_search_query_not_an_object():
+    response = client.get("/sensors/search", params={"query": '["Velocitat"]'})
+    assert response.status_code == 400
+
+
+def latest(**params):
+    return client.get("/sensors/latest", params={"metric": "battery_level", **params})
+
+
+def test_latest_exclusive_and_inclusive_bounds():
+    assert [sensor["name"] for sensor in latest(gt=0.1, lt=0.5).json()["sensors"]] == ["Velocitat 3"]
+    assert [sensor["name"] for sensor in latest(gte=0.1, lte=0.5).json()["sensors"]] == ["Velocitat 1", "Velocitat 2", "Velocitat 3"]
+
+def test_latest_conflicting_lower_bounds():
+    response = latest(gt=0.1, gte=0.2)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Use only one lower and one upper bound"
+
+def test_latest_conflicting_upper_bounds():
+    assert latest(lt=0.5, lte=0.6).status_code == 400
+
+def test_latest_invalid_metric():
+    response = latest(metric="pressure")
+    assert response.status_code == 400
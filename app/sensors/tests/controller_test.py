@@ -6,7 +6,9 @@ from app.mongodb_client import MongoDBClient
 from app.elasticsearch_client import ElasticsearchClient
 from app.timescale import Timescale
 from app.cassandra_client import CassandraClient
+from app.bootstrap import TIMESCALE_SCHEMA
 import time
+from datetime import datetime, timezone
 
 client = TestClient(app)
 
@@ -24,8 +26,14 @@ def clear_dbs():
     mongo.close()
     es = ElasticsearchClient(host="elasticsearch")
     es.clearIndex("sensors")  
+    # the continuous aggregates of migrations_time depend on sensor_data, it is emptied instead of dropped
     ts = Timescale()
-    ts.execute("DROP TABLE IF EXISTS sensor_data")
+    ts.conn.autocommit = True
+    ts.execute(TIMESCALE_SCHEMA)
+    ts.execute("TRUNCATE sensor_data")
+    # refreshing over the empty table drops the buckets materialized by earlier runs
+    for view in ts.select("SELECT view_name FROM timescaledb_information.continuous_aggregates WHERE hypertable_name = 'sensor_data'"):
+        ts.execute(f"CALL refresh_continuous_aggregate('{view[0]}', NULL, NULL)")
     ts.close()
 
     while True:
@@ -174,6 +182,39 @@ def test_update_sensor_2_data():
     response = client.post("/sensors/2/data", json={"velocity": 46.0,"battery_level": 1.9, "last_seen": "2020-01-01T00:00:01.000Z"})
     assert response.status_code == 200
 
+def bucket_times(response):
+    return [datetime.fromisoformat(bucket["bucket"]) for bucket in response.json()]
+
+def test_get_sensor_data_hourly_edge_buckets():
+    """The buckets containing from and to are returned whole"""
+    response = client.get("/sensors/1/data?from=2020-01-01T00:30:00Z&to=2020-01-01T01:30:00Z&bucket=hour")
+    assert response.status_code == 200
+    assert bucket_times(response) == [datetime(2020, 1, 1, 0, tzinfo=timezone.utc), datetime(2020, 1, 1, 1, tzinfo=timezone.utc)]
+    first, second = response.json()
+    assert first["readings"] == 2
+    assert first["temperature"] == {"avg": pytest.approx(1.5), "min": 1.0, "max": 2.0, "count": 2}
+    assert first["battery_level"] == {"avg": pytest.approx(1.45), "min": 1.0, "max": 1.9, "count": 2}
+    assert first["velocity"] == {"avg": None, "min": None, "max": None, "count": 0}
+    assert second["readings"] == 1
+    assert second["temperature"] == {"avg": pytest.approx(4.0), "min": 4.0, "max": 4.0, "count": 1}
+
+def test_get_sensor_data_from_bucket_start():
+    response = client.get("/sensors/1/data?from=2020-01-01T01:00:00Z&bucket=hour")
+    assert response.status_code == 200
+    assert bucket_times(response) == [datetime(2020, 1, 1, 1, tzinfo=timezone.utc)]
+
+def test_get_sensor_data_daily():
+    response = client.get("/sensors/1/data?bucket=day")
+    assert response.status_code == 200
+    assert bucket_times(response) == [datetime(2020, 1, 1, tzinfo=timezone.utc)]
+    assert response.json()[0]["readings"] == 3
+    assert response.json()[0]["temperature"]["max"] == 4.0
+
+def test_get_sensor_data_invalid_bucket():
+    response = client.get("/sensors/1/data?bucket=minute")
+    assert response.status_code == 400
+    assert "Invalid bucket size" in response.text
+
 def test_search_sensors_name_similar():
     """Sensors can be properly searched by name"""
     response = client.get('/sensors/search?query={"name":"Velocidad 1"}&search_type=similar')
@@ -193,4 +234,28 @@ def test_delete_sensor_1():
 
 def test_delete_sensor_2():
     response = client.delete("/sensors/2")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_post_sensor_data_batch():
+    response = client.post("/sensors/data/batch", json={"readings": [
+        {"sensor_id": 3, "velocity": 20.0, "battery_level": 0.9, "last_seen": "2020-01-03T00:00:00.000Z"},
+        {"sensor_id": 4, "temperature": 18.0, "humidity": 1.0, "battery_level": 0.9, "last_seen": "2020-01-03T00:00:00.000Z"},
+        {"sensor_id": 4, "temperature": 19.0, "humidity": 1.0, "battery_level": 0.8, "last_seen": "2020-01-03T01:00:00.000Z"}]})
+    assert response.status_code == 200
+    assert response.json() == {"readings": 3, "sensors": 2}
+
+def test_post_sensor_data_batch_not_exists():
+    response = client.post("/sensors/data/batch", json={"readings": [
+        {"sensor_id": 3, "velocity": 20.0, "battery_level": 0.9, "last_seen": "2020-01-03T02:00:00.000Z"},
+        {"sensor_id": 1, "temperature": 1.0, "humidity": 1.0, "battery_level": 1.0, "last_seen": "2020-01-03T02:00:00.000Z"}]})
+    assert response.status_code == 404
+    assert "Sensor not found" in response.text
+
+def test_get_sensors_latest_battery_level():
+    response = client.get("/sensors/latest?metric=battery_level&gt=0.85")
+    assert response.status_code == 200
+    assert response.json() == {"sensors": [{"id": 3, "name": "Velocitat 2", "latitude": 2.0, "longitude": 2.0, "type": "Velocitat", "mac_address": "00:00:00:00:00:02", "manufacturer": "Dummy", "model":"Dummy Vel", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de velocitat model Dummy Vel del fabricant Dummy cruïlla 2", "battery_level": 0.9}]}
+
+def test_get_sensors_latest_invalid_metric():
+    response = client.get("/sensors/latest?metric=pressure&lt=1")
+    assert response.status_code == 400
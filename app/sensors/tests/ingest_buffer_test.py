@@ -0,0 +1,110 @@
+import threading
+
+from app.sensors.ingest_buffer import WriteBehindBuffer
+
+
+def test_buffer_flushes_full_batches():
+    batches = []
+    flushed = threading.Event()
+
+    def write(rows):
+        batches.append(rows)
+        flushed.set()
+
+    buffer = WriteBehindBuffer(write, batch_size=3, flush_interval=60)
+    buffer.start()
+    buffer.append([1, 2, 3, 4])
+    assert flushed.wait(5)
+    buffer.stop()
+    assert batches == [[1, 2, 3], [4]]
+
+def test_buffer_drains_on_stop():
+    batches = []
+    buffer = WriteBehindBuffer(batches.append, batch_size=100, flush_interval=60)
+    buffer.start()
+    buffer.append([1, 2])
+    buffer.stop()
+    assert batches == [[1, 2]]
+    assert buffer.pending() == 0
+
+def test_buffer_retries_failed_flush():
+    batches = []
+    flushed = threading.Event()
+
+    def write(rows):
+        if not batches:
+            batches.append(None)
+            raise RuntimeError("timescale unavailable")
+        batches.append(rows)
+        flushed.set()
+
+    buffer = WriteBehindBuffer(write, batch_size=2, flush_interval=60, retry_interval=0)
+    buffer.start()
+    buffer.append([1, 2])
+    assert flushed.wait(5)
+    buffer.stop()
+    assert batches == [None, [1, 2]]
+
+def test_buffer_drops_rows_the_databases_refuse():
+    written = []
+    done = threading.Event()
+
+    def write(rows):
+        if "bad" in rows:
+            raise ValueError("invalid timestamp")
+        written.extend(rows)
+        if len(written) == 5:
+            done.set()
+
+    buffer = WriteBehindBuffer(write, batch_size=6, flush_interval=60, retry_interval=0)
+    buffer.start()
+    buffer.append(["bad", 1, 2, 3, 4, 5])
+    assert done.wait(5)
+    buffer.stop()
+    assert written == [1, 2, 3, 4, 5]
+
+def test_buffer_keeps_a_single_row_while_the_databases_are_down():
+    attempts = []
+    done = threading.Event()
+
+    def write(rows):
+        attempts.append(rows)
+        if len(attempts) < 20:
+            raise ConnectionError("timescale down")
+        done.set()
+
+    buffer = WriteBehindBuffer(write, batch_size=1, flush_interval=60, retry_interval=0)
+    buffer.start()
+    buffer.append([1])
+    assert done.wait(5)
+    buffer.stop()
+    assert attempts == [[1]] * 20
+
+def test_stop_retries_the_last_flush_for_a_bounded_time():
+    attempts = []
+
+    def write(rows):
+        attempts.append(rows)
+        if len(attempts) < 3:
+            raise ConnectionError("timescale down")
+
+    buffer = WriteBehindBuffer(write, batch_size=100, flush_interval=60, retry_interval=0.01, stop_timeout=5)
+    buffer.start()
+    buffer.append([1, 2])
+    buffer.stop()
+    assert attempts == [[1, 2]] * 3
+
+    def down(rows):
+        raise ConnectionError("timescale down")
+
+    buffer = WriteBehindBuffer(down, batch_size=100, flush_interval=60, retry_interval=0.01, stop_timeout=0.1)
+    buffer.start()
+    buffer.append([1, 2])
+    buffer.stop()
+    assert buffer.pending() == 0
+
+def test_append_times_out_when_full():
+    buffer = WriteBehindBuffer(lambda rows: None, batch_size=10, max_pending=2)
+    assert buffer.append([1, 2])
+    assert not buffer.append([3], timeout=0.01)
+    assert buffer.pending() == 2
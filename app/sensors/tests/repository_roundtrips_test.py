@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+from app.sensors.cache import metadata_cache
+from benchmarks.repository_bench import measure, operations, populate
+from benchmarks.standins import StandIns
+
+
+def round_trips(sensors):
+    metadata_cache.invalidate()
+    standins = StandIns()
+    try:
+        populate(standins, sensors)
+        return {name: measure(standins, function, repeat=3, max_seconds=10, cold_cache=True)["round_trips"]
+                for name, function in operations(standins, sensors, random.Random(0)).items()}
+    finally:
+        standins.database.close()
+        metadata_cache.invalidate()
+
+
+@pytest.fixture(scope="module")
+def small_and_large():
+    return round_trips(10), round_trips(500)
+
+
+@pytest.mark.parametrize("operation", ["record_data", "record_data_batch", "get_sensor", "get_data", "get_sensors_near",
+                                       "get_values_sensor_temperatura", "get_quantity_by_type", "get_latest_in_range"])
+def test_round_trips_do_not_grow_with_the_fleet(small_and_large, operation):
+    small, large = small_and_large
+    assert large[operation] == small[operation]
+
+def test_record_data_batch_makes_one_round_trip_per_backend(small_and_large):
+    _, large = small_and_large
+    # redis is written twice, the latest values first and the statistics once the history is stored
+    assert large["record_data_batch"].pop("redis") == 2
+    assert all(count == 1 for count in large["record_data_batch"].values())
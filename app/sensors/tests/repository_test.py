@@ -0,0 +1,101 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.sensors import repository, schemas
+from app.sensors.cache import metadata_cache
+from benchmarks.repository_bench import populate
+from benchmarks.standins import StandIns
+
+
+@pytest.fixture
+def standins():
+    metadata_cache.invalidate()
+    standins = StandIns()
+    populate(standins, 2, history_sensors=0)
+    yield standins
+    standins.database.close()
+    metadata_cache.invalidate()
+
+
+def record(standins, cassandra, battery_level=0.5, last_seen="2020-01-01T00:00:00+00:00"):
+    db = standins.database.SessionLocal()
+    timescale = standins.timescale.get()
+    try:
+        return repository.record_data(redis=standins.redis, sensor_id=1, data=schemas.SensorData(battery_level=battery_level, last_seen=last_seen),
+                                      db=db, mongodb_client=standins.mongodb, timescale_client=timescale, cassandra_client=cassandra)
+    finally:
+        timescale.close()
+        db.close()
+
+
+def battery_count(standins):
+    return int(standins.redis.hgetall(repository.stats_key(1)).get(b"battery_level:count", 0))
+
+
+def test_stats_are_not_updated_when_the_history_write_fails(standins):
+    before = battery_count(standins)
+
+    class FailingCassandra:
+        def execute_concurrent_statements(self, statements, concurrency=100):
+            raise RuntimeError("cassandra unavailable")
+
+    with pytest.raises(RuntimeError):
+        record(standins, FailingCassandra())
+    assert battery_count(standins) == before
+    record(standins, standins.cassandra)
+    assert battery_count(standins) == before + 1
+
+
+def test_a_late_reading_does_not_replace_the_latest_value(standins):
+    record(standins, standins.cassandra, battery_level=0.95, last_seen="2100-01-01T00:00:00+00:00")
+    record(standins, standins.cassandra, battery_level=0.05, last_seen="2099-12-31T23:00:00Z")
+
+    latest = json.loads(standins.redis.get("sensor-1"))
+    assert latest["battery_level"] == 0.95
+    assert latest["last_seen"] == "2100-01-01T00:00:00+00:00"
+    assert standins.redis.zrangebyscore(repository.latest_key("battery_level"), 0.9, 1.0) == [(b"1", 0.95)]
+    assert standins.redis.zrangebyscore(repository.latest_key("battery_level"), 0.0, 0.1) == []
+
+
+def test_the_newest_reading_of_a_batch_is_the_latest_value(standins):
+    rows = [(1, {"battery_level": 0.7}, "2100-01-01T02:00:00+00:00", None),
+            (1, {"battery_level": 0.3}, "2100-01-01T01:00:00+00:00", None)]
+    repository.store_latest(standins.redis, rows)
+    assert json.loads(standins.redis.get("sensor-1"))["battery_level"] == 0.7
+
+
+def test_readings_by_type_are_spread_over_shards(standins, monkeypatch):
+    monkeypatch.setattr(repository, "READINGS_BY_TYPE_SHARDS", 4)
+    rows = [(sensor_id, {"battery_level": 0.5}, "2100-01-01T00:00:00+00:00", "Temperatura") for sensor_id in (5, 6, 9)]
+    repository.write_cassandra_readings(standins.cassandra, rows)
+
+    shards = standins.cassandra.execute("SELECT shard FROM sensor.sensor_reading_days WHERE type_sensor = ?", ["Temperatura"])
+    assert {row.shard for row in shards} >= {1, 2}
+    readings = repository.get_readings_by_type(standins.cassandra, "Temperatura", "sensor_id, last_seen")
+    assert sorted(reading.sensor_id for reading in readings if reading.last_seen.year == 2100) == [5, 6, 9]
+
+
+def test_late_readings_refresh_the_aggregates_their_policies_no_longer_cover():
+    class Timescale:
+        def __init__(self):
+            self.refreshed = []
+
+        def execute_autocommit(self, query, params=None):
+            self.refreshed.append((params["view"], params["start"], params["end"]))
+
+    now = datetime.now(timezone.utc)
+    rows = [(1, {}, (now - timedelta(days=age)).isoformat(), "Temperatura") for age in (0, 10, 30)]
+    timescale = Timescale()
+    repository.refresh_late_history(timescale, rows)
+    # the weekly policy still covers the 10 days old reading, the monthly and yearly ones both
+    assert [(view, end - start) for view, start, end in timescale.refreshed] == [
+        ("sensor_data_hourly", timedelta(days=20)),
+        ("sensor_data_daily", timedelta(days=20)),
+        ("sensor_data_weekly", timedelta(0)),
+    ]
+
+    timescale = Timescale()
+    repository.refresh_late_history(timescale, rows[:1])
+    assert timescale.refreshed == []
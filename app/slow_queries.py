@@ -0,0 +1,111 @@
+# Log of the backend operations slower than SLOW_QUERY_MS, kept in a bounded ring buffer and served by /admin/slow_queries.
+# Statements are stored without their values: bound parameters are never kept, literals in the text and the values
+# of mongo filters are replaced by ?. With SLOW_QUERY_EXPLAIN=1 slow Timescale SELECTs are run again under
+# EXPLAIN (ANALYZE, BUFFERS), at most once every SLOW_QUERY_EXPLAIN_INTERVAL seconds per statement.
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?(?![\w])")
+_SPACES = re.compile(r"\s+")
+
+# frames of these modules are skipped when looking for the caller of a slow operation
+_CLIENT_MODULES = {__name__, "app.metrics", "app.timescale", "app.cassandra_client", "app.mongodb_client"}
+
+
+def redact_statement(statement):
+    statement = _STRING.sub("'?'", str(statement))
+    statement = _NUMBER.sub("?", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+def redact_filter(value):
+    # keeps field names and operators, drops the values
+    if isinstance(value, dict):
+        return {key: redact_filter(item) for key, item in value.items()}
+    return "?"
+
+
+def describe_filter(query):
+    return json.dumps(redact_filter(query or {}), sort_keys=True)
+
+
+def _caller():
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get("__name__") in _CLIENT_MODULES:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}:{frame.f_lineno}"
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=100.0, maxsize=100, explain=False, explain_interval=60.0):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self._entries = deque(maxlen=maxsize)
+        self._explained = {}
+        self._lock = threading.Lock()
+
+    def check(self, backend, operation, statement, seconds, rows=None, explain=None, redact=redact_statement):
+        # Records the operation when it took longer than the threshold, statement is redacted with redact.
+        # explain is an optional function returning the query plan, only called for slow operations.
+        duration_ms = seconds * 1000
+        if duration_ms < self.threshold_ms:
+            return False
+        statement = redact(statement)
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "backend": backend,
+            "operation": operation,
+            "statement": statement,
+            "duration_ms": round(duration_ms, 3),
+            "rows": rows,
+            "caller": _caller(),
+        }
+        if explain is not None and self.explain and self._should_explain(backend, statement):
+            try:
+                entry["plan"] = explain()
+            except Exception as e:
+                entry["plan_error"] = str(e)
+        logger.warning("Slow %s %s (%.1f ms, %s rows) from %s: %s", backend, operation, duration_ms, rows, entry["caller"], statement)
+        with self._lock:
+            self._entries.append(entry)
+        return True
+
+    def _should_explain(self, backend, statement):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get((backend, statement), float("-inf")) < self.explain_interval:
+                return False
+            self._explained[(backend, statement)] = now
+            # forget statements not explained for a while so the map stays bounded
+            if len(self._explained) > 1000:
+                self._explained = {key: at for key, at in self._explained.items() if now - at < self.explain_interval}
+            return True
+
+    def entries(self):
+        # newest first
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._explained.clear()
+
+
+slow_queries = SlowQueryLog(threshold_ms=float(os.environ.get("SLOW_QUERY_MS", "100")),
+                            maxsize=int(os.environ.get("SLOW_QUERY_LOG_SIZE", "100")),
+                            explain=os.environ.get("SLOW_QUERY_EXPLAIN", "0") == "1",
+                            explain_interval=float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "60")))
@@ -0,0 +1,40 @@
+import pytest
+
+from app.metrics import Histogram, instrumented, timed_iter, BACKEND_DURATION, BACKEND_ERRORS
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", ("backend",), buckets=(0.1, 1.0))
+    histogram.observe(("redis",), 0.05)
+    histogram.observe(("redis",), 0.5)
+    histogram.observe(("redis",), 5.0)
+    assert histogram.render() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{backend="redis",le="0.1"} 1',
+        'test_seconds_bucket{backend="redis",le="1.0"} 2',
+        'test_seconds_bucket{backend="redis",le="+Inf"} 3',
+        'test_seconds_count{backend="redis"} 3',
+        'test_seconds_sum{backend="redis"} 5.55',
+    ]
+
+def test_instrumented_counts_calls_and_errors():
+    BACKEND_DURATION.clear()
+    BACKEND_ERRORS.clear()
+
+    @instrumented("test", "fail")
+    def fail():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        fail()
+    assert BACKEND_DURATION._series[("test", "fail")][1] == 1
+    assert BACKEND_ERRORS._values[("test", "fail")] == 1
+
+def test_timed_iter_observes_once_exhausted():
+    BACKEND_DURATION.clear()
+    documents = timed_iter("test", "find", iter([1, 2, 3]))
+    assert next(documents) == 1
+    assert ("test", "find") not in BACKEND_DURATION._series
+    assert list(documents) == [2, 3]
+    assert BACKEND_DURATION._series[("test", "find")][1] == 1
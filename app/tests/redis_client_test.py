@@ -0,0 +1,72 @@
+import threading
+
+import redis
+from redis.client import PubSubWorkerThread
+
+from app import redis_client
+from app.redis_client import RedisClient
+
+
+class FakeConnection:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+        self.down = 0
+
+    def disconnect(self):
+        pass
+
+    def connect(self):
+        if self.down:
+            self.down -= 1
+            raise redis.ConnectionError("Connection refused")
+        self.pubsub.connected = True
+
+
+class FakePubSub:
+    # get_message fails while disconnected, like a redis PubSub whose server went away
+    def __init__(self):
+        self.connected = True
+        self.connection = FakeConnection(self)
+        self.handlers = {}
+        self.received = threading.Event()
+
+    def subscribe(self, **handlers):
+        self.handlers.update(handlers)
+
+    def run_in_thread(self, sleep_time=0, daemon=False, exception_handler=None):
+        thread = PubSubWorkerThread(self, sleep_time, daemon=daemon, exception_handler=exception_handler)
+        thread.start()
+        return thread
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        if not self.connected:
+            raise redis.ConnectionError("Connection closed by server.")
+        self.received.wait(timeout)
+
+    def deliver(self, channel, data):
+        self.handlers[channel]({"type": "message", "channel": channel, "data": data})
+
+    def close(self):
+        pass
+
+
+def test_subscription_survives_a_disconnect(monkeypatch):
+    monkeypatch.setattr(redis_client.time, "sleep", lambda seconds: None)
+    client = RedisClient(host="localhost")
+    pubsub = FakePubSub()
+    monkeypatch.setattr(client._client, "pubsub", lambda ignore_subscribe_messages=False: pubsub)
+    messages = []
+    reconnected = threading.Event()
+    thread = client.subscribe("invalidate", messages.append, on_reconnect=reconnected.set)
+    try:
+        # the server goes away and refuses two reconnections
+        pubsub.connection.down = 2
+        pubsub.connected = False
+        assert reconnected.wait(5)
+        assert thread.is_alive()
+        pubsub.deliver("invalidate", b"1")
+        assert messages == [{"type": "message", "channel": "invalidate", "data": b"1"}]
+    finally:
+        thread.stop()
+        pubsub.received.set()
+        thread.join(5)
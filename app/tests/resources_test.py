@@ -0,0 +1,63 @@
+import pytest
+
+from app import resources as resources_module
+from app.resources import Resources
+
+
+class FakeClient:
+    def __init__(self, name, opened):
+        self.name = name
+        self.closed = False
+        opened.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    # name -> attempts that fail before the backend comes up, None when it never does
+    backends = {"redis": 0, "mongodb": 0, "elasticsearch": 0, "timescale": 0, "cassandra": 0}
+    opened = []
+
+    def client(name):
+        def connect(*args, **kwargs):
+            return FakeClient(name, opened)
+        return connect
+
+    def setup(client):
+        failures = backends[client.name]
+        if failures is None or failures > 0:
+            backends[client.name] = None if failures is None else failures - 1
+            raise ConnectionError(f"{client.name} is starting")
+
+    for name, cls in (("redis", "RedisClient"), ("mongodb", "MongoDBClient"), ("elasticsearch", "ElasticsearchClient"),
+                      ("timescale", "TimescalePool"), ("cassandra", "CassandraClient")):
+        monkeypatch.setattr(resources_module, cls, client(name))
+    for step in ("bootstrap_redis", "bootstrap_mongodb", "bootstrap_elasticsearch", "bootstrap_timescale", "bootstrap_cassandra"):
+        monkeypatch.setattr(resources_module, step, setup)
+    monkeypatch.setattr(resources_module.metadata_cache, "listen", lambda redis: None)
+    monkeypatch.setattr(resources_module.time, "sleep", lambda seconds: None)
+    backends["opened"] = opened
+    return backends
+
+
+def test_open_retries_a_backend_that_is_starting(backends):
+    backends["cassandra"] = 3
+    resources = Resources()
+    resources.open(timeout=60)
+    assert resources.opened
+    # the clients of the failed attempts are closed, the ones in use are not
+    cassandras = [client for client in backends["opened"] if client.name == "cassandra"]
+    assert [client.closed for client in cassandras] == [True, True, True, False]
+    assert resources.cassandra is cassandras[-1]
+
+
+def test_open_closes_the_clients_already_opened_when_a_backend_never_comes_up(backends):
+    backends["timescale"] = None
+    resources = Resources()
+    with pytest.raises(ConnectionError):
+        resources.open(timeout=0)
+    assert not resources.opened
+    assert backends["opened"] and all(client.closed for client in backends["opened"])
+    assert resources.redis is None
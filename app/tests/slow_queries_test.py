@@ -0,0 +1,38 @@
+from app.slow_queries import SlowQueryLog, describe_filter, redact_statement
+
+
+def test_redact_statement_drops_literals():
+    statement = "SELECT * FROM sensor_data WHERE sensor_id = 42 AND data->>'type' = 'Temperatura' AND  value > -1.5"
+    assert redact_statement(statement) == "SELECT * FROM sensor_data WHERE sensor_id = ? AND data->>'?' = '?' AND value > ?"
+
+def test_describe_filter_keeps_fields_and_operators():
+    assert describe_filter({"sensor_id": {"$in": [1, 2]}, "name": "Sensor 1"}) == '{"name": "?", "sensor_id": {"$in": "?"}}'
+
+def test_only_slow_operations_are_recorded():
+    log = SlowQueryLog(threshold_ms=10, maxsize=2)
+    assert not log.check("timescale", "select", "SELECT 1", 0.001)
+    assert log.check("timescale", "select", "SELECT 2", 0.02, rows=1)
+    entry = log.entries()[0]
+    assert entry["statement"] == "SELECT ?"
+    assert entry["rows"] == 1
+    assert "slow_queries_test.test_only_slow_operations_are_recorded" in entry["caller"]
+
+def test_log_keeps_the_newest_entries():
+    log = SlowQueryLog(threshold_ms=0, maxsize=2)
+    for table in ("a", "b", "c"):
+        log.check("cassandra", "execute", f"SELECT * FROM {table}", 0.0)
+    assert [entry["statement"] for entry in log.entries()] == ["SELECT * FROM c", "SELECT * FROM b"]
+
+def test_plans_are_captured_once_per_interval():
+    log = SlowQueryLog(threshold_ms=0, explain=True, explain_interval=60)
+    plans = []
+
+    def explain():
+        plans.append("Seq Scan on sensor_data")
+        return plans[-1:]
+
+    log.check("timescale", "select", "SELECT * FROM sensor_data", 0.1, explain=explain)
+    log.check("timescale", "select", "SELECT * FROM sensor_data", 0.1, explain=explain)
+    assert len(plans) == 1
+    assert log.entries()[1]["plan"] == ["Seq Scan on sensor_data"]
+    assert "plan" not in log.entries()[0]
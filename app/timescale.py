@@ -1,49 +1,164 @@
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import os
+import threading
+import time
+
+from app.metrics import instrumented
+from app.slow_queries import slow_queries
+
+
+def connection_params():
+    return dict(
+        host=os.environ.get("TS_HOST"),
+        port=os.environ.get("TS_PORT"),
+        user=os.environ.get("TS_USER"),
+        password=os.environ.get("TS_PASSWORD"),
+        database=os.environ.get("TS_DBNAME"))
 
 
 class Timescale:
-    def __init__(self):
-        self.conn = psycopg2.connect(
-            host=os.environ.get("TS_HOST"),
-            port=os.environ.get("TS_PORT"),
-            user=os.environ.get("TS_USER"),
-            password=os.environ.get("TS_PASSWORD"),
-            database=os.environ.get("TS_DBNAME"))
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS sensor_data ( id SERIAL PRIMARY KEY, sensor_id INT NOT NULL, data JSONB, last_seen TIMESTAMPTZ NOT NULL);")
+    def __init__(self, conn=None, pool=None):
+        # A client from a TimescalePool borrows a connection on first use and hands it back on close
+        self.pool = pool
+        self._conn = conn
+        self._cursor = None
+        if conn is None and pool is None:
+            self._conn = psycopg2.connect(**connection_params())
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self.pool.getconn()
+        return self._conn
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.conn.cursor()
+        return self._cursor
         
     def getCursor(self):
             return self.cursor
 
     def close(self):
-        self.cursor.close()
-        self.conn.close()
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        if self._conn is None:
+            return
+        if self.pool is not None:
+            self.pool.putconn(self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
     
+    @instrumented("timescale")
     def ping(self):
         return self.conn.ping()
     
-    def execute(self, query):
-       return self.cursor.execute(query)
+    @instrumented("timescale")
+    def execute(self, query, params=None):
+        start = time.perf_counter()
+        result = self.cursor.execute(query, params)
+        self._check_slow("execute", query, params, start, self.cursor.rowcount)
+        return result
     
+    @instrumented("timescale")
     def insert(self, query):
         # Insert values into a table
+        start = time.perf_counter()
         self.cursor.execute(query)
         self.conn.commit()
+        self._check_slow("insert", query, None, start, self.cursor.rowcount)
 
-    def select(self, query):
-        # Select values from a table
-        self.cursor.execute(query)
-        return self.cursor.fetchall()
+    @instrumented("timescale")
+    def insert_many(self, query, rows, page_size=1000):
+        # Insert many rows with multi-row VALUES statements, query must contain a single VALUES %s
+        start = time.perf_counter()
+        execute_values(self.cursor, query, rows, page_size=page_size)
+        self.conn.commit()
+        self._check_slow("insert_many", query, None, start, len(rows))
+
+    @instrumented("timescale")
+    def execute_autocommit(self, query, params=None):
+        # For statements that can not run inside a transaction, e.g. CALL refresh_continuous_aggregate
+        start = time.perf_counter()
+        self.conn.commit()
+        self.conn.autocommit = True
+        try:
+            self.cursor.execute(query, params)
+        finally:
+            self.conn.autocommit = False
+        self._check_slow("execute_autocommit", query, params, start, self.cursor.rowcount)
+
+    @instrumented("timescale")
+    def select(self, query, params=None):
+        # Select values from a table, params are bound by psycopg2
+        start = time.perf_counter()
+        self.cursor.execute(query, params)
+        rows = self.cursor.fetchall()
+        self._check_slow("select", query, params, start, len(rows))
+        return rows
+
+    def explain(self, query, params=None):
+        # Plan of the query as text lines. EXPLAIN ANALYZE runs the query again, only use it for SELECTs.
+        # A savepoint keeps a failing EXPLAIN from aborting the caller's transaction.
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SAVEPOINT explain")
+            try:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                return [row[0] for row in cursor.fetchall()]
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT explain")
+                raise
+            finally:
+                cursor.execute("RELEASE SAVEPOINT explain")
+        finally:
+            cursor.close()
+
+    def _check_slow(self, operation, query, params, start, rows):
+        explain = None
+        if query.lstrip().upper().startswith("SELECT"):
+            explain = lambda: self.explain(query, params)
+        slow_queries.check("timescale", operation, query, time.perf_counter() - start, rows, explain)
 
     def fetchall(self):
         # Fetch all results from the last executed statement
         return self.cursor.fetchall()
     
+    @instrumented("timescale")
     def delete(self, table):
+        start = time.perf_counter()
         self.cursor.execute("DELETE FROM " + table)
         self.conn.commit()
+        self._check_slow("delete", "DELETE FROM " + table, None, start, self.cursor.rowcount)
 
-        
-     
-         
+
+class TimescalePool:
+    def __init__(self, minconn=1, maxconn=int(os.environ.get("TS_POOL_SIZE", "10"))):
+        self.pool = ThreadedConnectionPool(minconn, maxconn, **connection_params())
+        # psycopg2 pools raise when exhausted, callers wait for a free connection instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        # psycopg2 rolls back any transaction left open before the connection is reused
+        self.pool.putconn(conn)
+        self._slots.release()
+
+    def get(self):
+        # The returned client gives its connection back on close()
+        return Timescale(pool=self)
+
+    def close(self):
+        self.pool.closeall()
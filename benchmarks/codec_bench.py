@@ -0,0 +1,74 @@
+# Encode/decode cost and size of reading messages, JSON against the binary reading layout of shared.codec.
+# Usage: python -m benchmarks.codec_bench [--readings 10000] [--batch 1 100] [--repeat 5]
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from shared import codec
+
+
+def generate_readings(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    readings = []
+    for i in range(count):
+        readings.append({
+            "sensor_id": rng.randint(1, 100000),
+            "velocity": rng.uniform(0, 120) if i % 2 else None,
+            "temperature": rng.uniform(-10, 40) if i % 2 == 0 else None,
+            "humidity": rng.uniform(0, 1) if i % 2 == 0 else None,
+            "battery_level": rng.uniform(0, 1),
+            "last_seen": (start + timedelta(seconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        })
+    return readings
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(name, encoder, decode, batches, repeat):
+    bodies = [encoder(batch) for batch in batches]
+    readings = sum(len(batch) for batch in batches)
+    encode_time = best_of(repeat, lambda: [encoder(batch) for batch in batches])
+    decode_time = best_of(repeat, lambda: [decode(body) for body in bodies])
+    return {
+        "codec": name,
+        "encode_us_per_reading": encode_time / readings * 1e6,
+        "decode_us_per_reading": decode_time / readings * 1e6,
+        "bytes_per_reading": sum(len(body) for body in bodies) / readings,
+    }
+
+
+def run(readings, batch_sizes, repeat):
+    results = []
+    for batch_size in batch_sizes:
+        batches = [readings[i:i + batch_size] for i in range(0, len(readings), batch_size)]
+        for result in (bench("json", codec.json_codec.encode, codec.json_codec.decode, batches, repeat),
+                       bench("binary", codec.reading_codec.encode, codec.reading_codec.decode, batches, repeat)):
+            results.append({"batch": batch_size, **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the JSON and binary codecs of reading messages")
+    parser.add_argument("--readings", type=int, default=10000)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 100], help="readings per message")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'batch':>6} {'codec':>7} {'encode us':>10} {'decode us':>10} {'bytes':>7}")
+    for result in run(generate_readings(args.readings), args.batch, args.repeat):
+        print(f"{result['batch']:>6} {result['codec']:>7} {result['encode_us_per_reading']:>10.2f} "
+              f"{result['decode_us_per_reading']:>10.2f} {result['bytes_per_reading']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
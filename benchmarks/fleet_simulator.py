@@ -0,0 +1,314 @@
+# Simulates a fleet of sensors: registers them through POST /sensors, then every sensor reports a reading per interval.
+# Reports the offered and acknowledged reading rate, the latency until each reading is acknowledged and the sending lag.
+#
+# Targets:
+#   http  POST /sensors/{id}/data on the API, served by controller.py (200) or controller_mq.py (202).
+#         Without --url the app runs in process on the in-memory stand-ins of benchmarks.standins.
+#   amqp  publishes straight to the readings queue with the ReadingPublisher of controller_mq.py, acknowledged by the
+#         broker confirms. Sensors are still registered through --url, or --no-register takes ids 1..N as existing.
+#
+# Traffic patterns:
+#   --interval and --rate-spread  reporting interval of every sensor, each one drawn in interval * (1 +- spread)
+#   --jitter                      fraction of the interval every reading moves around its slot
+#   --out-of-order                fraction of readings held back up to --max-delay seconds, so newer readings overtake them
+#   --burst-every                 every that many seconds --burst-fraction of the sensors reconnect and flush --burst-size
+#                                 readings buffered while offline
+#
+# Usage: python -m benchmarks.fleet_simulator [--sensors 1000] [--interval 10] [--duration 60] [--target http|amqp]
+#                                             [--types Temperatura=1 Velocitat=1] [--url http://localhost:8000] [--output results.json]
+import argparse
+import asyncio
+import heapq
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from app.main import app
+from app.resources import resources
+from benchmarks import traffic
+from benchmarks.http_replay import percentile
+from benchmarks.standins import StandIns
+from shared.publisher import READINGS_QUEUE, ReadingPublisher
+
+
+def parse_types(values):
+    # ["Temperatura=3", "Velocitat"] -> {"Temperatura": 3.0, "Velocitat": 1.0}
+    weights = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def build_fleet(sensors, types, interval, rate_spread, seed=0, prefix="Sim"):
+    # One dict per sensor with its registration payload and its reporting interval, types are assigned by weight
+    rng = random.Random(seed)
+    names, weights = zip(*types.items())
+    fleet = []
+    for index in range(sensors):
+        sensor_type = rng.choices(names, weights)[0]
+        payload = traffic.sensor_payload(index, rng, sensor_type)
+        payload["name"] = f"{prefix} {sensor_type} {index}"
+        fleet.append({
+            "index": index,
+            "id": index + 1,
+            "type": sensor_type,
+            "payload": payload,
+            "interval": interval * rng.uniform(1 - rate_spread, 1 + rate_spread),
+        })
+    return fleet
+
+
+def schedule(fleet, duration, jitter=0.0, out_of_order=0.0, max_delay=0.0,
+             burst_every=0.0, burst_fraction=0.0, burst_size=0, seed=0):
+    # Yields (send_at, sensor, measured_at) sorted by send_at, both in seconds from the start of the run.
+    # measured_at is when the sensor took the reading, send_at when it reaches the network.
+    rng = random.Random(seed)
+    heap = []
+    sequence = 0
+
+    def push(send_at, index, measured_at, kind, slot=None):
+        nonlocal sequence
+        heapq.heappush(heap, (send_at, sequence, index, measured_at, kind, slot))
+        sequence += 1
+
+    def tick(index, slot, now):
+        # readings move around their slot but never before the previous one
+        measured_at = max(now, slot + rng.uniform(-jitter, jitter) * fleet[index]["interval"])
+        push(measured_at, index, measured_at, "tick", slot)
+
+    for sensor in fleet:
+        # sensors are not synchronized, the first reading lands anywhere in the first interval
+        tick(sensor["index"], rng.uniform(0, sensor["interval"]), 0.0)
+    if burst_every and burst_fraction and burst_size:
+        push(burst_every, -1, burst_every, "burst")
+
+    while heap:
+        send_at, _, index, measured_at, kind, slot = heapq.heappop(heap)
+        if send_at >= duration:
+            continue
+        if kind == "burst":
+            for sensor in rng.sample(fleet, max(1, int(len(fleet) * burst_fraction))):
+                # readings buffered while the sensor was offline, oldest first
+                for back in range(burst_size, 0, -1):
+                    push(send_at, sensor["index"], max(0.0, send_at - back * sensor["interval"]), "late")
+            push(send_at + burst_every, -1, send_at + burst_every, "burst")
+            continue
+        sensor = fleet[index]
+        if kind == "tick":
+            tick(index, slot + sensor["interval"], send_at)
+            if out_of_order and rng.random() < out_of_order:
+                push(send_at + rng.uniform(0, max_delay), index, measured_at, "late")
+                continue
+        yield send_at, sensor, measured_at
+
+
+class HttpTarget:
+    def __init__(self, client):
+        self.client = client
+
+    async def send(self, sensor, reading):
+        response = await self.client.post(f"/sensors/{sensor['id']}/data", json=reading)
+        return response.status_code
+
+
+class AmqpTarget:
+    # ReadingPublisher is blocking, it is called from a pool of threads each publishing on its own connection
+
+    def __init__(self, host, port, queue, publishers):
+        self.publisher = ReadingPublisher(host, port, queue)
+        self.executor = ThreadPoolExecutor(max_workers=publishers)
+
+    async def send(self, sensor, reading):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.publisher.publish, {"sensor_id": sensor["id"], **reading})
+        return 200
+
+    def close(self):
+        self.executor.shutdown()
+        self.publisher.close()
+
+
+async def register(client, fleet, concurrency):
+    # Creates the sensors and keeps the ids the API gave them
+    pending = iter(fleet)
+    failures = []
+
+    async def worker():
+        for sensor in pending:
+            response = await client.post("/sensors", json=sensor["payload"])
+            if response.status_code == 200:
+                sensor["id"] = response.json()["id"]
+            else:
+                failures.append((sensor["payload"]["name"], response.status_code, response.text))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if failures:
+        name, status, text = failures[0]
+        raise RuntimeError(f"{len(failures)} sensors could not be registered, {name}: {status} {text}")
+
+
+async def simulate(target, events, concurrency, speed=1.0, seed=0):
+    # Sends the scheduled readings in real time, at most concurrency of them in flight.
+    # Returns one (send_at, lag, status, latency) per reading, status 0 when sending raised.
+    rng = random.Random(seed)
+    results = []
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+
+    async def send(sensor, reading, send_at, lag):
+        sent = time.perf_counter()
+        try:
+            status = await target.send(sensor, reading)
+        except Exception:
+            status = 0
+        results.append((send_at, lag, status, time.perf_counter() - sent))
+        slots.release()
+
+    for send_at, sensor, measured_at in events:
+        delay = send_at / speed - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await slots.acquire()
+        lag = max(0.0, time.perf_counter() - start - send_at / speed)
+        reading = traffic.reading_payload(sensor["type"], rng, started + timedelta(seconds=measured_at))
+        task = asyncio.create_task(send(sensor, reading, send_at, lag))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency * 1000 for _, _, status, latency in results if 200 <= status < 300)
+    lags = sorted(lag * 1000 for _, lag, _, _ in results)
+    statuses = {}
+    for _, _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "readings": len(results),
+        "acknowledged": len(latencies),
+        "failed": len(results) - len(latencies),
+        "statuses": statuses,
+        "elapsed_s": elapsed,
+        "offered_rps": len(results) / elapsed if elapsed else None,
+        "acknowledged_rps": len(latencies) / elapsed if elapsed else None,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+        # how late readings left compared to their schedule, a growing lag means the target can not keep up
+        "lag_ms": {"p95": percentile(lags, 0.95), "max": lags[-1] if lags else None},
+    }
+
+
+def print_report(summary):
+    latency, lag = summary["latency_ms"], summary["lag_ms"]
+    print(f"readings {summary['readings']} acknowledged {summary['acknowledged']} failed {summary['failed']} in {summary['elapsed_s']:.1f} s")
+    print(f"offered {summary['offered_rps']:.1f}/s acknowledged {summary['acknowledged_rps']:.1f}/s statuses {summary['statuses']}")
+    if latency["p50"] is not None:
+        print(f"latency ms p50 {latency['p50']:.2f} p95 {latency['p95']:.2f} p99 {latency['p99']:.2f} max {latency['max']:.2f}")
+    if lag["max"] is not None:
+        print(f"send lag ms p95 {lag['p95']:.2f} max {lag['max']:.2f}")
+
+
+async def run(args):
+    fleet = build_fleet(args.sensors, parse_types(args.types), args.interval, args.rate_spread, args.seed, args.prefix)
+    standins = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    elif args.target == "http":
+        standins = StandIns(latency=args.backend_latency_ms / 1000)
+        standins.install(app, resources)
+        client = httpx.AsyncClient(app=app, base_url="http://senser", timeout=args.timeout)
+    elif args.register:
+        raise SystemExit("--target amqp registers the sensors through --url, pass --no-register if they exist already")
+    else:
+        client = None
+
+    target = None
+    try:
+        if client is not None:
+            async with client:
+                if args.register:
+                    await register(client, fleet, args.concurrency)
+                    print(f"registered {len(fleet)} sensors")
+                if args.target == "http":
+                    target = HttpTarget(client)
+                    results, elapsed = await simulate(target, _events(fleet, args), args.concurrency, args.speed, args.seed)
+        if args.target == "amqp":
+            target = AmqpTarget(args.amqp_host, args.amqp_port, args.queue, args.publishers)
+            results, elapsed = await simulate(target, _events(fleet, args), args.concurrency, args.speed, args.seed)
+    finally:
+        if isinstance(target, AmqpTarget):
+            target.close()
+        if standins is not None:
+            standins.uninstall(app, resources)
+
+    summary = summarize(results, elapsed)
+    summary["run"] = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "target": args.target,
+        "url": args.url or ("in-process stand-ins" if args.target == "http" else None),
+        "sensors": args.sensors,
+        "types": parse_types(args.types),
+        "interval_s": args.interval,
+        "duration_s": args.duration,
+        "speed": args.speed,
+        "seed": args.seed,
+    }
+    return summary
+
+
+def _events(fleet, args):
+    return schedule(fleet, args.duration, args.jitter, args.out_of_order, args.max_delay,
+                    args.burst_every, args.burst_fraction, args.burst_size, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register a synthetic sensor fleet and send its readings in real time")
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--types", nargs="+", default=["Temperatura=1", "Velocitat=1"], help="sensor types with their weight, TYPE=WEIGHT")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between the readings of a sensor")
+    parser.add_argument("--rate-spread", type=float, default=0.0, help="sensor intervals vary by up to this fraction")
+    parser.add_argument("--jitter", type=float, default=0.05, help="readings move up to this fraction of the interval")
+    parser.add_argument("--out-of-order", type=float, default=0.0, help="fraction of readings delivered late")
+    parser.add_argument("--max-delay", type=float, default=30.0, help="seconds a late reading is held back at most")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="seconds between bursts, 0 for none")
+    parser.add_argument("--burst-fraction", type=float, default=0.1, help="fraction of the sensors flushing in a burst")
+    parser.add_argument("--burst-size", type=int, default=10, help="buffered readings each of them flushes")
+    parser.add_argument("--duration", type=float, default=60.0, help="simulated seconds")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 10 sends a minute of traffic in 6 seconds")
+    parser.add_argument("--concurrency", type=int, default=64, help="readings in flight at most")
+    parser.add_argument("--target", choices=("http", "amqp"), default="http")
+    parser.add_argument("--url", help="base url of a running api, the in-process stand-ins otherwise")
+    parser.add_argument("--no-register", dest="register", action="store_false", help="sensors 1..N exist already")
+    parser.add_argument("--prefix", default=f"Sim {int(time.time())}", help="sensor names start with it, names are unique")
+    parser.add_argument("--amqp-host", default="rabbitmq")
+    parser.add_argument("--amqp-port", type=int, default=5672)
+    parser.add_argument("--queue", default=READINGS_QUEUE)
+    parser.add_argument("--publishers", type=int, default=4, help="AMQP connections publishing in parallel")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0, help="latency added to every stand-in round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(summary, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
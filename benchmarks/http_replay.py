@@ -0,0 +1,205 @@
+# Replay a request corpus against the API and report throughput and latency percentiles per endpoint.
+# By default the app runs in process on the in-memory stand-ins of benchmarks.standins, --url targets a running server.
+#
+# A corpus is a JSONL file with one request per line: {"method": "GET", "path": "/sensors/near", "params": {...}, "json": {...}}.
+# Without --corpus, or with --generate, traffic is generated by benchmarks.traffic after registering --sensors sensors.
+#
+# Usage: python -m benchmarks.http_replay [--sensors 100] [--generate 5000] [--concurrency 16] [--corpus file.jsonl]
+#                                         [--output results.json] [--compare baseline.json --max-regression 20]
+import argparse
+import asyncio
+import json
+import math
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from app.main import app
+from app.resources import resources
+from benchmarks import traffic
+from benchmarks.standins import StandIns
+
+
+def load_corpus(path):
+    with open(path) as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def save_corpus(path, requests):
+    with open(path, "w") as corpus:
+        for request in requests:
+            corpus.write(json.dumps(request) + "\n")
+
+
+_labels = {}
+
+
+def endpoint(method, path):
+    # the route template, so /sensors/1 and /sensors/2 are reported together
+    key = (method, path)
+    if key not in _labels:
+        label = path
+        for route in app.routes:
+            if method in getattr(route, "methods", ()) and route.path_regex.match(path):
+                label = route.path
+                break
+        _labels[key] = f"{method} {label}"
+    return _labels[key]
+
+
+def percentile(values, fraction):
+    # nearest rank on sorted values, rounded first so 0.07 * 100 is rank 7 and not 8
+    if not values:
+        return None
+    return values[max(0, math.ceil(round(fraction * len(values), 9)) - 1)]
+
+
+async def replay(client, requests, concurrency):
+    # Returns (endpoint, status, seconds) per request, status 0 when the request raised
+    results = [None] * len(requests)
+    pending = iter(range(len(requests)))
+
+    async def worker():
+        for i in pending:
+            request = requests[i]
+            start = time.perf_counter()
+            try:
+                response = await client.request(request["method"], request["path"], params=request.get("params"), json=request.get("json"))
+                status = response.status_code
+            except Exception:
+                status = 0
+            results[i] = (endpoint(request["method"], request["path"]), status, time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def summarize(results, elapsed):
+    by_endpoint = {}
+    for name, status, seconds in results:
+        by_endpoint.setdefault(name, []).append((status, seconds))
+
+    def stats(entries, elapsed):
+        latencies = sorted(seconds * 1000 for _, seconds in entries)
+        return {
+            "requests": len(entries),
+            "throughput_rps": len(entries) / elapsed if elapsed else None,
+            "errors": sum(1 for status, _ in entries if status == 0 or status >= 500),
+            "non_2xx": sum(1 for status, _ in entries if not 200 <= status < 300),
+            "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": latencies[-1],
+        }
+
+    return {
+        "total": stats([(status, seconds) for _, status, seconds in results], elapsed),
+        "endpoints": {name: stats(entries, elapsed) for name, entries in sorted(by_endpoint.items())},
+    }
+
+
+def print_report(summary):
+    print(f"{'endpoint':<40} {'requests':>8} {'rps':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = list(summary["endpoints"].items()) + [("total", summary["total"])]
+    for name, stats in rows:
+        print(f"{name:<40} {stats['requests']:>8} {stats['throughput_rps']:>8.1f} {stats['errors']:>6} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def compare(summary, baseline, max_regression):
+    # Endpoints whose p95 latency grew by more than max_regression percent over the baseline run
+    regressions = []
+    for name, stats in summary["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        if change > max_regression:
+            regressions.append((name, before["p95_ms"], stats["p95_ms"], change))
+    return regressions
+
+
+async def run(args):
+    requests = []
+    if args.corpus:
+        for path in args.corpus:
+            requests += load_corpus(path)
+    setup = traffic.setup_requests(args.sensors, args.seed) if args.sensors else []
+    if args.generate or not args.corpus:
+        requests += traffic.generate_requests(args.generate or 5000, max(args.sensors, 1), args.seed)
+    if args.save_corpus:
+        save_corpus(args.save_corpus, setup + requests)
+
+    standins = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        standins = StandIns(latency=args.backend_latency_ms / 1000)
+        standins.install(app, resources)
+        client = httpx.AsyncClient(app=app, base_url="http://senser", timeout=args.timeout)
+
+    try:
+        async with client:
+            # registration and first readings are not measured
+            await replay(client, setup, args.concurrency)
+            if args.warmup:
+                await replay(client, requests[:args.warmup], args.concurrency)
+            start = time.perf_counter()
+            results = await replay(client, requests, args.concurrency)
+            elapsed = time.perf_counter() - start
+    finally:
+        if standins is not None:
+            standins.uninstall(app, resources)
+
+    summary = summarize(results, elapsed)
+    summary["run"] = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "in-process stand-ins",
+        "requests": len(requests),
+        "sensors": args.sensors,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "elapsed_s": elapsed,
+        "python": platform.python_version(),
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request corpus against the API and report latency per endpoint")
+    parser.add_argument("--corpus", nargs="+", help="JSONL request files replayed in order")
+    parser.add_argument("--generate", type=int, default=0, help="generated requests, 5000 when no corpus is given")
+    parser.add_argument("--sensors", type=int, default=100, help="sensors registered before the replay, 0 to skip")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=0, help="requests of the corpus replayed once before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--url", help="base url of a running api instead of the in-process stand-ins")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0, help="latency added to every stand-in round trip")
+    parser.add_argument("--save-corpus", help="write the replayed requests, setup included, as a JSONL corpus")
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--compare", help="JSON results file of a baseline run")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed p95 growth over the baseline, in percent")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(summary, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(summary, json.load(baseline), args.max_regression)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: p95 {before:.2f} ms -> {after:.2f} ms (+{change:.0f}%)")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
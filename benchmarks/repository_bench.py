@@ -0,0 +1,190 @@
+# Cost and backend round trips of the repository functions on the in-memory stand-ins, for growing fleets.
+# Round trips per call should not grow with the fleet, a count that does is an N+1 query.
+# --latency-ms sleeps on every round trip to see how the call pattern behaves against a real network.
+# Usage: python -m benchmarks.repository_bench [--sizes 10 100 1000 10000 100000] [--repeat 50] [--cold-cache] [--output results.json]
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+
+from app.sensors import models, repository, schemas
+from app.sensors.cache import metadata_cache
+from app.bootstrap import bootstrap_cassandra, bootstrap_elasticsearch, bootstrap_mongodb
+from benchmarks import traffic
+from benchmarks.standins import StandIns
+
+CENTER = (sum(traffic.LATITUDE) / 2, sum(traffic.LONGITUDE) / 2)
+
+
+def populate(standins, sensors, history_sensors=10, history_hours=48, seed=0):
+    # Registers the fleet straight into the stand-ins, every sensor gets a latest reading
+    # and the first history_sensors sensors an hourly history
+    rng = random.Random(seed)
+    recorder, standins.recorder = standins.recorder, None
+    for client in (standins.redis, standins.mongodb, standins.elastic, standins.timescale, standins.cassandra):
+        client.recorder = None
+    try:
+        bootstrap_mongodb(standins.mongodb)
+        bootstrap_elasticsearch(standins.elastic)
+        bootstrap_cassandra(standins.cassandra)
+        joined_at = datetime.utcnow()
+        payloads = [traffic.sensor_payload(index, rng) for index in range(sensors)]
+
+        db = standins.database.SessionLocal()
+        db.execute(insert(models.Sensor), [{"id": index + 1, "name": payload["name"], "joined_at": joined_at} for index, payload in enumerate(payloads)])
+        db.commit()
+
+        docs = []
+        for index, payload in enumerate(payloads):
+            docs.append({"sensor_id": index + 1, "name": payload["name"],
+                         "location": {"type": "Point", "coordinates": [payload["longitude"], payload["latitude"]]},
+                         **{field: payload[field] for field in ("type", "mac_address", "manufacturer", "model", "serie_number", "firmware_version", "description")}})
+        standins.mongodb.collection.extend(docs)
+        standins.elastic.bulk_index(repository.SENSORS_INDEX, (repository.sensor_document(doc) for doc in docs))
+
+        now = datetime.now(timezone.utc)
+        readings = []
+        for index, payload in enumerate(payloads):
+            readings.append(schemas.SensorReading(sensor_id=index + 1, **traffic.reading_payload(payload["type"], rng, now)))
+            if index < history_sensors:
+                for hour in range(history_hours, 0, -1):
+                    readings.append(schemas.SensorReading(sensor_id=index + 1, **traffic.reading_payload(payload["type"], rng, now - timedelta(hours=hour))))
+        timescale = standins.timescale.get()
+        for start in range(0, len(readings), 5000):
+            repository.ingest_readings(standins.redis, readings[start:start + 5000], db, standins.mongodb, timescale, standins.cassandra)
+        db.close()
+    finally:
+        standins.recorder = recorder
+        for client in (standins.redis, standins.mongodb, standins.elastic, standins.timescale, standins.cassandra):
+            client.recorder = recorder
+    return payloads
+
+
+def operations(standins, sensors, rng):
+    # name -> function(db, timescale) running one call of the repository
+    clients = dict(redis=standins.redis, mongodb_client=standins.mongodb, cassandra_client=standins.cassandra)
+    now = datetime.now(timezone.utc)
+
+    def sensor():
+        index = rng.randrange(sensors)
+        return index + 1, traffic.SENSOR_TYPES[index % len(traffic.SENSOR_TYPES)]
+
+    def record_data(db, timescale):
+        sensor_id, sensor_type = sensor()
+        data = schemas.SensorData(**traffic.reading_payload(sensor_type, rng, now))
+        repository.record_data(sensor_id=sensor_id, data=data, db=db, timescale_client=timescale, **clients)
+
+    def record_data_batch(db, timescale):
+        readings = []
+        for _ in range(100):
+            sensor_id, sensor_type = sensor()
+            readings.append(schemas.SensorReading(sensor_id=sensor_id, **traffic.reading_payload(sensor_type, rng, now)))
+        repository.record_data_batch(readings=readings, db=db, timescale_client=timescale, **clients)
+
+    def get_sensor(db, timescale):
+        repository.get_sensor(db, sensor()[0], standins.mongodb)
+
+    def get_data(db, timescale):
+        repository.get_data(redis=standins.redis, sensor_id=1, db=db, mongodb_client=standins.mongodb, timescale_client=timescale,
+                            from_date=now - timedelta(days=2), to_date=now, bucket="hour")
+
+    def get_sensors_near(db, timescale):
+        repository.get_sensors_near(latitude=CENTER[0], longitude=CENTER[1], radius=1000, db=db,
+                                    mongodb_client=standins.mongodb, redis_client=standins.redis, limit=50)
+
+    def search_sensors(db, timescale):
+        repository.search_sensors(db=db, mongodb=standins.mongodb, es=standins.elastic, query='{"type": "Temperatura"}',
+                                  size=10, search_type="match", from_=rng.randrange(0, 50))
+
+    def get_values_sensor_temperatura(db, timescale):
+        repository.get_values_sensor_temperatura(db=db, timescale_client=timescale, **clients)
+
+    def get_quantity_by_type(db, timescale):
+        repository.get_quantity_by_type(db=db, timescale_client=timescale, **clients)
+
+    def get_low_battery(db, timescale):
+        repository.get_low_battery(db=db, timescale_client=timescale, **clients)
+
+    def get_latest_in_range(db, timescale):
+        repository.get_latest_in_range(db=db, redis=standins.redis, mongodb_client=standins.mongodb, metric="battery_level", gt=0.9)
+
+    return {function.__name__: function for function in (
+        record_data, record_data_batch, get_sensor, get_data, get_sensors_near, search_sensors,
+        get_values_sensor_temperatura, get_quantity_by_type, get_low_battery, get_latest_in_range)}
+
+
+def measure(standins, function, repeat, max_seconds, cold_cache=False):
+    # Runs function up to repeat times, or until max_seconds are spent, returns timings and round trips per call
+    timings = []
+    round_trips = {}
+    db = standins.database.SessionLocal()
+    timescale = standins.timescale.get()
+    deadline = time.perf_counter() + max_seconds
+    try:
+        while len(timings) < repeat and (not timings or time.perf_counter() < deadline):
+            if cold_cache:
+                metadata_cache.invalidate()
+            standins.recorder.reset()
+            start = time.perf_counter()
+            function(db, timescale)
+            timings.append(time.perf_counter() - start)
+            for backend, count in standins.recorder.by_backend().items():
+                round_trips[backend] = round_trips.get(backend, 0) + count
+    finally:
+        timescale.close()
+        db.close()
+    timings.sort()
+    return {
+        "calls": len(timings),
+        "mean_us": sum(timings) / len(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "max_us": timings[-1] * 1e6,
+        "round_trips": {backend: count / len(timings) for backend, count in sorted(round_trips.items())},
+    }
+
+
+def run(sizes, repeat, max_seconds, cold_cache, latency, seed=0):
+    results = []
+    for size in sizes:
+        metadata_cache.invalidate()
+        standins = StandIns(latency=latency)
+        try:
+            populate(standins, size, seed=seed)
+            rng = random.Random(seed)
+            for name, function in operations(standins, size, rng).items():
+                results.append({"sensors": size, "operation": name, **measure(standins, function, repeat, max_seconds, cold_cache)})
+        finally:
+            standins.database.close()
+    return results
+
+
+def print_report(results):
+    print(f"{'sensors':>8} {'operation':<32} {'calls':>6} {'mean us':>10} {'p50 us':>10}  round trips per call")
+    for result in results:
+        round_trips = " ".join(f"{backend}={count:g}" for backend, count in result["round_trips"].items())
+        print(f"{result['sensors']:>8} {result['operation']:<32} {result['calls']:>6} {result['mean_us']:>10.0f} {result['p50_us']:>10.0f}  {round_trips}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the repository functions on in-memory backends")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000], help="fleet sizes")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per operation")
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="time budget per operation, at least one call is made")
+    parser.add_argument("--cold-cache", action="store_true", help="empty the sensor metadata cache before every call")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency added to every backend round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat, args.max_seconds, args.cold_cache, args.latency_ms / 1000, args.seed)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,794 @@
+# In-memory stand-ins for the backend client wrappers of app/, so the benchmarks run on one box without the databases.
+# Each class implements the surface of the wrapper it replaces (RedisClient, MongoDBClient, ElasticsearchClient,
+# Timescale/TimescalePool and CassandraClient), not of the underlying driver, and only as far as the repository uses it.
+# Postgres is replaced by SQLite through the get_db dependency.
+# Every method that would be a network round trip is counted by a CallRecorder, which can also delay it
+# to emulate the latency of a real backend.
+import fnmatch
+import functools
+import inspect
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import timedelta, timezone
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.sensors import models, repository
+
+
+class CallRecorder:
+    # Round trips per backend and operation, latency is slept on every round trip,
+    # per backend from latencies or else the default one, in seconds
+    def __init__(self, latency=0.0, latencies=None):
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, backend, operation):
+        with self._lock:
+            self.counts[(backend, operation)] += 1
+        delay = self.latencies.get(backend, self.latency)
+        if delay:
+            time.sleep(delay)
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+    def snapshot(self):
+        # {"redis.get": 2, ...}
+        with self._lock:
+            return {f"{backend}.{operation}": count for (backend, operation), count in sorted(self.counts.items())}
+
+    def by_backend(self):
+        totals = Counter()
+        with self._lock:
+            for (backend, _), count in self.counts.items():
+                totals[backend] += count
+        return dict(totals)
+
+
+def round_trip(backend):
+    # Count every call of the decorated method as one round trip to backend
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.recorder is not None:
+                self.recorder.record(backend, func.__name__)
+            return func(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _uncounted(obj, name):
+    # the method without its round_trip wrapper, for calls made inside one round trip
+    return inspect.unwrap(getattr(type(obj), name)).__get__(obj)
+
+
+def _bytes(value):
+    # redis answers bytes whatever was stored
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+
+class InMemoryRedis:
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self._data = {}
+        self._subscribers = {}
+        self._lock = threading.RLock()
+
+    def close(self):
+        pass
+
+    @round_trip("redis")
+    def ping(self):
+        return True
+
+    @round_trip("redis")
+    def get(self, key):
+        return self._data.get(key)
+
+    @round_trip("redis")
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = _bytes(value)
+        return True
+
+    @round_trip("redis")
+    def mget(self, keys):
+        return [self._data.get(key) for key in keys]
+
+    @round_trip("redis")
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self):
+        return InMemoryRedisPipeline(self)
+
+    @round_trip("redis")
+    def update_stats(self, key, values):
+        with self._lock:
+            stats = self._data.setdefault(key, {})
+            for field, value in values.items():
+                value = float(value)
+                count = int(stats.get(_bytes(f"{field}:count"), b"0")) + 1
+                total = float(stats.get(_bytes(f"{field}:sum"), b"0")) + value
+                stats[_bytes(f"{field}:count")] = _bytes(count)
+                stats[_bytes(f"{field}:sum")] = _bytes(total)
+                minimum = stats.get(_bytes(f"{field}:min"))
+                if minimum is None or value < float(minimum):
+                    stats[_bytes(f"{field}:min")] = _bytes(value)
+                maximum = stats.get(_bytes(f"{field}:max"))
+                if maximum is None or value > float(maximum):
+                    stats[_bytes(f"{field}:max")] = _bytes(value)
+
+    @round_trip("redis")
+    def hset(self, key, mapping):
+        with self._lock:
+            self._data.setdefault(key, {}).update({_bytes(field): _bytes(value) for field, value in mapping.items()})
+
+    @round_trip("redis")
+    def hgetall(self, key):
+        return dict(self._data.get(key, {}))
+
+    @round_trip("redis")
+    def sadd(self, key, *members):
+        with self._lock:
+            members = {_bytes(member) for member in members}
+            current = self._data.setdefault(key, set())
+            added = len(members - current)
+            current |= members
+            return added
+
+    @round_trip("redis")
+    def srem(self, key, *members):
+        with self._lock:
+            current = self._data.get(key, set())
+            removed = {_bytes(member) for member in members} & current
+            current -= removed
+            return len(removed)
+
+    @round_trip("redis")
+    def smembers(self, key):
+        return set(self._data.get(key, set()))
+
+    @round_trip("redis")
+    def zadd(self, key, mapping):
+        with self._lock:
+            scores = self._data.setdefault(key, {})
+            added = 0
+            for member, score in mapping.items():
+                added += _bytes(member) not in scores
+                scores[_bytes(member)] = float(score)
+            return added
+
+    @round_trip("redis")
+    def zrem(self, key, *members):
+        with self._lock:
+            scores = self._data.get(key, {})
+            return sum(scores.pop(_bytes(member), None) is not None for member in members)
+
+    @round_trip("redis")
+    def set_latest(self, order_key, order, key, value, member, scores):
+        # same as the LATEST_SCRIPT of the redis client
+        with self._lock:
+            current = self._data.get(order_key)
+            if current is not None and int(current) > order:
+                return 0
+            self._data[order_key] = _bytes(order)
+            self._data[key] = _bytes(value)
+            for sorted_set, score in scores.items():
+                if score is None:
+                    self._data.get(sorted_set, {}).pop(_bytes(member), None)
+                else:
+                    self._data.setdefault(sorted_set, {})[_bytes(member)] = float(score)
+            return 1
+
+    @round_trip("redis")
+    def zrangebyscore(self, key, min, max):
+        lower, lower_open = _score_bound(min)
+        upper, upper_open = _score_bound(max)
+        members = []
+        for member, score in self._data.get(key, {}).items():
+            if (score > lower if lower_open else score >= lower) and (score < upper if upper_open else score <= upper):
+                members.append((member, score))
+        return sorted(members, key=lambda member: (member[1], member[0]))
+
+    @round_trip("redis")
+    def publish(self, channel, message):
+        handlers = list(self._subscribers.get(channel, []))
+        for handler in handlers:
+            handler({"type": "message", "channel": _bytes(channel), "data": _bytes(message)})
+        return len(handlers)
+
+    def subscribe(self, channel, handler, on_reconnect=None):
+        # handlers run synchronously in the publishing thread, the subscription is never lost
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(handler)
+        return _Subscription(self, channel, handler)
+
+    @round_trip("redis")
+    def keys(self, pattern):
+        return [_bytes(key) for key in list(self._data) if fnmatch.fnmatchcase(key, pattern)]
+
+    @round_trip("redis")
+    def clearAll(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _score_bound(bound):
+    bound = str(bound)
+    if bound.startswith("("):
+        return float(bound[1:]), True
+    return float(bound), False
+
+
+class _Subscription:
+    def __init__(self, redis, channel, handler):
+        self._redis = redis
+        self._channel = channel
+        self._handler = handler
+
+    def stop(self):
+        with self._redis._lock:
+            self._redis._subscribers.get(self._channel, []).remove(self._handler)
+
+
+class InMemoryRedisPipeline:
+    # Queues the calls and applies them on execute() like a redis pipeline
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    def __getattr__(self, name):
+        if name not in ("set", "set_latest", "delete", "update_stats", "hset", "hgetall", "sadd", "srem", "zadd", "zrem"):
+            raise AttributeError(name)
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        if self._redis.recorder is not None:
+            self._redis.recorder.record("redis", "pipeline")
+        with self._redis._lock:
+            return [_uncounted(self._redis, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class InMemoryMongoDB:
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self._databases = {}
+        self.database = None
+        self.collection = None
+        self._lock = threading.RLock()
+
+    def close(self):
+        pass
+
+    @round_trip("mongodb")
+    def ping(self):
+        return {"ok": 1.0}
+
+    def getDatabase(self, database):
+        self.database = self._databases.setdefault(database, {})
+        return self.database
+
+    def getCollection(self, collection):
+        self.collection = self.database.setdefault(collection, [])
+        return self.collection
+
+    @round_trip("mongodb")
+    def clearDb(self, database):
+        self._databases.pop(database, None)
+
+    @round_trip("mongodb")
+    def createIndex(self, keys, **kwargs):
+        return "_".join(f"{field}_{kind}" for field, kind in keys)
+
+    @round_trip("mongodb")
+    def insertOne(self, doc):
+        with self._lock:
+            self.collection.append(dict(doc))
+
+    @round_trip("mongodb")
+    def findOne(self, query={}):
+        for doc in self.collection:
+            if _matches(doc, query):
+                return dict(doc)
+        return None
+
+    @round_trip("mongodb")
+    def deleteOne(self, query={}):
+        with self._lock:
+            for i, doc in enumerate(self.collection):
+                if _matches(doc, query):
+                    del self.collection[i]
+                    return
+
+    @round_trip("mongodb")
+    def findAllDocuments(self, query={}, projection=None, limit=0):
+        near = next(((field, condition["$near"]) for field, condition in query.items()
+                     if isinstance(condition, dict) and "$near" in condition), None)
+        if near is None:
+            docs = [doc for doc in self.collection if _matches(doc, query)]
+        else:
+            # $near sorts by distance and drops documents further than $maxDistance meters
+            field, condition = near
+            rest = {key: value for key, value in query.items() if key != field}
+            longitude, latitude = condition["$geometry"]["coordinates"]
+            max_distance = condition.get("$maxDistance", math.inf)
+            distances = []
+            for doc in self.collection:
+                if not _matches(doc, rest):
+                    continue
+                distance = _haversine(doc[field]["coordinates"], (longitude, latitude))
+                if distance <= max_distance:
+                    distances.append((distance, doc))
+            docs = [doc for _, doc in sorted(distances, key=lambda pair: pair[0])]
+        if limit:
+            docs = docs[:limit]
+        return [_project(doc, projection) for doc in docs]
+
+    @round_trip("mongodb")
+    def aggregate(self, pipeline):
+        # $group on one field with $sum counters and $sort, the stages repository uses
+        rows = [dict(doc) for doc in self.collection]
+        for stage in pipeline:
+            if "$group" in stage:
+                group = stage["$group"]
+                key = group["_id"].lstrip("$")
+                grouped = {}
+                for doc in rows:
+                    row = grouped.setdefault(doc.get(key), {"_id": doc.get(key)})
+                    for name, accumulator in group.items():
+                        if name != "_id":
+                            row[name] = row.get(name, 0) + accumulator["$sum"]
+                rows = list(grouped.values())
+            elif "$sort" in stage:
+                for field, direction in reversed(list(stage["$sort"].items())):
+                    rows.sort(key=lambda row: row[field], reverse=direction < 0)
+        return rows
+
+
+def _matches(doc, query):
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict) and "$in" in condition:
+            if value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if projection.get(field, 1)}
+
+
+def _haversine(a, b):
+    # distance in meters between two [longitude, latitude] points
+    lon1, lat1, lon2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(h))
+
+
+class InMemoryElasticsearch:
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self._indices = {}
+        self._aliases = {}
+        self._lock = threading.RLock()
+
+    def close(self):
+        pass
+
+    @round_trip("elasticsearch")
+    def ping(self):
+        return True
+
+    def _resolve(self, index_name):
+        return self._aliases.get(index_name, [index_name])
+
+    @round_trip("elasticsearch")
+    def clearIndex(self, index_name):
+        with self._lock:
+            for name in self._resolve(index_name):
+                self._indices.pop(name, None)
+            self._aliases.pop(index_name, None)
+
+    @round_trip("elasticsearch")
+    def index_exists(self, index_name):
+        return index_name in self._indices or index_name in self._aliases
+
+    @round_trip("elasticsearch")
+    def create_index(self, index_name, mappings=None, settings=None):
+        with self._lock:
+            self._indices.setdefault(index_name, {})
+
+    @round_trip("elasticsearch")
+    def create_mapping(self, index_name, mapping):
+        pass
+
+    @round_trip("elasticsearch")
+    def search(self, index_name, query, size=None, from_=None, source=None):
+        hits = []
+        for name in self._resolve(index_name):
+            for id, document in self._indices.get(name, {}).items():
+                if _es_matches(document, query.get("query", {"match_all": {}})):
+                    hits.append({"_index": name, "_id": str(id), "_source": document})
+        total = len(hits)
+        start = from_ or 0
+        hits = hits[start:start + (10 if size is None else size)]
+        if source is not None:
+            hits = [{**hit, "_source": {field: hit["_source"].get(field) for field in source}} for hit in hits]
+        return {"hits": {"total": {"value": total, "relation": "eq"}, "hits": hits}}
+
+    @round_trip("elasticsearch")
+    def index_document(self, index_name, document, id=None):
+        with self._lock:
+            name = self._resolve(index_name)[0]
+            documents = self._indices.setdefault(name, {})
+            documents[str(id) if id is not None else str(len(documents) + 1)] = dict(document)
+
+    @round_trip("elasticsearch")
+    def delete_document(self, index_name, id):
+        with self._lock:
+            for name in self._resolve(index_name):
+                self._indices.get(name, {}).pop(str(id), None)
+
+    def bulk_index(self, index_name, documents, id_field="id", chunk_size=500, refresh=False):
+        # one _bulk request per chunk
+        indexed = 0
+        for document in documents:
+            if indexed % chunk_size == 0 and self.recorder is not None:
+                self.recorder.record("elasticsearch", "bulk")
+            _uncounted(self, "index_document")(index_name, document, id=document[id_field])
+            indexed += 1
+        return indexed
+
+    @round_trip("elasticsearch")
+    def refresh(self, index_name):
+        pass
+
+    @round_trip("elasticsearch")
+    def put_settings(self, index_name, settings):
+        pass
+
+    @round_trip("elasticsearch")
+    def get_alias_indices(self, alias):
+        return list(self._aliases.get(alias, []))
+
+    @round_trip("elasticsearch")
+    def update_aliases(self, actions):
+        with self._lock:
+            for action in actions:
+                (kind, target), = action.items()
+                if kind == "add":
+                    self._aliases.setdefault(target["alias"], []).append(target["index"])
+                elif kind == "remove":
+                    self._aliases.get(target["alias"], []).remove(target["index"])
+                elif kind == "remove_index":
+                    self._indices.pop(target["index"], None)
+
+
+def _es_matches(document, query):
+    (kind, condition), = query.items()
+    if kind == "match_all":
+        return True
+    (field, value), = condition.items()
+    if isinstance(value, dict):
+        value = value.get("value", value.get("query"))
+    actual = document.get(field)
+    if actual is None:
+        return False
+    actual, value = str(actual).lower(), str(value).lower()
+    if kind == "fuzzy":
+        # fuzziness AUTO: exact up to 2 characters, one edit up to 5, two edits beyond
+        allowed = 0 if len(value) <= 2 else 1 if len(value) <= 5 else 2
+        return _edit_distance(actual, value) <= allowed
+    if kind in ("match", "match_phrase"):
+        # analyzed text matches on any token, keywords on the whole value
+        return value == actual or bool(set(value.split()) & set(actual.split()))
+    if kind == "prefix":
+        return actual.startswith(value)
+    return value == actual
+
+
+def _edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class _Connection:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class InMemoryTimescale:
+    # The sensor_data hypertable as a list of (sensor_id, data, last_seen) rows.
+    # select() answers the history query of repository.get_data on the continuous aggregates, aggregating the rows
+    # on the fly, and [] to anything else.
+    def __init__(self, pool):
+        self.pool = pool
+        self.recorder = pool.recorder
+        self.conn = _Connection()
+
+    @property
+    def cursor(self):
+        return self
+
+    def getCursor(self):
+        return self
+
+    def close(self):
+        pass
+
+    @round_trip("timescale")
+    def ping(self):
+        return True
+
+    @round_trip("timescale")
+    def execute(self, query, params=None):
+        pass
+
+    @round_trip("timescale")
+    def insert(self, query):
+        pass
+
+    @round_trip("timescale")
+    def execute_autocommit(self, query, params=None):
+        # the aggregates are computed on the fly, there is nothing to refresh
+        pass
+
+    @round_trip("timescale")
+    def insert_many(self, query, rows, page_size=1000):
+        parsed = [(sensor_id, json.loads(data), repository.parse_last_seen(last_seen)) for sensor_id, data, last_seen in rows]
+        with self.pool.lock:
+            self.pool.rows.extend(parsed)
+
+    @round_trip("timescale")
+    def select(self, query, params=None):
+        if "sensor_data_" not in query or not params:
+            return []
+        return self.pool.history(params)
+
+    def fetchall(self):
+        return []
+
+    @round_trip("timescale")
+    def delete(self, table):
+        with self.pool.lock:
+            self.pool.rows.clear()
+
+
+def _utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def time_bucket(width, timestamp):
+    midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if width == "1 hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if width == "1 day":
+        return midnight
+    if width == "1 week":
+        # timescale weeks start on monday
+        return midnight - timedelta(days=midnight.weekday())
+    if width == "1 month":
+        return midnight.replace(day=1)
+    if width == "1 year":
+        return midnight.replace(month=1, day=1)
+    raise ValueError(f"Unsupported bucket width {width}")
+
+
+class InMemoryTimescalePool:
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        return InMemoryTimescale(self)
+
+    def close(self):
+        pass
+
+    def history(self, params):
+        width = params["width"]
+        from_date, to_date = _utc(params.get("from_date")), _utc(params.get("to_date"))
+        lower = time_bucket(width, from_date) if from_date else None
+        upper = time_bucket(width, to_date) if to_date else None
+        buckets = {}
+        with self.lock:
+            rows = [row for row in self.rows if row[0] == params["sensor_id"]]
+        for _, data, last_seen in rows:
+            bucket = time_bucket(width, last_seen)
+            if (lower and last_seen < lower) or (upper and bucket > upper):
+                continue
+            buckets.setdefault(bucket, []).append(data)
+        result = []
+        for bucket in sorted(buckets):
+            readings = buckets[bucket]
+            row = [bucket, len(readings)]
+            for metric in repository.METRICS:
+                values = [data[metric] for data in readings if data.get(metric) is not None]
+                row += [sum(values) / len(values) if values else None, min(values, default=None), max(values, default=None), len(values)]
+            result.append(tuple(row))
+        return result
+
+
+_INSERT = re.compile(r"INSERT INTO\s+(?:\w+\.)?(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+_SELECT = re.compile(r"SELECT\s+(DISTINCT\s+)?(.+?)\s+FROM\s+(?:\w+\.)?(\w+)(?:\s+WHERE\s+(.+?))?\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+
+
+class InMemoryCassandra:
+    # Tables are lists of rows, inserts are parsed from the statement and selects support equality conditions only
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self._tables = {}
+        self._prepared = set()
+        self._lock = threading.Lock()
+
+    def get_session(self):
+        return self
+
+    def get_session_keyspace(self):
+        return self
+
+    def set_keyspace(self, keyspace):
+        pass
+
+    def close(self):
+        pass
+
+    def prepare(self, query):
+        # prepared once per query like CassandraClient
+        if query not in self._prepared:
+            self._prepared.add(query)
+            if self.recorder is not None:
+                self.recorder.record("cassandra", "prepare")
+        return query
+
+    @round_trip("cassandra")
+    def execute(self, query, parameters=None):
+        return self._execute(query, parameters)
+
+    def _execute(self, query, parameters=None):
+        insert = _INSERT.search(query)
+        if insert:
+            table, columns = insert.group(1), [column.strip() for column in insert.group(2).split(",")]
+            with self._lock:
+                self._tables.setdefault(table, []).append(dict(zip(columns, parameters)))
+            return []
+        select = _SELECT.search(query.strip())
+        if select:
+            return self._select(select, parameters or [])
+        # DDL
+        return []
+
+    def _select(self, match, parameters):
+        distinct, columns, table, where = match.groups()
+        columns = [column.strip() for column in columns.split(",")]
+        conditions = [condition.split("=")[0].strip() for condition in re.split(r"\s+AND\s+", where, flags=re.IGNORECASE)] if where else []
+        Row = namedtuple("Row", columns)
+        with self._lock:
+            rows = list(self._tables.get(table, []))
+        result = []
+        for row in rows:
+            if all(row.get(column) == value for column, value in zip(conditions, parameters)):
+                result.append(Row(*(row.get(column) for column in columns)))
+        if distinct:
+            result = list(dict.fromkeys(result))
+        return result
+
+    @round_trip("cassandra")
+    def execute_async(self, query, parameters=None):
+        return _Future(self._execute(query, parameters))
+
+    # the statements of a concurrent execution are in flight together, they count, and wait, as one round trip
+    @round_trip("cassandra")
+    def execute_concurrent(self, query, parameters, concurrency=100):
+        return [_ExecutionResult(True, self._execute(query, params)) for params in parameters]
+
+    @round_trip("cassandra")
+    def execute_concurrent_statements(self, statements, concurrency=100):
+        return [_ExecutionResult(True, self._execute(query, params)) for query, params in statements]
+
+
+# what cassandra.concurrent.execute_concurrent returns for every statement
+_ExecutionResult = namedtuple("ExecutionResult", ["success", "result_or_exc"])
+
+
+class _Future:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def result(self):
+        return self._rows
+
+
+class SQLiteDatabase:
+    # Postgres replaced by a SQLite file, shared by every thread of the benchmark
+    def __init__(self, path=None, recorder=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="senser-bench-", suffix=".db")
+            os.close(fd)
+        self.path = path
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+        models.Base.metadata.drop_all(bind=self.engine)
+        models.Base.metadata.create_all(bind=self.engine)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        if recorder is not None:
+            @event.listens_for(self.engine, "before_cursor_execute")
+            def count_statement(conn, cursor, statement, parameters, context, executemany):
+                recorder.record("postgres", statement.split(None, 1)[0].lower())
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def close(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+
+class StandIns:
+    def __init__(self, sqlite_path=None, latency=0.0, latencies=None):
+        self.recorder = CallRecorder(latency, latencies)
+        self.database = SQLiteDatabase(sqlite_path, self.recorder)
+        self.redis = InMemoryRedis(self.recorder)
+        self.mongodb = InMemoryMongoDB(self.recorder)
+        self.elastic = InMemoryElasticsearch(self.recorder)
+        self.timescale = InMemoryTimescalePool(self.recorder)
+        self.cassandra = InMemoryCassandra(self.recorder)
+
+    def install(self, app, resources):
+        # Route the app at the stand-ins: the shared clients through resources, postgresql through get_db
+        from app.sensors.cache import metadata_cache
+        from app.sensors.controller import get_db
+
+        metadata_cache.invalidate()
+        resources.open_with(self.redis, self.mongodb, self.elastic, self.timescale, self.cassandra)
+        app.dependency_overrides[get_db] = self.database.get_db
+
+    def uninstall(self, app, resources):
+        from app.sensors.controller import get_db
+
+        resources.close()
+        app.dependency_overrides.pop(get_db, None)
+        self.database.close()
@@ -0,0 +1,17 @@
+from benchmarks.http_replay import percentile
+
+
+def test_percentile_is_the_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile(values, 0.07) == 7
+    assert percentile(values, 1.0) == 100
+
+def test_percentile_of_few_values():
+    values = list(range(1, 21))
+    assert percentile(values, 0.95) == 19
+    assert percentile(values, 0.50) == 10
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
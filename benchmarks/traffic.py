@@ -0,0 +1,116 @@
+# Synthetic sensors and readings shared by the benchmarks.
+import random
+from datetime import datetime, timedelta, timezone
+
+SENSOR_TYPES = ("Temperatura", "Velocitat")
+
+# area the sensors are spread over, around Barcelona
+LATITUDE = (41.35, 41.45)
+LONGITUDE = (2.10, 2.22)
+
+
+def sensor_payload(index, rng, sensor_type=None):
+    # body of POST /sensors for the index-th sensor of a fleet
+    sensor_type = sensor_type or SENSOR_TYPES[index % len(SENSOR_TYPES)]
+    return {
+        "name": f"Sensor {sensor_type} {index}",
+        "latitude": round(rng.uniform(*LATITUDE), 6),
+        "longitude": round(rng.uniform(*LONGITUDE), 6),
+        "type": sensor_type,
+        "mac_address": ":".join(f"{(index >> shift) & 0xff:02x}" for shift in (40, 32, 24, 16, 8, 0)),
+        "manufacturer": "Dummy",
+        "model": f"Dummy {sensor_type}",
+        "serie_number": f"{index:016d}",
+        "firmware_version": "1.0",
+        "description": f"Sensor de {sensor_type.lower()} {index} del fabricant Dummy",
+    }
+
+
+def reading_payload(sensor_type, rng, last_seen):
+    # body of POST /sensors/{id}/data, temperature sensors report temperature and humidity, the others velocity
+    reading = {"velocity": None, "temperature": None, "humidity": None,
+               "battery_level": round(rng.uniform(0.05, 1.0), 3),
+               "last_seen": format_timestamp(last_seen)}
+    if sensor_type == "Temperatura":
+        reading["temperature"] = round(rng.gauss(18, 6), 2)
+        reading["humidity"] = round(rng.uniform(0.2, 0.9), 3)
+    else:
+        reading["velocity"] = round(abs(rng.gauss(40, 20)), 2)
+    return reading
+
+
+def format_timestamp(timestamp):
+    return timestamp.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def setup_requests(sensors, seed=0):
+    # registers the fleet and gives every sensor a first reading, sensor ids are expected to be 1..sensors
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    requests = []
+    for index in range(sensors):
+        requests.append({"method": "POST", "path": "/sensors", "json": sensor_payload(index, rng)})
+    for index in range(sensors):
+        sensor_type = SENSOR_TYPES[index % len(SENSOR_TYPES)]
+        requests.append({"method": "POST", "path": f"/sensors/{index + 1}/data", "json": reading_payload(sensor_type, rng, now)})
+    return requests
+
+
+# relative weight of every kind of generated request
+DEFAULT_MIX = {
+    "record_data": 60,
+    "record_data_batch": 5,
+    "get_sensor": 8,
+    "get_data": 8,
+    "near": 5,
+    "search": 5,
+    "latest": 3,
+    "low_battery": 2,
+    "temperature_values": 2,
+    "quantity_by_type": 2,
+}
+
+
+def generate_requests(count, sensors, seed=0, mix=None):
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    now = datetime.now(timezone.utc)
+    requests = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        index = rng.randrange(sensors)
+        sensor_id = index + 1
+        sensor_type = SENSOR_TYPES[index % len(SENSOR_TYPES)]
+        last_seen = now + timedelta(seconds=i)
+        if kind == "record_data":
+            request = {"method": "POST", "path": f"/sensors/{sensor_id}/data", "json": reading_payload(sensor_type, rng, last_seen)}
+        elif kind == "record_data_batch":
+            readings = []
+            for _ in range(rng.randint(10, 100)):
+                index = rng.randrange(sensors)
+                readings.append({"sensor_id": index + 1, **reading_payload(SENSOR_TYPES[index % len(SENSOR_TYPES)], rng, last_seen)})
+            request = {"method": "POST", "path": "/sensors/data/batch", "json": {"readings": readings}}
+        elif kind == "get_sensor":
+            request = {"method": "GET", "path": f"/sensors/{sensor_id}"}
+        elif kind == "get_data":
+            request = {"method": "GET", "path": f"/sensors/{sensor_id}/data",
+                       "params": {"from": format_timestamp(now - timedelta(days=1)), "to": format_timestamp(now + timedelta(days=1)),
+                                  "bucket": rng.choice(("hour", "day"))}}
+        elif kind == "near":
+            request = {"method": "GET", "path": "/sensors/near",
+                       "params": {"latitude": round(rng.uniform(*LATITUDE), 6), "longitude": round(rng.uniform(*LONGITUDE), 6),
+                                  "radius": rng.choice((500, 1000, 2000)), "limit": 50}}
+        elif kind == "search":
+            request = {"method": "GET", "path": "/sensors/search",
+                       "params": {"query": f'{{"type": "{sensor_type}"}}', "size": 10, "from": rng.randrange(0, 50)}}
+        elif kind == "latest":
+            request = {"method": "GET", "path": "/sensors/latest", "params": {"metric": "battery_level", "gt": 0.9}}
+        elif kind == "low_battery":
+            request = {"method": "GET", "path": "/sensors/low_battery"}
+        elif kind == "temperature_values":
+            request = {"method": "GET", "path": "/sensors/temperature/values"}
+        else:
+            request = {"method": "GET", "path": "/sensors/quantity_by_type"}
+        requests.append(request)
+    return requests
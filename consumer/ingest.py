@@ -0,0 +1,139 @@
+# Consumer of the one-way ingest queue filled by controller_mq.record_data.
+# Readings are taken in batches of up to INGEST_BATCH_SIZE, or whatever arrived within INGEST_FLUSH_INTERVAL seconds,
+# and stored with one redis pipeline, one timescale insert and one round of cassandra writes per batch.
+# A batch is acknowledged at once after it is stored and requeued when storing it fails, so a reading can be stored
+# twice but is never lost. A batch failing with a data error is stored one reading at a time and the readings
+# the databases refuse are dropped, a single bad reading does not keep the queue from moving.
+# Usage: python -m consumer.ingest
+import logging
+import os
+import signal
+import time
+
+from pydantic import ValidationError
+
+from shared import codec
+from shared.publisher import READINGS_QUEUE
+from shared.subscriber import Subscriber
+from app.sensors import schemas, repository
+from app.sensors.ingest_buffer import is_data_error
+from app.resources import resources
+from consumer.main import message_clients
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", "0.5"))
+
+
+def parse_readings(body, content_type=None):
+    # a message holds one or more readings, malformed ones, a last_seen that is not a timestamp included,
+    # are dropped since they never get better
+    try:
+        decoded = codec.decode(body, content_type)
+    except ValueError as e:
+        logger.warning("Dropping undecodable readings message: %s", e)
+        return []
+    readings = []
+    for reading in decoded if isinstance(decoded, list) else [decoded]:
+        try:
+            readings.append(schemas.SensorReading.parse_obj(reading))
+        except ValidationError as e:
+            logger.warning("Dropping malformed reading: %s", e)
+    return readings
+
+
+def store_batch(readings):
+    if not readings:
+        return 0
+    with message_clients() as clients:
+        return repository.ingest_readings(redis=clients.redis, readings=readings, db=clients.db, mongodb_client=clients.mongodb, timescale_client=clients.timescale, cassandra_client=clients.cassandra)
+
+
+class IngestConsumer:
+    def __init__(self, subscriber, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL, queue=READINGS_QUEUE):
+        self.channel = subscriber.channel
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue
+        self._stopping = False
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def run(self):
+        self.channel.queue_declare(queue=self.queue, durable=True)
+        # the next batch is already on its way while the current one is stored
+        self.channel.basic_qos(prefetch_count=self.batch_size * 2)
+
+        readings = []
+        messages = 0
+        last_tag = None
+        deadline = time.monotonic() + self.flush_interval
+        # yields (None, None, None) after flush_interval seconds without messages
+        for method, properties, body in self.channel.consume(self.queue, inactivity_timeout=self.flush_interval):
+            if method is not None:
+                readings += parse_readings(body, properties.content_type)
+                messages += 1
+                last_tag = method.delivery_tag
+            if messages and (len(readings) >= self.batch_size or time.monotonic() >= deadline or self._stopping):
+                self._flush(readings, last_tag)
+                readings = []
+                messages = 0
+            if not messages:
+                deadline = time.monotonic() + self.flush_interval
+            if self._stopping and not messages:
+                break
+        # prefetched readings that were not taken go back to the queue
+        self.channel.cancel()
+
+    def _flush(self, readings, last_tag):
+        try:
+            stored = store_batch(readings)
+        except Exception as e:
+            if not is_data_error(e):
+                self._requeue(readings, last_tag)
+                return
+            logger.warning("Storing %d readings failed on their data, storing them one by one: %s", len(readings), e)
+            try:
+                stored = self._store_one_by_one(readings)
+            except Exception:
+                self._requeue(readings, last_tag)
+                return
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+        logger.debug("Stored %d of %d readings", stored, len(readings))
+
+    def _requeue(self, readings, last_tag):
+        logger.exception("Failed to store %d readings, requeueing them", len(readings))
+        self.channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+        time.sleep(1)
+
+    def _store_one_by_one(self, readings):
+        # the readings refused for their data are dropped, any other error requeues the whole batch
+        stored = 0
+        for reading in readings:
+            try:
+                stored += store_batch([reading])
+            except Exception as e:
+                if not is_data_error(e):
+                    raise
+                logger.error("Dropping reading of sensor %s at %s the databases refuse: %s", reading.sensor_id, reading.last_seen, e)
+        return stored
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    resources.open()
+    subscriber = Subscriber()
+    consumer = IngestConsumer(subscriber)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, consumer.stop)
+    try:
+        consumer.run()
+    finally:
+        subscriber.close()
+        resources.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,116 +1,152 @@
-import json
-import pika
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
 
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from shared import codec
 from shared.subscriber import Subscriber
+from app.sensors import schemas, repository
+from app.database import SessionLocal
+from app.resources import resources
 
-subscriber = Subscriber()
+logger = logging.getLogger(__name__)
 
-import json
-from fastapi import APIRouter, Depends, HTTPException, Query
-from app.sensors import models, schemas, repository
-from app.database import SessionLocal
-from app.redis_client import RedisClient
-from app.mongodb_client import MongoDBClient
-from app.elasticsearch_client import ElasticsearchClient 
-from app.timescale import Timescale
-from app.cassandra_client import CassandraClient
-
-# Dependency to get db session
-def get_db():
+# request_type -> handler(data, clients)
+HANDLERS = {}
+
+
+def handler(request_type):
+    def register(func):
+        HANDLERS[request_type] = func
+        return func
+    return register
+
+
+class Clients:
+    # Clients used while handling one message. The backend clients are the ones shared by the whole
+    # process, only the postgresql session and the pooled timescale connection belong to the message.
+
+    def __init__(self, resources, db, timescale):
+        self.db = db
+        self.timescale = timescale
+        self.redis = resources.redis
+        self.mongodb = resources.mongodb
+        self.es = resources.elastic
+        self.cassandra = resources.cassandra
+        self.ingest_buffer = resources.ingest_buffer
+
+
+@contextmanager
+def message_clients():
+    shared = resources.get()
     db = SessionLocal()
+    # borrows a pooled connection only if the handler uses it
+    timescale = shared.timescale.get()
     try:
-        yield db
+        yield Clients(shared, db, timescale)
     finally:
+        timescale.close()
         db.close()
 
-def get_timescale():
-    ts = Timescale()
-    try:
-        yield ts
-    finally:
-        ts.close()
 
-# Dependency to get redis client
-def get_redis_client():
-    redis = RedisClient(host="redis")
-    try:
-        yield redis
-    finally:
-        redis.close()
+def parse_datetime(value) -> Optional[datetime]:
+    return parse_obj_as(Optional[datetime], value)
 
-# Dependency to get mongodb client
-def get_mongodb_client():
-    mongodb = MongoDBClient(host="mongodb")
-    try:
-        yield mongodb
-    finally:
-        mongodb.close()
 
-# Dependency to get elastic_search client
-def get_elastic_search():
-    es = ElasticsearchClient(host="elasticsearch")
-    try:
-        yield es
-    finally:
-        es.close()
+@handler('search')
+def search(data, clients):
+    return repository.search_sensors(db=clients.db, mongodb=clients.mongodb, es=clients.es, query=data['query'], size=data['size'], search_type=data['search_type'], from_=data.get('from', 0))
+
+
+@handler('near')
+def near(data, clients):
+    return repository.get_sensors_near(latitude=data['latitude'], longitude=data['longitude'], radius=data['radius'], db=clients.db, mongodb_client=clients.mongodb, redis_client=clients.redis, limit=data.get('limit', 0))
+
 
-# Dependency to get cassandra client
-def get_cassandra_client():
-    cassandra = CassandraClient(hosts=["cassandra"])
+@handler('temperature/values')
+def temperature_values(data, clients):
+    return repository.get_values_sensor_temperatura(db=clients.db, redis=clients.redis, mongodb_client=clients.mongodb, timescale_client=clients.timescale, cassandra_client=clients.cassandra)
+
+
+@handler('quantity_by_type')
+def quantity_by_type(data, clients):
+    return repository.get_quantity_by_type(db=clients.db, redis=clients.redis, mongodb_client=clients.mongodb, timescale_client=clients.timescale, cassandra_client=clients.cassandra)
+
+
+@handler('low_battery')
+def low_battery(data, clients):
+    return repository.get_low_battery(db=clients.db, redis=clients.redis, mongodb_client=clients.mongodb, timescale_client=clients.timescale, cassandra_client=clients.cassandra)
+
+
+@handler('get_sensors')
+def get_sensors(data, clients):
+    return repository.get_sensors(clients.db)
+
+
+@handler('create_sensor')
+def create_sensor(data, clients):
+    sensor = schemas.SensorCreate(**data['sensor'])
+    if repository.get_sensor_by_name(clients.db, sensor.name):
+        raise HTTPException(status_code=400, detail="Sensor with same name already registered")
+    return repository.create_sensor(db=clients.db, sensor=sensor, mongodb_client=clients.mongodb, elastic_client=clients.es, redis=clients.redis)
+
+
+@handler('get_sensor_by_id')
+def get_sensor(data, clients):
+    return repository.get_sensor(clients.db, data['sensor_id'], clients.mongodb)
+
+
+@handler('delete_sensor_by_id')
+def delete_sensor(data, clients):
+    repository.get_sensor(clients.db, data['sensor_id'], clients.mongodb)
+    return repository.delete_sensor(db=clients.db, sensor_id=data['sensor_id'], mongodb_client=clients.mongodb, redis=clients.redis, elastic_client=clients.es)
+
+
+@handler('post_sensor_by_id_data')
+def record_data(data, clients):
+    return repository.record_data(redis=clients.redis, sensor_id=data['sensor_id'], data=schemas.SensorData(**data['data']), db=clients.db, mongodb_client=clients.mongodb, timescale_client=clients.timescale, cassandra_client=clients.cassandra, ingest_buffer=clients.ingest_buffer)
+
+
+@handler('get_sensor_by_id_data')
+def get_data(data, clients):
+    return repository.get_data(redis=clients.redis, sensor_id=data['sensor_id'], from_date=parse_datetime(data.get('from_date')), to_date=parse_datetime(data.get('to_date')), bucket=data.get('bucket'), db=clients.db, mongodb_client=clients.mongodb, timescale_client=clients.timescale)
+
+
+def callback(body):
+    message = codec.json_codec.decode(body)
+    request_type = message['request_type']
+    func = HANDLERS.get(request_type)
+
+    # errors the api would have answered are sent back for controller_mq to raise them again,
+    # anything else fails the message so the subscriber retries it
+    if func is None:
+        reply = {'status_code': 400, 'detail': f"Unknown request type: {request_type}"}
+    else:
+        try:
+            with message_clients() as clients:
+                reply = {'status_code': 200, 'response': jsonable_encoder(func(message['data'], clients))}
+        except HTTPException as e:
+            reply = {'status_code': e.status_code, 'detail': e.detail}
+
+    # the subscriber sends the reply and acknowledges the request once this returns
+    return codec.json_codec.encode(reply)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # create schemas and warm the connections before taking messages
+    resources.open()
+    subscriber = Subscriber()
     try:
-        yield cassandra
+        subscriber.consume(callback)
     finally:
-        cassandra.close()
+        subscriber.close()
+        resources.close()
 
 
-def callback(ch, method, properties, body,  
-             db = Depends(get_db), 
-             mongodb_client: MongoDBClient = Depends(get_mongodb_client), 
-             es: ElasticsearchClient = Depends(get_elastic_search),
-             redis_client: RedisClient = Depends(get_redis_client),
-             timescale_client = Depends(get_timescale),
-             cassandra_client = Depends(get_cassandra_client)):
-    message = json.loads(body)
-    request_type = message['request_type']
-    data = message['data']
-
-    response = {'response'}
-    if request_type == 'search':
-        response  = repository.search_sensors(db=db,mongodb=mongodb_client, es=es, query=data['query'], size=data['size'], search_type=data['search_type'])
-    elif request_type == 'near':
-        response = repository.get_sensors_near(latitude=data['latitude'], longitude=data['longitude'], radius=data['radius'], db=db, mongodb_client=mongodb_client, redis_client=redis_client)
-    elif request_type == 'temperature/values':
-        response = repository.get_values_sensor_temperatura(db=db, redis=redis_client, mongodb_client=mongodb_client, timescale_client= timescale_client, cassandra_client=cassandra_client)
-    elif request_type == 'quantity_by_type':
-        response =  repository.get_quantity_by_type(db=db, redis=redis_client, mongodb_client=mongodb_client, timescale_client= timescale_client, cassandra_client=cassandra_client)
-    elif request_type == 'low_battery':
-        response = repository.get_low_battery(db=db, redis=redis_client, mongodb_client=mongodb_client, timescale_client= timescale_client, cassandra_client=cassandra_client)
-    elif request_type == 'get_sensors':
-        response = repository.get_sensors(db)
-    elif request_type == 'create_sensor':
-        db_sensor = repository.get_sensor_by_name(db, data['sensor'].name)
-        if db_sensor:
-            raise HTTPException(status_code=400, detail="Sensor with same name already registered")
-        response = repository.create_sensor(db=db, sensor=data['sensor'], mongodb_client=mongodb_client, elastic_client=ElasticsearchClient)
-    elif request_type == 'get_sensor_by_id':
-        db_sensor = repository.get_sensor(db, data['sensor_id'], mongodb_client)
-        if db_sensor is None:
-            raise HTTPException(status_code=404, detail="Sensor not found")
-        response = db_sensor
-    elif request_type == 'delete_sensor_by_id':
-        db_sensor = repository.get_sensor(db, data['sensor_id'], )
-        if db_sensor is None:
-            raise HTTPException(status_code=404, detail="Sensor not found")
-        response = repository.delete_sensor(db=db, sensor_id=data['sensor_id'], mongodb_client=mongodb_client)
-    elif request_type == 'post_sensor_by_id_data':
-        response = repository.record_data(redis=redis_client, sensor_id=data['sensor_id'], data=data, db=db, mongodb_client=mongodb_client, timescale_client=timescale_client, cassandra_client=cassandra_client)
-
-    elif request_type == 'get_sensor_by_id_data':
-        response = repository.get_data(redis=redis_client, sensor_id=data['sensor_id'], from_date=data['from_date'], to_date=data['to_date'], bucket=data['bucket'], db=db, mongodb_client=mongodb_client, timescale_client= timescale_client)
-
-                                                          
-
-    ch.basic_publish(exchange='', routing_key=properties.reply_to, properties=pika.BasicProperties(correlation_id=properties.correlation_id), body=json.dumps(response))
-
-
-subscriber.subscribe(callback)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+from shared import codec
+from consumer import ingest
+
+
+class FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+    return ingest.IngestConsumer(SimpleNamespace(channel=FakeChannel()))
+
+
+def readings(*sensor_ids):
+    return [ingest.schemas.SensorReading(sensor_id=sensor_id, battery_level=0.5, last_seen="2020-01-01T00:00:00Z") for sensor_id in sensor_ids]
+
+
+def test_parse_readings_drops_readings_without_a_timestamp():
+    body = codec.json_codec.encode([{"sensor_id": 1, "battery_level": 0.5, "last_seen": "yesterday"},
+                                    {"sensor_id": 2, "battery_level": 0.5, "last_seen": "2020-01-01T00:00:00Z"}])
+    assert [reading.sensor_id for reading in ingest.parse_readings(body, codec.JSON)] == [2]
+
+
+def test_a_bad_reading_is_dropped(consumer, monkeypatch):
+    stored = []
+
+    def store_batch(batch):
+        if any(reading.sensor_id == 2 for reading in batch):
+            raise ValueError("bad reading")
+        stored.extend(reading.sensor_id for reading in batch)
+        return len(batch)
+
+    monkeypatch.setattr(ingest, "store_batch", store_batch)
+    consumer._flush(readings(1, 2, 3), 1)
+    assert consumer.channel.calls == [("ack", 1)]
+    assert stored == [1, 3]
+
+
+def test_a_single_reading_is_requeued_while_the_backends_are_down(consumer, monkeypatch):
+    def store_batch(batch):
+        raise ConnectionError("timescale unavailable")
+
+    monkeypatch.setattr(ingest, "store_batch", store_batch)
+    for tag in range(1, 11):
+        consumer._flush(readings(1), tag)
+    assert consumer.channel.calls == [("nack", tag, True) for tag in range(1, 11)]
+
+    monkeypatch.setattr(ingest, "store_batch", lambda batch: len(batch))
+    consumer._flush(readings(1), 11)
+    assert consumer.channel.calls[-1] == ("ack", 11)
+
+
+def test_a_batch_is_requeued_when_a_backend_goes_down_while_storing_one_by_one(consumer, monkeypatch):
+    def store_batch(batch):
+        if len(batch) > 1:
+            raise ValueError("bad reading")
+        raise ConnectionError("cassandra unavailable")
+
+    monkeypatch.setattr(ingest, "store_batch", store_batch)
+    consumer._flush(readings(1, 2), 1)
+    assert consumer.channel.calls == [("nack", 1, True)]
@@ -0,0 +1,22 @@
+from yoyo import step
+
+__depends__ = {'20230212_02_VKKLZ'}
+
+steps = [
+   step(
+       "CREATE EXTENSION IF NOT EXISTS timescaledb;",
+   ),
+   # hypertables need the time column in every unique constraint, the serial id is kept as a plain column.
+   # Rolled back after create_hypertable the table is still a hypertable, so the key has to include last_seen.
+   step(
+       "ALTER TABLE sensor_data DROP CONSTRAINT IF EXISTS sensor_data_pkey;",
+       "ALTER TABLE sensor_data ADD PRIMARY KEY (id, last_seen);",
+   ),
+   step(
+       "SELECT create_hypertable('sensor_data', 'last_seen', migrate_data => true, if_not_exists => true);",
+   ),
+   step(
+       "CREATE INDEX IF NOT EXISTS sensor_data_sensor_id_last_seen_idx ON sensor_data (sensor_id, last_seen DESC);",
+       "DROP INDEX IF EXISTS sensor_data_sensor_id_last_seen_idx;",
+   ),
+]
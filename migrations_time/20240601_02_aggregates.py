@@ -0,0 +1,58 @@
+from yoyo import step
+
+__depends__ = {'20240601_01_hypertable'}
+
+# continuous aggregates can not be created or refreshed inside a transaction
+__transactional__ = False
+
+# view name, bucket width, refresh policy (start offset, end offset, schedule interval)
+AGGREGATES = [
+    ('sensor_data_hourly', '1 hour', ('3 hours', '1 hour', '30 minutes')),
+    ('sensor_data_daily', '1 day', ('3 days', '1 hour', '1 hour')),
+    ('sensor_data_weekly', '1 week', ('3 weeks', '1 hour', '1 day')),
+    ('sensor_data_monthly', '1 month', ('3 months', '1 day', '1 day')),
+    ('sensor_data_yearly', '1 year', ('3 years', '1 day', '1 day')),
+]
+
+METRICS = ['velocity', 'temperature', 'humidity', 'battery_level']
+
+
+def aggregate_columns():
+    columns = []
+    for metric in METRICS:
+        value = f"(data->>'{metric}')::float"
+        columns += [f"avg({value}) AS {metric}_avg",
+                    f"min({value}) AS {metric}_min",
+                    f"max({value}) AS {metric}_max",
+                    f"count({value}) AS {metric}_count"]
+    return ",\n    ".join(columns)
+
+
+steps = []
+for view, width, (start_offset, end_offset, schedule_interval) in AGGREGATES:
+    steps += [
+        step(
+            f"""CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT sensor_id,
+    time_bucket(INTERVAL '{width}', last_seen) AS bucket,
+    count(*) AS readings,
+    {aggregate_columns()}
+FROM sensor_data
+GROUP BY sensor_id, bucket
+WITH NO DATA;""",
+            f"DROP MATERIALIZED VIEW IF EXISTS {view};",
+        ),
+        step(
+            f"""SELECT add_continuous_aggregate_policy('{view}',
+    start_offset => INTERVAL '{start_offset}',
+    end_offset => INTERVAL '{end_offset}',
+    schedule_interval => INTERVAL '{schedule_interval}',
+    if_not_exists => true);""",
+            f"SELECT remove_continuous_aggregate_policy('{view}', if_exists => true);",
+        ),
+        # materialize the history that already exists, the policy only keeps the recent buckets fresh
+        step(
+            f"CALL refresh_continuous_aggregate('{view}', NULL, NULL);",
+        ),
+    ]
@@ -0,0 +1,34 @@
+from yoyo import step
+
+__depends__ = {'20240601_02_aggregates'}
+
+# Readings of gateways flushing a backlog arrive late. A policy only refreshes the buckets newer than its start offset,
+# the hourly and daily ones now look back 8 days. Readings older than each policy covers are refreshed when
+# they are written, see repository.refresh_late_history.
+# view, (start offset, end offset, schedule interval) before and after
+POLICIES = [
+    ('sensor_data_hourly', ('3 hours', '1 hour', '30 minutes'), ('8 days', '1 hour', '30 minutes')),
+    ('sensor_data_daily', ('3 days', '1 hour', '1 hour'), ('8 days', '1 hour', '1 hour')),
+]
+
+
+def add_policy(view, start_offset, end_offset, schedule_interval):
+    return f"""SELECT add_continuous_aggregate_policy('{view}',
+    start_offset => INTERVAL '{start_offset}',
+    end_offset => INTERVAL '{end_offset}',
+    schedule_interval => INTERVAL '{schedule_interval}',
+    if_not_exists => true);"""
+
+
+steps = []
+for view, before, after in POLICIES:
+    steps += [
+        step(
+            f"SELECT remove_continuous_aggregate_policy('{view}', if_exists => true);",
+            add_policy(view, *before),
+        ),
+        step(
+            add_policy(view, *after),
+            f"SELECT remove_continuous_aggregate_policy('{view}', if_exists => true);",
+        ),
+    ]
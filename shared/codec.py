@@ -0,0 +1,124 @@
+# Message codecs for the queues, chosen by the content_type property of each message.
+# RPC requests and replies use JSON. Readings use a fixed binary layout about a quarter of the size of their JSON form,
+# with JSON as the fallback for readings it can not represent. benchmarks.codec_bench compares both.
+import json
+import struct
+from datetime import date, datetime, timedelta, timezone
+
+from pydantic import BaseModel
+
+JSON = "application/json"
+READINGS = "application/vnd.senser.readings"
+
+METRICS = ("velocity", "temperature", "humidity", "battery_level")
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _default(value):
+    # pydantic models and dates are not serializable by the json module
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+    content_type = JSON
+
+    def encode(self, message) -> bytes:
+        return json.dumps(message, default=_default, separators=(",", ":")).encode()
+
+    def decode(self, body: bytes):
+        return json.loads(body)
+
+
+class ReadingCodec:
+    # A message is a list of readings, each one a fixed size record:
+    # version, presence flags of the optional metrics, sensor_id, last_seen in microseconds since the epoch (UTC),
+    # then velocity, temperature, humidity and battery_level as doubles, absent metrics are sent as 0.
+    content_type = READINGS
+    version = 1
+    record = struct.Struct("<BBIq4d")
+
+    def encode(self, readings) -> bytes:
+        # Raises ValueError for readings the layout can not hold
+        body = bytearray()
+        for reading in readings:
+            flags = 0
+            values = []
+            for bit, metric in enumerate(METRICS):
+                value = reading.get(metric)
+                if value is None:
+                    if metric == "battery_level":
+                        raise ValueError("battery_level is required")
+                    values.append(0.0)
+                else:
+                    flags |= 1 << bit
+                    values.append(float(value))
+            try:
+                body += self.record.pack(self.version, flags, reading["sensor_id"], _to_micros(reading["last_seen"]), *values)
+            except struct.error as e:
+                raise ValueError(str(e))
+        return bytes(body)
+
+    def decode(self, body: bytes):
+        if len(body) % self.record.size:
+            raise ValueError(f"Truncated readings message of {len(body)} bytes")
+        readings = []
+        for version, flags, sensor_id, micros, *values in self.record.iter_unpack(body):
+            if version != self.version:
+                raise ValueError(f"Unknown readings version {version}")
+            reading = {"sensor_id": sensor_id, "last_seen": _from_micros(micros)}
+            for bit, (metric, value) in enumerate(zip(METRICS, values)):
+                reading[metric] = value if flags & (1 << bit) else None
+            readings.append(reading)
+        return readings
+
+
+def _to_micros(last_seen) -> int:
+    if isinstance(last_seen, str):
+        last_seen = datetime.fromisoformat(last_seen)
+    # naive timestamps are taken as UTC, as the repository does
+    if last_seen.tzinfo is None:
+        last_seen = last_seen.replace(tzinfo=timezone.utc)
+    delta = last_seen - EPOCH.replace(tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_micros(micros: int) -> str:
+    # isoformat of a naive datetime is several times cheaper than strftime
+    return (EPOCH + timedelta(microseconds=micros)).isoformat(timespec="microseconds") + "Z"
+
+
+CODECS = {}
+
+
+def register(codec):
+    CODECS[codec.content_type] = codec
+    return codec
+
+
+json_codec = register(JsonCodec())
+reading_codec = register(ReadingCodec())
+
+
+def get_codec(content_type=None):
+    # messages without a content type predate the codecs and are JSON
+    codec = CODECS.get(content_type or JSON)
+    if codec is None:
+        raise ValueError(f"Unsupported content type: {content_type}")
+    return codec
+
+
+def encode_readings(readings):
+    # Returns (content_type, body), the binary layout when every reading fits in it and JSON otherwise
+    try:
+        return READINGS, reading_codec.encode(readings)
+    except (ValueError, KeyError, TypeError):
+        return JSON, json_codec.encode(readings)
+
+
+def decode(body: bytes, content_type=None):
+    return get_codec(content_type).decode(body)
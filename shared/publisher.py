@@ -1,49 +1,217 @@
 import pika
 import uuid
-import json
 import time
+import logging
+import threading
+from concurrent import futures
+
+from shared import codec
 
 QUEUE_NAME = 'test'
 
-class Publisher:
+logger = logging.getLogger(__name__)
 
-    channel = None
-    conn = None
 
-    def __init__(self):
+class Publisher:
+    # Long-lived RPC publisher shared by every request of a worker.
+    # One IO thread owns the connection and the reply queue, pika connections are not thread safe,
+    # so other threads only hand it work through add_callback_threadsafe.
+    # In-flight requests are matched to their replies by correlation id.
+
+    def __init__(self, host='rabbitmq', port=5672, timeout=30.0, max_backoff=30.0):
         credentials = pika.PlainCredentials('guest', 'guest')
-        parameters = pika.ConnectionParameters('rabbitmq',
-                                       5672,
+        self.parameters = pika.ConnectionParameters(host,
+                                       port,
                                        '/',
                                        credentials)
-        try:
-            self.conn = pika.BlockingConnection(parameters)
-        except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.conn = None
+        self.channel = None
+        self.callback_queue = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="rpc-publisher", daemon=True)
+        self._thread.start()
 
+    def _connect(self):
+        self.conn = pika.BlockingConnection(self.parameters)
         self.channel = self.conn.channel()
         self.callback_queue = self.channel.queue_declare(queue='', exclusive=True).method.queue
         self.channel.basic_consume(queue=self.callback_queue, on_message_callback=self.on_response, auto_ack=True)
-        self.response = None
-        self.corr_id = None
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stopping:
+            try:
+                self._connect()
+                backoff = 1.0
+                self._ready.set()
+                while not self._stopping:
+                    # returns at least every second so a stop request is noticed
+                    self.conn.process_data_events(time_limit=1)
+            except Exception as e:
+                if self._stopping:
+                    break
+                logger.warning("RabbitMQ connection lost, reconnecting in %.0fs: %s", backoff, e)
+            self._ready.clear()
+            # replies of requests sent on the old connection would go to a reply queue that no longer exists
+            self._fail_pending(ConnectionError("RabbitMQ connection lost"))
+            self._close_connection()
+            if not self._stopping:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self._fail_pending(ConnectionError("Publisher closed"))
+        self._close_connection()
+
+    def _close_connection(self):
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+        self.channel = None
+
+    def _fail_pending(self, error):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
 
     def on_response(self, ch, method, properties, body):
-        if self.corr_id == properties.correlation_id:
-            self.response = body
-
-    def publish(self, request_type, data):
-        self.response = None
-        self.corr_id = str(uuid.uuid4())
-        message = {'request_type': request_type, 'data': data}
-        self.channel.basic_publish(
-            exchange='', routing_key=QUEUE_NAME,
-            properties=pika.BasicProperties(reply_to=self.callback_queue, correlation_id=self.corr_id),
-            body=json.dumps(message)
-        )
-        while self.response is None:
-            self.connection.process_data_events()
-        return self.response.decode()
-    
+        with self._lock:
+            future = self._pending.pop(properties.correlation_id, None)
+        # replies of requests that already timed out are dropped
+        if future is not None:
+            future.set_result(body)
+
+    def _send(self, corr_id, body):
+        # runs on the IO thread
+        try:
+            self.channel.basic_publish(
+                exchange='', routing_key=QUEUE_NAME,
+                properties=pika.BasicProperties(reply_to=self.callback_queue, correlation_id=corr_id, content_type=codec.JSON),
+                body=body
+            )
+        except Exception as e:
+            with self._lock:
+                future = self._pending.pop(corr_id, None)
+            if future is not None:
+                future.set_exception(e)
+
+    def publish(self, request_type, data, timeout=None):
+        # Raises TimeoutError when no reply arrives in time and ConnectionError when the broker is unreachable
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not self._ready.wait(timeout):
+            raise ConnectionError("RabbitMQ is not available")
+
+        corr_id = str(uuid.uuid4())
+        body = codec.json_codec.encode({'request_type': request_type, 'data': data})
+        future = futures.Future()
+        with self._lock:
+            self._pending[corr_id] = future
+        try:
+            conn = self.conn
+            if conn is None:
+                raise ConnectionError("RabbitMQ is not available")
+            conn.add_callback_threadsafe(lambda: self._send(corr_id, body))
+            response = future.result(max(deadline - time.monotonic(), 0))
+        except futures.TimeoutError:
+            raise TimeoutError(f"No reply to {request_type} after {timeout}s")
+        finally:
+            with self._lock:
+                self._pending.pop(corr_id, None)
+        return codec.json_codec.decode(response)
+
+    def close(self):
+        self._stopping = True
+        conn = self.conn
+        if conn is not None:
+            try:
+                # wake up the IO thread
+                conn.add_callback_threadsafe(lambda: None)
+            except Exception:
+                pass
+        self._thread.join()
+
+
+READINGS_QUEUE = 'sensor_readings'
+
+
+class ReadingPublisher:
+    # One-way publisher for sensor readings, nobody waits for a reply.
+    # Publisher confirms make publish() return only once the broker has the reading on disk.
+    # Shared by the threads of a worker, every thread publishes on a connection of its own:
+    # pika connections are not thread safe and a confirmed publish blocks its channel until the broker answers.
+
+    def __init__(self, host='rabbitmq', port=5672, queue=READINGS_QUEUE, retries=3):
+        credentials = pika.PlainCredentials('guest', 'guest')
+        self.parameters = pika.ConnectionParameters(host,
+                                       port,
+                                       '/',
+                                       credentials)
+        self.queue = queue
+        self.retries = retries
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = pika.BlockingConnection(self.parameters)
+        with self._lock:
+            self._connections.add(conn)
+        self._local.conn = conn
+        self._local.channel = conn.channel()
+        self._local.channel.queue_declare(queue=self.queue, durable=True)
+        self._local.channel.confirm_delivery()
+
+    def _close_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        self._local.channel = None
+        if conn is None:
+            return
+        with self._lock:
+            self._connections.discard(conn)
+        try:
+            if conn.is_open:
+                conn.close()
+        except Exception:
+            pass
+
+    def publish(self, reading):
+        self.publish_many([reading])
+
+    def publish_many(self, readings):
+        # Raises when the broker refuses the readings or stays unreachable after the retries.
+        # All the readings go in one message, in the binary reading layout when they fit in it.
+        content_type, body = codec.encode_readings(readings)
+        properties = pika.BasicProperties(delivery_mode=2, content_type=content_type)
+        for attempt in range(self.retries):
+            try:
+                conn = getattr(self._local, 'conn', None)
+                if conn is None or not conn.is_open:
+                    self._connect()
+                self._local.channel.basic_publish(exchange='', routing_key=self.queue, body=body, properties=properties, mandatory=True)
+                return
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+                self._close_connection()
+                if attempt == self.retries - 1:
+                    raise
+                logger.warning("Reading publish failed, reconnecting: %s", e)
+                time.sleep(min(2 ** attempt, 5))
+
     def close(self):
-        self.conn.close()
+        # closes the connections of every thread, at shutdown once nothing publishes any more
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            try:
+                if conn.is_open:
+                    conn.close()
+            except Exception:
+                pass
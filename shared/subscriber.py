@@ -1,7 +1,21 @@
 import pika
 import time
+import os
+import signal
+import logging
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 from shared.publisher import QUEUE_NAME
+from shared import codec
+
+logger = logging.getLogger(__name__)
+
+CONSUMER_WORKERS = int(os.environ.get("CONSUMER_WORKERS", "8"))
+# unacknowledged messages the broker hands to this consumer, enough to keep every worker busy
+CONSUMER_PREFETCH = int(os.environ.get("CONSUMER_PREFETCH", str(CONSUMER_WORKERS * 2)))
+
 
 class Subscriber:
     def __init__(self):
@@ -18,6 +32,8 @@ class Subscriber:
             self.conn = pika.BlockingConnection(parameters)
         self.channel = self.conn.channel()
         self.channel.queue_declare(queue=QUEUE_NAME, durable=True)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
 
 
     def subscribe(self, callback):
@@ -25,7 +41,85 @@ class Subscriber:
         self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
         self.channel.start_consuming()
 
+    def consume(self, handler, workers=CONSUMER_WORKERS, prefetch=CONSUMER_PREFETCH, queue=QUEUE_NAME):
+        # Run handler(body) on a pool of worker threads, it returns the reply body or None.
+        # A message is acknowledged, and answered when it has a reply_to, only after the handler succeeds.
+        # A failed message is requeued once and dropped when it fails again, answering a 500 error to its reply_to.
+        # SIGTERM and SIGINT stop taking new messages and wait for the ones being handled.
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="consumer")
+        self.channel.basic_qos(prefetch_count=prefetch)
+        consumer_tag = self.channel.basic_consume(
+            queue=queue,
+            on_message_callback=lambda ch, method, properties, body: self._dispatch(executor, handler, method, properties, body))
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        try:
+            self.channel.start_consuming()
+        finally:
+            self._drain(consumer_tag)
+            executor.shutdown(wait=True)
+
+    def _on_signal(self, signum, frame):
+        logger.info("Signal %s received, draining the consumer", signum)
+        self.stop()
+
+    def stop(self):
+        self.conn.add_callback_threadsafe(self.channel.stop_consuming)
+
+    def _dispatch(self, executor, handler, method, properties, body):
+        # runs on the connection thread
+        with self._in_flight_lock:
+            self._in_flight += 1
+        executor.submit(self._handle, handler, method, properties, body)
+
+    def _handle(self, handler, method, properties, body):
+        # runs on a worker thread, the channel is only used from the connection thread
+        try:
+            reply = handler(body)
+        except Exception as e:
+            logger.exception("Failed to handle message %s", properties.correlation_id)
+            # the message is dropped when it fails again, its sender gets an error instead of waiting for a timeout
+            error = None if not method.redelivered else codec.json_codec.encode({'status_code': 500, 'detail': str(e) or type(e).__name__})
+            callback = functools.partial(self._nack, method.delivery_tag, not method.redelivered, properties, error)
+        else:
+            callback = functools.partial(self._ack, method.delivery_tag, properties, reply)
+        self.conn.add_callback_threadsafe(callback)
+
+    def _reply(self, properties, reply):
+        if reply is not None and properties.reply_to:
+            self.channel.basic_publish(exchange='', routing_key=properties.reply_to,
+                                       properties=pika.BasicProperties(correlation_id=properties.correlation_id, content_type=codec.JSON),
+                                       body=reply)
+
+    def _ack(self, delivery_tag, properties, reply):
+        try:
+            self._reply(properties, reply)
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+        finally:
+            self._done()
+
+    def _nack(self, delivery_tag, requeue, properties=None, reply=None):
+        try:
+            if properties is not None:
+                self._reply(properties, reply)
+            self.channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _drain(self, consumer_tag):
+        # stop deliveries, then keep the connection running until the workers have acked what they took
+        if self.channel.is_open:
+            self.channel.basic_cancel(consumer_tag)
+        while self.conn.is_open:
+            with self._in_flight_lock:
+                if self._in_flight == 0:
+                    break
+            self.conn.process_data_events(time_limit=0.5)
+
     def close(self):
         self.conn.close()
-
-    
\ No newline at end of file
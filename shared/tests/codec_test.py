@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+from shared import codec
+from app.sensors import schemas
+
+
+def test_readings_round_trip():
+    readings = [
+        {"sensor_id": 1, "velocity": 45.0, "temperature": None, "humidity": None, "battery_level": 0.78, "last_seen": "2020-01-01T00:00:00.000Z"},
+        {"sensor_id": 2, "velocity": None, "temperature": 21.5, "humidity": 0.4, "battery_level": 0.1, "last_seen": "2020-01-01T00:00:01.250000+00:00"},
+    ]
+    content_type, body = codec.encode_readings(readings)
+    assert content_type == codec.READINGS
+    assert len(body) == 2 * codec.reading_codec.record.size
+    decoded = codec.decode(body, content_type)
+    assert decoded[0] == {**readings[0], "last_seen": "2020-01-01T00:00:00.000000Z"}
+    assert decoded[1] == {**readings[1], "last_seen": "2020-01-01T00:00:01.250000Z"}
+
+def test_readings_normalize_timestamps_to_utc():
+    content_type, body = codec.encode_readings([{"sensor_id": 1, "battery_level": 1.0, "last_seen": "2020-01-01T02:00:00+02:00"}])
+    assert codec.decode(body, content_type)[0]["last_seen"] == "2020-01-01T00:00:00.000000Z"
+
+def test_readings_fall_back_to_json():
+    readings = [{"sensor_id": 1, "battery_level": 0.5, "last_seen": "yesterday"}]
+    content_type, body = codec.encode_readings(readings)
+    assert content_type == codec.JSON
+    assert codec.decode(body, content_type) == readings
+
+def test_readings_reject_truncated_messages():
+    _, body = codec.encode_readings([{"sensor_id": 1, "battery_level": 0.5, "last_seen": "2020-01-01T00:00:00"}])
+    with pytest.raises(ValueError):
+        codec.decode(body[:-1], codec.READINGS)
+
+def test_json_encodes_models_and_datetimes():
+    data = schemas.SensorData(velocity=1.0, temperature=None, humidity=None, battery_level=0.5, last_seen="2020-01-01T00:00:00.000Z")
+    body = codec.json_codec.encode({"data": data, "from_date": datetime(2020, 1, 1)})
+    assert codec.decode(body) == {"data": data.dict(), "from_date": "2020-01-01T00:00:00"}
+
+def test_unknown_content_type():
+    with pytest.raises(ValueError):
+        codec.decode(b"", "application/x-unknown")
@@ -0,0 +1,183 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from shared import codec, publisher
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.on_message = None
+
+    def queue_declare(self, queue, exclusive=False):
+        return SimpleNamespace(method=SimpleNamespace(queue="amq.gen-replies"))
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self.on_message = on_message_callback
+
+    def basic_publish(self, exchange, routing_key, properties, body):
+        self.connection.published.put((properties.correlation_id, codec.json_codec.decode(body)))
+
+
+class FakeConnection:
+    # Stands in for a pika BlockingConnection, callbacks and replies run on the thread calling process_data_events
+    def __init__(self):
+        self.published = queue.Queue()
+        self.is_open = True
+        self.lost = False
+        self._callbacks = queue.Queue()
+        self._channel = FakeChannel(self)
+
+    def channel(self):
+        return self._channel
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + time_limit
+        while time.monotonic() < deadline:
+            if self.lost:
+                raise pika.exceptions.AMQPConnectionError("connection reset")
+            try:
+                callback = self._callbacks.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            callback()
+
+    def reply(self, corr_id, message):
+        properties = pika.BasicProperties(correlation_id=corr_id)
+        self.add_callback_threadsafe(lambda: self._channel.on_message(self._channel, None, properties, codec.json_codec.encode(message)))
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    connections = []
+
+    def connect(parameters):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(publisher.pika, "BlockingConnection", connect)
+    return connections
+
+
+@pytest.fixture
+def rpc(connections):
+    rpc = publisher.Publisher(host="localhost", timeout=5.0)
+    yield rpc
+    rpc.close()
+
+
+def publish_in_thread(rpc, request_type, data, timeout=None):
+    result = {}
+
+    def run():
+        try:
+            result["reply"] = rpc.publish(request_type, data, timeout)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_replies_out_of_order_reach_their_requests(rpc, connections):
+    first, first_result = publish_in_thread(rpc, "get_sensor", {"sensor_id": 1})
+    second, second_result = publish_in_thread(rpc, "get_sensor", {"sensor_id": 2})
+    sent = {}
+    for _ in range(2):
+        corr_id, request = connections[0].published.get(timeout=2)
+        sent[request["data"]["sensor_id"]] = corr_id
+
+    connections[0].reply(sent[2], {"status_code": 200, "response": "two"})
+    second.join(2)
+    assert second_result == {"reply": {"status_code": 200, "response": "two"}}
+    connections[0].reply(sent[1], {"status_code": 200, "response": "one"})
+    first.join(2)
+    assert first_result == {"reply": {"status_code": 200, "response": "one"}}
+
+
+def test_a_reply_after_the_timeout_is_dropped(rpc, connections):
+    with pytest.raises(TimeoutError):
+        rpc.publish("get_sensor", {"sensor_id": 1}, timeout=0.2)
+    late_corr_id, _ = connections[0].published.get(timeout=2)
+
+    thread, result = publish_in_thread(rpc, "get_sensor", {"sensor_id": 2})
+    corr_id, _ = connections[0].published.get(timeout=2)
+    connections[0].reply(late_corr_id, {"status_code": 200, "response": "late"})
+    connections[0].reply(corr_id, {"status_code": 200, "response": "on time"})
+    thread.join(2)
+    assert result == {"reply": {"status_code": 200, "response": "on time"}}
+    assert rpc._pending == {}
+
+
+def test_pending_requests_fail_when_the_connection_is_lost(rpc, connections):
+    thread, result = publish_in_thread(rpc, "get_sensor", {"sensor_id": 1})
+    connections[0].published.get(timeout=2)
+    connections[0].lost = True
+    thread.join(2)
+    assert isinstance(result["error"], ConnectionError)
+    assert rpc._pending == {}
+
+    # the IO thread reconnects and later requests go through the new connection
+    thread, result = publish_in_thread(rpc, "get_sensor", {"sensor_id": 2})
+    deadline = time.monotonic() + 5
+    while len(connections) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    corr_id, _ = connections[1].published.get(timeout=5)
+    connections[1].reply(corr_id, {"status_code": 200, "response": "two"})
+    thread.join(2)
+    assert result == {"reply": {"status_code": 200, "response": "two"}}
+
+
+class ConfirmingConnection:
+    # basic_publish blocks like a confirmed publish, until every publishing thread is waiting on its own channel
+    barrier = None
+
+    def __init__(self, parameters):
+        self.is_open = True
+        self.published = []
+
+    def channel(self):
+        return self
+
+    def queue_declare(self, queue, durable=False):
+        pass
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory=False):
+        self.barrier.wait(2)
+        self.published.append(codec.decode(body, properties.content_type))
+
+    def close(self):
+        self.is_open = False
+
+
+def test_reading_publishes_of_different_threads_do_not_wait_for_each_other(monkeypatch):
+    monkeypatch.setattr(publisher.pika, "BlockingConnection", ConfirmingConnection)
+    monkeypatch.setattr(ConfirmingConnection, "barrier", threading.Barrier(2))
+    readings = publisher.ReadingPublisher(host="localhost")
+    reading = {"sensor_id": 1, "battery_level": 0.5, "last_seen": "2020-01-01T00:00:00Z"}
+    threads = [threading.Thread(target=readings.publish, args=(reading,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    connections = list(readings._connections)
+    assert len(connections) == 2
+    assert all(len(conn.published) == 1 for conn in connections)
+    readings.close()
+    assert not any(conn.is_open for conn in connections)
@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from shared import codec, subscriber
+
+
+class FakeChannel:
+    # Records the calls made on it, start_consuming hands over the queued deliveries and returns as if stopped
+    def __init__(self):
+        self.calls = []
+        self.deliveries = []
+        self.is_open = True
+        self.on_message = None
+
+    def queue_declare(self, queue, durable=False):
+        pass
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def basic_consume(self, queue, on_message_callback):
+        self.on_message = on_message_callback
+        return "consumer-1"
+
+    def start_consuming(self):
+        for method, properties, body in self.deliveries:
+            self.on_message(self, method, properties, body)
+
+    def basic_cancel(self, consumer_tag):
+        self.calls.append(("cancel", consumer_tag))
+
+    def basic_publish(self, exchange, routing_key, properties, body):
+        self.calls.append(("publish", routing_key, properties.correlation_id, codec.json_codec.decode(body)))
+
+    def basic_ack(self, delivery_tag):
+        self.calls.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+class FakeConnection:
+    def __init__(self, parameters):
+        self.is_open = True
+        self._channel = FakeChannel()
+        self._callbacks = queue.Queue()
+
+    def channel(self):
+        return self._channel
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + time_limit
+        while time.monotonic() < deadline:
+            try:
+                self._callbacks.get(timeout=0.01)()
+            except queue.Empty:
+                pass
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    monkeypatch.setattr(subscriber.pika, "BlockingConnection", FakeConnection)
+    monkeypatch.setattr(subscriber.signal, "signal", lambda signum, handler: None)
+    return subscriber.Subscriber()
+
+
+def delivery(tag, redelivered=False, reply_to="amq.gen-replies"):
+    method = SimpleNamespace(delivery_tag=tag, redelivered=redelivered)
+    return method, pika.BasicProperties(reply_to=reply_to, correlation_id=f"request-{tag}"), b"{}"
+
+
+def test_a_message_is_acked_after_its_reply(consumer):
+    channel = consumer.channel
+    channel.deliveries = [delivery(1)]
+    consumer.consume(lambda body: codec.json_codec.encode({"status_code": 200, "response": "ok"}))
+    assert channel.calls == [("cancel", "consumer-1"),
+                             ("publish", "amq.gen-replies", "request-1", {"status_code": 200, "response": "ok"}),
+                             ("ack", 1)]
+
+
+def test_a_failed_message_is_requeued_once_then_answered_with_an_error(consumer):
+    channel = consumer.channel
+
+    def fail(body):
+        raise RuntimeError("timescale unavailable")
+
+    channel.deliveries = [delivery(1)]
+    consumer.consume(fail)
+    assert channel.calls[1:] == [("nack", 1, True)]
+
+    channel.calls.clear()
+    channel.deliveries = [delivery(2, redelivered=True)]
+    consumer.consume(fail)
+    assert channel.calls[1:] == [("publish", "amq.gen-replies", "request-2", {"status_code": 500, "detail": "timescale unavailable"}),
+                                 ("nack", 2, False)]
+
+
+def test_stopping_waits_for_the_messages_being_handled(consumer):
+    channel = consumer.channel
+    release = threading.Event()
+
+    def slow(body):
+        release.wait(5)
+        return None
+
+    channel.deliveries = [delivery(1), delivery(2)]
+    threading.Timer(0.2, release.set).start()
+    consumer.consume(slow)
+    # deliveries are cancelled first, the messages taken before are still acked
+    assert channel.calls[0] == ("cancel", "consumer-1")
+    assert sorted(channel.calls[1:]) == [("ack", 1), ("ack", 2)]